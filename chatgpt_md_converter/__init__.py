@@ -1,14 +1,28 @@
-from .html_splitter import split_html_for_telegram
-from .html_to_markdown import html_to_telegram_markdown
-from .telegram_entities import (EntityType, TelegramEntity,
+from .html_splitter import (Chunk, iter_split_html_for_telegram,
+                            split_html_chunks_for_telegram,
+                            split_html_for_telegram)
+from .html_to_markdown import (HtmlToMarkdownConverter,
+                               html_to_telegram_markdown)
+from .markdown_splitter import split_markdown_for_telegram
+from .telegram_entities import (EntityType, StreamingEntityFormatter,
+                                TelegramEntity, split_entities_for_telegram,
                                 telegram_format_entities)
 from .telegram_formatter import telegram_format
+from .telegram_markdown import StreamingTelegramFormatter
 
 __all__ = [
     "telegram_format",
+    "StreamingTelegramFormatter",
     "telegram_format_entities",
+    "StreamingEntityFormatter",
     "TelegramEntity",
     "EntityType",
     "split_html_for_telegram",
+    "iter_split_html_for_telegram",
+    "split_html_chunks_for_telegram",
+    "Chunk",
+    "split_entities_for_telegram",
+    "split_markdown_for_telegram",
     "html_to_telegram_markdown",
+    "HtmlToMarkdownConverter",
 ]
@@ -5,8 +5,6 @@ from __future__ import annotations
 import html
 import re
 
-from .tree import Node
-
 _SIMPLE_STAR_ITALIC = re.compile(
     r"(?<!\\)(?<!\*)\*(?=[^\s])([^\*\n]+?)(?<!\s)\*(?![A-Za-z0-9\*])",
 )
@@ -25,23 +23,9 @@ def _canonicalize_star_italics(text: str) -> str:
 def normalise_text(text: str) -> str:
     if not text:
         return ""
-    unescaped = html.unescape(text)
-    return unescaped.replace("\u00a0", " ")
-
-
-def collect_text(node: Node) -> str:
-    if node.kind == "text":
-        return html.unescape(node.text)
-    parts: list[str] = []
-    for child in node.children:
-        if child.kind == "text":
-            parts.append(html.unescape(child.text))
-        elif child.kind == "element":
-            if child.tag.lower() == "br":
-                parts.append("\n")
-            else:
-                parts.append(collect_text(child))
-    return "".join(parts)
+    if "&" in text:
+        text = html.unescape(text)
+    return text.replace("\u00a0", " ")
 
 
 def escape_inline_code(text: str) -> str:
@@ -59,10 +43,87 @@ def escape_link_url(url: str) -> str:
     return url.replace("\\", "\\\\").replace(")", "\\)")
 
 
+class PostProcessor:
+    """Tidy rendered Markdown in one pass over its lines, in pieces if needed.
+
+    A "•" and the whitespace after it at the start of a line become "- ",
+    runs of blank lines collapse to one, carriage returns and trailing
+    whitespace are dropped, simple ``*italic*`` becomes ``_italic_``, and
+    the result is stripped. Rules apply in that order, so a line holding
+    only "•" takes the next line in as its item text, and a line holding
+    only "\\r" or spaces still separates blank-line runs.
+
+    Text may arrive in pieces: :meth:`process` returns the output that is
+    final so far, holding back the unfinished line and any trailing
+    whitespace, and the outputs concatenate to what one call over the
+    whole text returns.
+    """
+
+    def __init__(self) -> None:
+        self._partial = ""
+        self._merge_next = False
+        self._blank_run = False
+        self._has_lines = False
+        self._started = False
+        self._held = ""
+
+    def process(self, text: str, final: bool = False) -> str:
+        """Tidy ``text``; pass ``final=True`` with (or after) the last piece."""
+        source = text.split("\n")
+        if self._partial:
+            source[0] = self._partial + source[0]
+        self._partial = "" if final else source.pop()
+        count = len(source)
+        merge_next = self._merge_next
+        blank_run = self._blank_run
+        has_lines = self._has_lines
+        lines: list[str] = []
+        index = 0
+        while index < count:
+            line = source[index]
+            index += 1
+            if merge_next:
+                line = "- " + line
+                merge_next = False
+            elif line.startswith("•"):
+                if len(line) > 1 and line[1].isspace():
+                    line = "- " + line[2:]
+                elif len(line) == 1 and (index < count or not final):
+                    merge_next = True
+                    continue
+
+            if not line:
+                blank_run = True
+                continue
+            if blank_run:
+                # Leading and trailing blank lines are stripped anyway.
+                if has_lines:
+                    lines.append("")
+                blank_run = False
+
+            if "\r" in line:
+                line = line.replace("\r", "")
+            line = line.rstrip()
+            if "*" in line:
+                line = _canonicalize_star_italics(line)
+            lines.append(line)
+            has_lines = True
+
+        output = "\n".join(lines)
+        if lines and self._has_lines:
+            output = "\n" + output
+        self._merge_next = merge_next
+        self._blank_run = blank_run
+        self._has_lines = has_lines
+
+        if not self._started:
+            output = output.lstrip()
+            self._started = bool(output)
+        output = self._held + output
+        finished = output.rstrip()
+        self._held = "" if final else output[len(finished):]
+        return finished
+
+
 def post_process(markdown: str) -> str:
-    text = re.sub(r"(^|\n)•\s", r"\1- ", markdown)
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    text = text.replace("\r", "")
-    text = "\n".join(line.rstrip() for line in text.split("\n"))
-    text = _canonicalize_star_italics(text)
-    return text.strip()
+    return PostProcessor().process(markdown, final=True)
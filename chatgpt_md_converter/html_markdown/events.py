@@ -0,0 +1,136 @@
+"""Event-driven HTML → Telegram Markdown rendering without a node tree."""
+
+from __future__ import annotations
+
+from html.parser import HTMLParser
+from typing import List, Optional
+
+from .escaping import PostProcessor
+from .handlers import MarkdownBuilder
+
+
+class _MarkdownEmitter(HTMLParser):
+    """Render Markdown while parsing, keeping only the open elements.
+
+    End tags close the nearest open element with the same tag, as in
+    ``_HTMLTreeBuilder``, so unclosed and stray tags resolve the same way;
+    an element is formatted as soon as it closes and only its Markdown is
+    passed on to its parent.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=False)
+        self.builder = MarkdownBuilder()
+
+    def handle_starttag(self, tag: str, attrs: List[tuple[str, Optional[str]]]) -> None:
+        if tag == "br":
+            self.builder.text("\n")
+            return
+        self.builder.start(tag, dict(attrs) if attrs else {})
+
+    def handle_endtag(self, tag: str) -> None:
+        stack = self.builder.stack
+        for index in range(len(stack) - 1, 0, -1):
+            if stack[index].tag == tag:
+                while len(stack) > index:
+                    self.builder.end()
+                return
+
+    def handle_startendtag(self, tag: str, attrs: List[tuple[str, Optional[str]]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag != "br":
+            self.builder.end()
+
+    def handle_data(self, data: str) -> None:
+        if data:
+            self.builder.text(data)
+
+    def handle_entityref(self, name: str) -> None:
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name: str) -> None:
+        self.handle_data(f"&#{name};")
+
+
+def render_html(html_text: str) -> str:
+    """Render HTML to Markdown in one pass, before post-processing."""
+    emitter = _MarkdownEmitter()
+    emitter.feed(html_text)
+    emitter.close()
+    return emitter.builder.result()
+
+
+class _BlockEmitter(_MarkdownEmitter):
+    """Emitter that tidies top-level content as soon as it is finished."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.post_processor = PostProcessor()
+        self.blocks: List[str] = []
+
+    def handle_endtag(self, tag: str) -> None:
+        super().handle_endtag(tag)
+        if len(self.builder.stack) == 1:
+            self.flush()
+
+    def handle_startendtag(self, tag: str, attrs: List[tuple[str, Optional[str]]]) -> None:
+        super().handle_startendtag(tag, attrs)
+        if len(self.builder.stack) == 1:
+            self.flush()
+
+    def flush(self, final: bool = False) -> None:
+        """Pass the finished top-level Markdown on to the post-processor."""
+        root = self.builder.stack[0]
+        if not root.parts and not final:
+            return
+        text = "".join(root.parts)
+        root.parts.clear()
+        block = self.post_processor.process(text, final)
+        if block:
+            self.blocks.append(block)
+
+
+class HtmlToMarkdownConverter:
+    """Convert HTML to Telegram Markdown as it arrives, block by block.
+
+    :meth:`feed` takes the HTML in chunks of any size and returns the
+    Markdown finished so far: one block each time a top-level element
+    closes, plus top-level text. Only the open elements, the unfinished
+    line and the parser's unread tail are kept, so files of any size
+    convert in memory bounded by their largest top-level element. Joined
+    with ``""``, the blocks from :meth:`feed` and :meth:`close` equal
+    :func:`html_to_telegram_markdown` of the whole HTML.
+
+    Example:
+        >>> converter = HtmlToMarkdownConverter()
+        >>> converter.feed("<b>Hello</b>\\n<i>wor")
+        ['**Hello**']
+        >>> converter.feed("ld</i>")
+        []
+        >>> converter.close()
+        ['\\n_world_']
+    """
+
+    def __init__(self) -> None:
+        self._emitter = _BlockEmitter()
+
+    def feed(self, chunk: str) -> List[str]:
+        """Parse ``chunk`` and return the Markdown blocks it finished."""
+        emitter = self._emitter
+        emitter.feed(chunk)
+        emitter.flush()
+        return self._take()
+
+    def close(self) -> List[str]:
+        """Finish the input, closing any open elements, and return the rest."""
+        emitter = self._emitter
+        emitter.close()
+        while len(emitter.builder.stack) > 1:
+            emitter.builder.end()
+        emitter.flush(final=True)
+        return self._take()
+
+    def _take(self) -> List[str]:
+        blocks = self._emitter.blocks
+        self._emitter.blocks = []
+        return blocks
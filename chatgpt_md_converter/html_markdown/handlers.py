@@ -2,15 +2,13 @@
 
 from __future__ import annotations
 
-from typing import Callable, Dict
+import html
+from typing import Callable, Dict, List, Mapping, Optional, Sequence
 
-from .escaping import (collect_text, escape_inline_code, escape_link_label,
-                       escape_link_url, normalise_text)
+from .escaping import (escape_inline_code, escape_link_label, escape_link_url,
+                       normalise_text)
 from .state import RenderState
-from .tree import Node
-
-InlineHandler = Callable[[Node, RenderState], str]
-
+from .tree import Child
 
 _INLINE_MARKERS: Dict[str, tuple[str, str]] = {
     "u": ("__", "__"),
@@ -19,20 +17,109 @@ _INLINE_MARKERS: Dict[str, tuple[str, str]] = {
     "strike": ("~~", "~~"),
     "del": ("~~", "~~"),
 }
+# Elements whose content is copied as raw text instead of being rendered.
+_RAW_TAGS = {"code", "pre"}
+_BOLD_TAGS = {"b", "strong"}
+_ITALIC_TAGS = {"i", "em"}
+_NO_ATTRS: Mapping[str, Optional[str]] = {}
+
+
+class Frame:
+    """An open element: its rendered content so far and the depths inside it."""
+
+    __slots__ = ("tag", "attrs", "parts", "bold_depth", "italic_depth", "raw",
+                 "children", "code_attrs")
+
+    def __init__(
+        self,
+        tag: str,
+        attrs: Mapping[str, Optional[str]],
+        bold_depth: int,
+        italic_depth: int,
+        raw: bool,
+    ) -> None:
+        self.tag = tag
+        self.attrs = attrs
+        self.parts: List[str] = []
+        self.bold_depth = bold_depth
+        self.italic_depth = italic_depth
+        self.raw = raw
+        # A <pre> takes its language from a lone <code> child.
+        self.children = 0
+        self.code_attrs: Optional[Mapping[str, Optional[str]]] = None
+
+
+class MarkdownBuilder:
+    """Render Markdown from ``start``/``text``/``end`` calls.
+
+    Only the open elements are kept, on an explicit stack, so nesting depth
+    is limited by memory rather than by Python's recursion limit. Bold and
+    italic depths are counters on the frames. Elements are finished with
+    the handlers in ``TAG_DISPATCH``.
+    """
+
+    def __init__(self, state: RenderState = RenderState()) -> None:
+        self.stack = [Frame("__root__", _NO_ATTRS, state.bold_depth, state.italic_depth, False)]
+
+    def start(self, tag: str, attrs: Mapping[str, Optional[str]]) -> None:
+        parent = self.stack[-1]
+        lowered = tag.lower()
+        parent.children += 1
+        if parent.children == 1 and lowered == "code":
+            parent.code_attrs = attrs
+
+        bold_depth, italic_depth = parent.bold_depth, parent.italic_depth
+        if not parent.raw:
+            if lowered in _BOLD_TAGS:
+                bold_depth += 1
+            elif lowered in _ITALIC_TAGS:
+                italic_depth += 1
+        self.stack.append(
+            Frame(tag, attrs, bold_depth, italic_depth, parent.raw or lowered in _RAW_TAGS)
+        )
+
+    def text(self, data: str) -> None:
+        frame = self.stack[-1]
+        frame.children += 1
+        frame.parts.append(html.unescape(data) if frame.raw else normalise_text(data))
+
+    def end(self) -> None:
+        """Finish the innermost open element."""
+        frame = self.stack.pop()
+        parent = self.stack[-1]
+        if parent.raw:
+            parent.parts.extend(frame.parts)
+            return
+        handler = TAG_DISPATCH.get(frame.tag.lower())
+        parent.parts.append(handler(frame, parent) if handler else "".join(frame.parts))
+
+    def result(self) -> str:
+        """Finish the elements left open and return the whole Markdown."""
+        while len(self.stack) > 1:
+            self.end()
+        return "".join(self.stack[0].parts)
+
+
+def render_nodes(nodes: Sequence[Child], state: RenderState) -> str:
+    builder = MarkdownBuilder(state)
+    pending = [iter(nodes)]
+    while pending:
+        for node in pending[-1]:
+            if isinstance(node, str):
+                builder.text(node)
+            else:
+                builder.start(node.tag, node.attrs)
+                pending.append(iter(node.children))
+                break
+        else:
+            pending.pop()
+            if pending:
+                builder.end()
+    return builder.result()
 
 
-def render_nodes(nodes: list[Node], state: RenderState) -> str:
-    return "".join(render_node(node, state) for node in nodes)
-
-
-def render_node(node: Node, state: RenderState) -> str:
-    if node.kind == "text":
-        return normalise_text(node.text)
-
-    handler = TAG_DISPATCH.get(node.tag.lower())
-    if handler:
-        return handler(node, state)
-    return render_nodes(node.children, state)
+def render_node(node: Child, state: RenderState) -> str:
+    return render_nodes([node], state)
 
 
 def _split_surrounding_whitespace(text: str) -> tuple[str, str, str]:
@@ -68,12 +155,10 @@ def _italic_boundary_conflict(marker: str, core: str) -> bool:
     return False
 
 
-def _choose_italic_marker(state: RenderState, core: str) -> str:
-    depth = state.italic_depth
-
-    if state.bold_depth > 0 and depth == 0:
+def _choose_italic_marker(bold_depth: int, italic_depth: int, core: str) -> str:
+    if bold_depth > 0 and italic_depth == 0:
         candidates = ["_", "*"]
-    elif depth % 2 == 0:
+    elif italic_depth % 2 == 0:
         candidates = ["*", "_"]
     else:
         candidates = ["_", "*"]
@@ -85,73 +170,61 @@ def _choose_italic_marker(state: RenderState, core: str) -> str:
     return candidates[0]
 
 
-def _handle_bold(node: Node, state: RenderState) -> str:
-    inner_state = state.child(bold_depth=state.bold_depth + 1)
-    inner = render_nodes(node.children, inner_state)
+def _wrap_inline(inner: str, marker_open: str, marker_close: str) -> str:
     leading, core, trailing = _split_surrounding_whitespace(inner)
     if not core:
         return leading + trailing
-    return f"{leading}**{core}**{trailing}"
+    return f"{leading}{marker_open}{core}{marker_close}{trailing}"
 
 
-def _handle_italic(node: Node, state: RenderState) -> str:
-    depth = state.italic_depth
-    inner_state = state.child(italic_depth=depth + 1)
-    inner = render_nodes(node.children, inner_state)
-    leading, core, trailing = _split_surrounding_whitespace(inner)
+# Handlers take the finished element and the frame it is rendered in.
+ElementHandler = Callable[[Frame, Frame], str]
+
+
+def _handle_bold(frame: Frame, parent: Frame) -> str:
+    return _wrap_inline("".join(frame.parts), "**", "**")
+
+
+def _handle_italic(frame: Frame, parent: Frame) -> str:
+    leading, core, trailing = _split_surrounding_whitespace("".join(frame.parts))
     if not core:
         return leading + trailing
-    marker = _choose_italic_marker(state, core)
+    marker = _choose_italic_marker(parent.bold_depth, parent.italic_depth, core)
     return f"{leading}{marker}{core}{marker}{trailing}"
 
 
-def _handle_inline_marker(node: Node, state: RenderState) -> str:
-    marker_open, marker_close = _INLINE_MARKERS[node.tag.lower()]
-    inner = render_nodes(node.children, state)
-    leading, core, trailing = _split_surrounding_whitespace(inner)
-    if not core:
-        return leading + trailing
-    return f"{leading}{marker_open}{core}{marker_close}{trailing}"
+def _handle_inline_marker(frame: Frame, parent: Frame) -> str:
+    marker_open, marker_close = _INLINE_MARKERS[frame.tag.lower()]
+    return _wrap_inline("".join(frame.parts), marker_open, marker_close)
 
 
-def _handle_spoiler(node: Node, state: RenderState) -> str:
-    inner = render_nodes(node.children, state)
-    leading, core, trailing = _split_surrounding_whitespace(inner)
-    if not core:
-        return leading + trailing
-    return f"{leading}||{core}||{trailing}"
+def _handle_spoiler(frame: Frame, parent: Frame) -> str:
+    return _wrap_inline("".join(frame.parts), "||", "||")
 
 
-def _handle_code(node: Node, state: RenderState) -> str:
-    inner = collect_text(node)
-    return f"`{escape_inline_code(inner)}`"
+def _handle_code(frame: Frame, parent: Frame) -> str:
+    return f"`{escape_inline_code(''.join(frame.parts))}`"
 
 
-def _handle_pre(node: Node, state: RenderState) -> str:
-    children = node.children
+def _handle_pre(frame: Frame, parent: Frame) -> str:
     language: str | None = None
-    content_node: Node
-
-    if len(children) == 1 and children[0].kind == "element" and children[0].tag.lower() == "code":
-        content_node = children[0]
-        class_attr = content_node.attrs.get("class") or ""
+    if frame.children == 1 and frame.code_attrs is not None:
+        class_attr = frame.code_attrs.get("class") or ""
         for part in class_attr.split():
             if part.startswith("language-"):
                 language = part.split("-", 1)[1]
                 break
-    else:
-        content_node = Node(kind="element", tag="__virtual__", children=children)
 
-    inner_text = collect_text(content_node)
+    inner_text = "".join(frame.parts)
     fence = f"```{language}" if language else "```"
     if language or "\n" in inner_text:
         return f"{fence}\n{inner_text}```"
     return f"{fence}{inner_text}```"
 
 
-def _handle_link(node: Node, state: RenderState) -> str:
-    href = node.attrs.get("href", "") or ""
-    label = render_nodes(node.children, state)
+def _handle_link(frame: Frame, parent: Frame) -> str:
+    href = frame.attrs.get("href", "") or ""
+    label = "".join(frame.parts)
     if not label:
         label = href
 
@@ -163,10 +236,9 @@ def _handle_link(node: Node, state: RenderState) -> str:
     return f"[{escaped_label}]({escaped_url})"
 
 
-def _handle_blockquote(node: Node, state: RenderState) -> str:
-    inner = render_nodes(node.children, state)
-    lines = inner.split("\n")
-    expandable = "expandable" in node.attrs
+def _handle_blockquote(frame: Frame, parent: Frame) -> str:
+    lines = "".join(frame.parts).split("\n")
+    expandable = "expandable" in frame.attrs
     rendered: list[str] = []
     for index, line in enumerate(lines):
         stripped = line.rstrip("\r")
@@ -179,25 +251,23 @@ def _handle_blockquote(node: Node, state: RenderState) -> str:
     return "\n".join(rendered)
 
 
-def _handle_tg_emoji(node: Node, state: RenderState) -> str:
-    emoji_id = node.attrs.get("emoji-id")
-    label = render_nodes(node.children, state)
+def _handle_tg_emoji(frame: Frame, parent: Frame) -> str:
+    emoji_id = frame.attrs.get("emoji-id")
+    label = "".join(frame.parts)
     if emoji_id:
         href = f"tg://emoji?id={emoji_id}"
         return f"![{escape_link_label(label)}]({href})"
     return label
 
 
-def _handle_span(node: Node, state: RenderState) -> str:
-    classes = (node.attrs.get("class") or "").split()
+def _handle_span(frame: Frame, parent: Frame) -> str:
+    classes = (frame.attrs.get("class") or "").split()
     if any(cls == "tg-spoiler" for cls in classes):
-        return _handle_spoiler(node, state)
-    if any(cls == "tg-emoji" for cls in classes):
-        return render_nodes(node.children, state)
-    return render_nodes(node.children, state)
+        return _handle_spoiler(frame, parent)
+    return "".join(frame.parts)
 
 
-TAG_DISPATCH: Dict[str, Callable[[Node, RenderState], str]] = {
+TAG_DISPATCH: Dict[str, ElementHandler] = {
     "b": _handle_bold,
     "strong": _handle_bold,
     "i": _handle_italic,
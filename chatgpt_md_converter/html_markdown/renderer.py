@@ -5,12 +5,24 @@ from __future__ import annotations
 from typing import List
 
 from .escaping import post_process
+from .events import render_html
 from .handlers import render_nodes
 from .state import RenderState
-from .tree import Node, build_tree
+from .tree import Child, build_flat_tree, build_tree
 
 
 def html_to_telegram_markdown(html_text: str) -> str:
-    nodes: List[Node] = build_tree(html_text)
+    return post_process(render_html(html_text))
+
+
+def html_tree_to_telegram_markdown(html_text: str) -> str:
+    """Render through an explicit node tree; same output, more memory."""
+    nodes: List[Child] = build_tree(html_text)
     markdown = render_nodes(nodes, RenderState())
     return post_process(markdown)
+
+
+def html_flat_tree_to_telegram_markdown(html_text: str) -> str:
+    """Render through a :class:`~.tree.FlatTree`; same output, smaller tree."""
+    markdown = render_nodes(build_flat_tree(html_text).roots(), RenderState())
+    return post_process(markdown)
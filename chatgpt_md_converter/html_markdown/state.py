@@ -10,7 +10,3 @@ class RenderState:
     bold_depth: int = 0
     italic_depth: int = 0
 
-    def child(self, **updates: int) -> "RenderState":
-        data = {"bold_depth": self.bold_depth, "italic_depth": self.italic_depth}
-        data.update(updates)
-        return RenderState(**data)
@@ -2,18 +2,52 @@
 
 from __future__ import annotations
 
-from dataclasses import dataclass, field
+from array import array
 from html.parser import HTMLParser
-from typing import Dict, List, Optional
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Sequence, Union
+
+_NO_ATTRS: Mapping[str, Optional[str]] = MappingProxyType({})
 
 
-@dataclass
 class Node:
-    kind: str  # "text" or "element"
-    text: str = ""
-    tag: str = ""
-    attrs: Dict[str, Optional[str]] = field(default_factory=dict)
-    children: List["Node"] = field(default_factory=list)
+    """An element. Text children are plain ``str``.
+
+    ``attrs`` and ``children`` are only allocated for elements that have
+    them; until then they read as an empty mapping and an empty tuple.
+    """
+
+    __slots__ = ("tag", "_attrs", "_children")
+
+    def __init__(
+        self,
+        tag: str,
+        attrs: Optional[Dict[str, Optional[str]]] = None,
+        children: Optional[List[Child]] = None,
+    ) -> None:
+        self.tag = tag
+        self._attrs = attrs or None
+        self._children = children or None
+
+    @property
+    def attrs(self) -> Mapping[str, Optional[str]]:
+        return self._attrs if self._attrs is not None else _NO_ATTRS
+
+    @property
+    def children(self) -> Sequence[Child]:
+        return self._children if self._children is not None else ()
+
+    def append(self, child: Child) -> None:
+        if self._children is None:
+            self._children = [child]
+        else:
+            self._children.append(child)
+
+    def __repr__(self) -> str:
+        return f"Node(tag={self.tag!r}, attrs={dict(self.attrs)!r}, children={list(self.children)!r})"
+
+
+Child = Union[str, Node]
 
 
 class _HTMLTreeBuilder(HTMLParser):
@@ -21,16 +55,16 @@ class _HTMLTreeBuilder(HTMLParser):
 
     def __init__(self) -> None:
         super().__init__(convert_charrefs=False)
-        self.root = Node(kind="element", tag="__root__")
+        self.root = Node("__root__")
         self._stack: List[Node] = [self.root]
 
     def handle_starttag(self, tag: str, attrs: List[tuple[str, Optional[str]]]) -> None:
         if tag in self.SELF_CLOSING_TAGS:
             if tag == "br":
-                self._stack[-1].children.append(Node(kind="text", text="\n"))
+                self._stack[-1].append("\n")
             return
-        node = Node(kind="element", tag=tag, attrs=dict(attrs))
-        self._stack[-1].children.append(node)
+        node = Node(tag, dict(attrs) if attrs else None)
+        self._stack[-1].append(node)
         self._stack.append(node)
 
     def handle_endtag(self, tag: str) -> None:
@@ -43,12 +77,11 @@ class _HTMLTreeBuilder(HTMLParser):
         if tag in self.SELF_CLOSING_TAGS:
             self.handle_starttag(tag, attrs)
             return
-        node = Node(kind="element", tag=tag, attrs=dict(attrs))
-        self._stack[-1].children.append(node)
+        self._stack[-1].append(Node(tag, dict(attrs) if attrs else None))
 
     def handle_data(self, data: str) -> None:
         if data:
-            self._stack[-1].children.append(Node(kind="text", text=data))
+            self._stack[-1].append(data)
 
     def handle_entityref(self, name: str) -> None:
         self.handle_data(f"&{name};")
@@ -57,9 +90,133 @@ class _HTMLTreeBuilder(HTMLParser):
         self.handle_data(f"&#{name};")
 
 
-def build_tree(html_text: str) -> List[Node]:
+def build_tree(html_text: str) -> List[Child]:
     """Parse HTML and return the list of top-level nodes."""
     builder = _HTMLTreeBuilder()
     builder.feed(html_text)
     builder.close()
-    return builder.root.children
+    return list(builder.root.children)
+
+
+class FlatTree:
+    """A parsed fragment stored as flat arrays in document order.
+
+    ``items[i]`` is the text of a text node or the tag of an element, and
+    ``ends[i]`` is one past the last descendant of element ``i`` (0 for
+    text), so every subtree is the slice ``i + 1:ends[i]``. Attributes are
+    kept only for elements that have any. Nothing is allocated per node
+    beyond the list and array slots; :meth:`roots` hands out
+    :class:`FlatNode` views that the ``TAG_DISPATCH`` handlers render like
+    :class:`Node`.
+    """
+
+    __slots__ = ("items", "ends", "attrs")
+
+    def __init__(self) -> None:
+        self.items: List[str] = []
+        self.ends = array("l")
+        self.attrs: Dict[int, Dict[str, Optional[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def children(self, index: int) -> List[Child]:
+        """Children of element ``index``; ``-1`` for the top level."""
+        result: List[Child] = []
+        position = index + 1
+        end = len(self.items) if index < 0 else self.ends[index]
+        items, ends = self.items, self.ends
+        while position < end:
+            child_end = ends[position]
+            if child_end:
+                result.append(FlatNode(self, position))
+                position = child_end
+            else:
+                result.append(items[position])
+                position += 1
+        return result
+
+    def roots(self) -> List[Child]:
+        return self.children(-1)
+
+
+class FlatNode:
+    """View of one element of a :class:`FlatTree`, shaped like :class:`Node`."""
+
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree: FlatTree, index: int) -> None:
+        self.tree = tree
+        self.index = index
+
+    @property
+    def tag(self) -> str:
+        return self.tree.items[self.index]
+
+    @property
+    def attrs(self) -> Mapping[str, Optional[str]]:
+        return self.tree.attrs.get(self.index, _NO_ATTRS)
+
+    @property
+    def children(self) -> List[Child]:
+        return self.tree.children(self.index)
+
+
+class _FlatTreeBuilder(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=False)
+        self.tree = FlatTree()
+        self._open: List[int] = []
+
+    def handle_starttag(self, tag: str, attrs: List[tuple[str, Optional[str]]]) -> None:
+        if tag == "br":
+            self.handle_data("\n")
+            return
+        tree = self.tree
+        index = len(tree.items)
+        tree.items.append(tag)
+        tree.ends.append(index + 1)
+        if attrs:
+            tree.attrs[index] = dict(attrs)
+        self._open.append(index)
+
+    def handle_endtag(self, tag: str) -> None:
+        items = self.tree.items
+        for position in range(len(self._open) - 1, -1, -1):
+            if items[self._open[position]] == tag:
+                self._close(position)
+                return
+
+    def handle_startendtag(self, tag: str, attrs: List[tuple[str, Optional[str]]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag != "br":
+            self._open.pop()
+
+    def handle_data(self, data: str) -> None:
+        if data:
+            self.tree.items.append(data)
+            self.tree.ends.append(0)
+
+    def handle_entityref(self, name: str) -> None:
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name: str) -> None:
+        self.handle_data(f"&#{name};")
+
+    def finish(self) -> FlatTree:
+        self._close(0)
+        return self.tree
+
+    def _close(self, position: int) -> None:
+        end = len(self.tree.items)
+        for index in self._open[position:]:
+            self.tree.ends[index] = end
+        del self._open[position:]
+
+
+def build_flat_tree(html_text: str) -> FlatTree:
+    """Parse HTML into a :class:`FlatTree`, the compact alternative to :func:`build_tree`."""
+    builder = _FlatTreeBuilder()
+    builder.feed(html_text)
+    builder.close()
+    return builder.finish()
@@ -1,99 +1,351 @@
 import re
-from html.parser import HTMLParser
+from collections import deque
+from functools import lru_cache
+from html import escape, unescape
+from typing import Iterator
+
+from .telegram_entities.utf16 import utf16_len
 
 MAX_LENGTH = 4096
 MIN_LENGTH = 500
+# "html" counts raw markup; "telegram" counts visible text in UTF-16 units,
+# the way Telegram applies its limit after parsing the HTML.
+_LENGTH_MODES = ("html", "telegram")
+# "greedy" fills each chunk in turn; "optimal" searches all break points.
+_PACKINGS = ("greedy", "optimal")
+
+
+# Tags Telegram understands, with their aliases; everything else is text.
+_TRACKED_TAGS = frozenset((
+    "b", "i", "u", "s", "code", "pre", "a", "span", "blockquote",
+    "strong", "em", "ins", "strike", "del", "tg-spoiler", "tg-emoji",
+))
+
+# Attribute text of a tag: quotes only delimit values that follow "=".
+_ATTRS = r"""(?:[^>"'=]|=\s*"[^"]*"|=\s*'[^']*'|=(?!\s*["'])|["'])*"""
+# A complete tag, comment or declaration, or the start of one that runs
+# to the end of the data fed so far (kept until the rest arrives).
+_TAG_RE = re.compile(
+    rf"""<(?:
+        (?P<name>[a-zA-Z][^\t\n\r\f />\x00]*)(?P<attrs>{_ATTRS})>
+      | /(?P<end>[a-zA-Z][^\t\n\r\f />\x00]*)[^>]*>
+      | !--[\s\S]*?-->
+      | [!?/][^>]*>
+      | (?P<partial>(?:
+            !--(?:(?!-->)[\s\S])*
+          | [a-zA-Z]{_ATTRS}(?:=\s*(?:"[^"]*|'[^']*))?
+          | [!?/][^>]*
+        )?)\Z
+    )""",
+    re.VERBOSE,
+)
+_ATTR_RE = re.compile(
+    r"""([^\s/>"'=][^\s/>=]*)(?:\s*=+\s*('[^']*'|"[^"]*"|(?!['"])[^>\s]*))?"""
+)
+
+
+class HTMLTagTracker:
+    """Track which Telegram tags are open in HTML fed piece by piece.
+
+    Only the tags Telegram supports are tracked, so a single regex pass
+    over each piece replaces a general HTML parser. A tag cut off at the
+    end of a piece is kept until the rest arrives. The rendered length of
+    the tags to reopen and close is kept as running counters; with
+    ``count_visible`` so is the visible length of the text outside tags, in
+    UTF-16 units.
+    """
 
-
-class HTMLTagTracker(HTMLParser):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, count_visible: bool = False):
+        self.count_visible = count_visible
         self.open_tags = []
+        self._open_html = []
+        self._pending = ""
+        self.open_tags_length = 0
+        self.closing_tags_length = 0
+        self.visible_length = 0
+
+    def feed(self, data: str) -> None:
+        """Scan ``data``, continuing any tag cut off by the previous piece."""
+        if self._pending:
+            data = self._pending + data
+            self._pending = ""
+        count_visible = self.count_visible
+        position = 0
+        for match in _TAG_RE.finditer(data):
+            if count_visible and match.start() > position:
+                self.visible_length += _visible_length(data[position:match.start()])
+            position = match.end()
+            kind = match.lastgroup
+            if kind == "attrs":
+                name = match.group("name").lower()
+                if name in _TRACKED_TAGS:
+                    self._open(name, match.group("attrs"))
+            elif kind == "end":
+                self._close(match.group("end").lower())
+            elif kind == "partial":
+                self._pending = match.group()
+        if count_visible and position < len(data):
+            self.visible_length += _visible_length(data[position:])
+
+    def copy(self) -> "HTMLTagTracker":
+        """Return an independent tracker in the same scanning state."""
+        clone = HTMLTagTracker(self.count_visible)
+        clone.open_tags = list(self.open_tags)
+        clone._open_html = list(self._open_html)
+        clone._pending = self._pending
+        clone.open_tags_length = self.open_tags_length
+        clone.closing_tags_length = self.closing_tags_length
+        clone.visible_length = self.visible_length
+        return clone
 
-    def handle_starttag(self, tag, attrs):
-        # saving tags
-        if tag in (
-                  "b", "i", "u", "s", "code", "pre", "a", "span", "blockquote",
-                  "strong", "em", "ins", "strike", "del", "tg-spoiler", "tg-emoji"
-                  ):
-            self.open_tags.append((tag, attrs))
+    def get_open_tags_html(self):
+        return "".join(self._open_html)
+
+    def get_closing_tags_html(self):
+        return "".join(f"</{tag}>" for tag, _ in reversed(self.open_tags))
 
-    def handle_endtag(self, tag):
+    def _open(self, tag: str, attr_text: str) -> None:
+        parsed = _parse_start_tag(tag, attr_text)
+        if parsed is None:
+            return  # <tag/> opens and closes at once
+        attrs, html = parsed
+        self.open_tags.append((tag, list(attrs)))
+        self._open_html.append(html)
+        self.open_tags_length += len(html)
+        self.closing_tags_length += len(tag) + 3
+
+    def _close(self, tag: str) -> None:
         for i in range(len(self.open_tags) - 1, -1, -1):
             if self.open_tags[i][0] == tag:
+                self.open_tags_length -= len(self._open_html[i])
+                self.closing_tags_length -= len(tag) + 3
                 del self.open_tags[i]
+                del self._open_html[i]
                 break
 
-    def get_open_tags_html(self):
-        parts = []
-        for tag, attrs in self.open_tags:
-            attr_str = ""
-            if attrs:
-                attr_str = " " + " ".join(f'{k}="{v}"' for k, v in attrs)
-            parts.append(f"<{tag}{attr_str}>")
-        return "".join(parts)
 
-    def get_closing_tags_html(self):
-        return "".join(f"</{tag}>" for tag, _ in reversed(self.open_tags))
+def _visible_length(text: str) -> int:
+    """UTF-16 length of text between tags once Telegram decodes its entities.
+
+    An entity cut between two pieces is counted as raw text, which can only
+    overestimate.
+    """
+    if "&" in text:
+        text = unescape(text)
+    return utf16_len(text)
+
+
+@lru_cache(maxsize=1024)
+def _parse_start_tag(tag: str, attr_text: str):
+    """Return ``(attrs, reopening_html)``, or None for a self-closing tag."""
+    if not attr_text:
+        return (), f"<{tag}>"
+    attrs = []
+    consumed = 0
+    for match in _ATTR_RE.finditer(attr_text):
+        value = match.group(2)
+        if value is not None:
+            if value[:1] == value[-1:] and value[:1] in ("'", '"'):
+                value = value[1:-1]
+            value = unescape(value)
+        attrs.append((match.group(1).lower(), value))
+        consumed = match.end()
+    if attr_text[consumed:].rstrip().endswith("/"):
+        return None
+    return tuple(attrs), _open_tag_html(tag, attrs)
+
+
+def _open_tag_html(tag, attrs) -> str:
+    """Render an opening tag; bare attributes stay bare, values are escaped."""
+    attr_str = "".join(
+        f" {k}" if v is None else f' {k}="{_escape_attr(v)}"' for k, v in attrs
+    )
+    return f"<{tag}{attr_str}>"
+
+
+def _escape_attr(value: str) -> str:
+    return escape(value, quote=False).replace('"', "&quot;")
 
 
 def split_pre_block(pre_block: str, max_length) -> list[str]:
     """
-    Splits long HTML-formatted text into chunks suitable for sending via Telegram,
-    preserving valid HTML tag nesting and handling <pre>/<code> blocks separately.
+    Splits a ``<pre>`` or ``<pre><code ...>`` block into chunks of at most
+    ``max_length`` characters, each wrapped in the block's own tags.
 
     Args:
-        text (str): The input HTML-formatted string.
-        trim_leading_newlines (bool): If True, removes leading newline characters (`\\n`)
-            from each resulting chunk before sending. This is useful to avoid
-            unnecessary blank space at the beginning of messages in Telegram.
+        pre_block (str): The whole block, from ``<pre>`` to ``</pre>``.
+        max_length (int): Maximum length of a chunk, wrapper tags included.
 
     Returns:
-        list[str]: A list of HTML-formatted message chunks, each within Telegram's length limit.
+        list[str]: The wrapped chunks, in order.
     """
+    return list(iter_pre_block_chunks(pre_block, max_length))
+
+
+def iter_pre_block_chunks(pre_block: str, max_length) -> Iterator[str]:
+    """Yield the chunks of :func:`split_pre_block` one at a time.
+
+    Lines are kept whole when they fit. A line longer than a chunk, such as
+    minified JSON or base64, is cut where the chunk is full, but never inside
+    an entity like ``&amp;``. Every chunk reopens the original tags, so the
+    ``class="language-..."`` attribute survives each cut.
+    """
+    return _iter_pre_chunks(pre_block, max_length)
+
+
+def _iter_pre_chunks(pre_block: str, max_length, first_length=None) -> Iterator[str]:
+    """:func:`iter_pre_block_chunks` with the first chunk at most ``first_length`` long.
+
+    The first chunk is left out when nothing fits in it.
+    """
+    opening, closing = _pre_tags(pre_block)
+    full_room = max_length - len(opening) - len(closing)
+    if full_room <= 0:
+        raise ValueError("unable to split content within max_length")
+    room = full_room
+    if first_length is not None:
+        room = min(max(first_length - len(opening) - len(closing), 0), full_room)
+
+    buf = ""
+    position = len(opening)
+    end = len(pre_block) - len(closing)
+    while position < end:
+        newline = pre_block.find("\n", position, end)
+        line_end = end if newline == -1 else newline + 1
+        line = pre_block[position:line_end]
+        position = line_end
+        while len(buf) + len(line) > room:
+            cut = 0
+            if len(line) > full_room:
+                # A line longer than a chunk is cut anyway, so it first
+                # fills the rest of this one.
+                cut = _entity_safe_cut(line, room - len(buf))
+                if cut > room - len(buf):
+                    # An entity at the start of the line does not fit here.
+                    cut = 0
+            if buf or cut:
+                yield opening + buf + line[:cut] + closing
+            buf = ""
+            line = line[cut:]
+            room = full_room
+        buf += line
+    if buf:
+        yield opening + buf + closing
+
+
+def _has_line_longer_than(text: str, size: int) -> bool:
+    return any(len(line) > size for line in text.split("\n"))
+
+
+def _pre_tags(pre_block: str) -> tuple[str, str]:
+    """Opening and closing tags that wrap the lines of a ``<pre>`` block."""
+    if pre_block.startswith("<pre><code") and pre_block.endswith("</code></pre>"):
+        return pre_block[:pre_block.index(">", 10) + 1], "</code></pre>"
+    return "<pre>", "</pre>"
+
+
+def _entity_safe_cut(text: str, size: int) -> int:
+    """Largest cut of ``text`` at or before ``size`` that keeps entities whole.
+
+    An entity that starts ``text`` and runs past ``size`` is kept whole, so
+    the cut then falls after its ``;``.
+    """
+    amp = text.rfind("&", max(size - _LONGEST_ENTITY, 0), size)
+    if amp >= 0 and ";" not in text[amp:size]:
+        match = _ENTITY_RE.match(text, amp)
+        if match:
+            return amp if amp > 0 else match.end()
+    return size
+
+
+def _is_only_tags(block: str, start: int = 0) -> bool:
+    return bool(_ONLY_TAGS_RE.fullmatch(block, start))
+
+
+_ONLY_TAGS_RE = re.compile(r'(?:\s*<[^>]+>\s*)+')
+
+
+# Character references, and the longest one worth looking back for at a cut.
+_ENTITY_RE = re.compile(r"&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);")
+_LONGEST_ENTITY = 32
+
+
+def _iter_split(pattern: re.Pattern, text: str):
+    """Lazy ``pattern.split(text)`` for a pattern with one capturing group around the whole match."""
+    position = 0
+    for match in pattern.finditer(text):
+        yield text[position:match.start()]
+        yield match.group(0)
+        position = match.end()
+    yield text[position:]
+
+
+def _split_work(pattern: re.Pattern, text: str, base: int):
+    """Work items for the non-empty parts of ``text``, which starts at offset ``base``."""
+    for part in _iter_split(pattern, text):
+        if part:
+            yield part, 0, None, base
+            base += len(part)
+
+
+_PRE_RE = re.compile(r"(<pre>.*?</pre>|<pre><code.*?</code></pre>)", re.DOTALL)
+_BLOCK_RE = re.compile(r"(\n\s*\n|<br\s*/?>|\n)")
+_WHITESPACE_SPLIT_RE = re.compile(r"(\\s+)")
+_TAG_SPLIT_RE = re.compile(r"(<[^>]+>)")
+
+
+class Chunk:
+    """A chunk of :func:`split_html_chunks_for_telegram` and what the split knows about it.
 
-    # language-aware: <pre><code class="language-python">...</code></pre>
-    match = re.match(r"<pre><code(.*?)>(.*)</code></pre>", pre_block, re.DOTALL)
-    if match:
-        attr, content = match.groups()
-        lines = content.splitlines(keepends=True)
-        chunks, buf = [], ""
-        overhead = len(f"<pre><code{attr}></code></pre>")
-        for line in lines:
-            if len(buf) + len(line) + overhead > max_length:
-                chunks.append(f"<pre><code{attr}>{buf}</code></pre>")
-                buf = ""
-            buf += line
-        if buf:
-            chunks.append(f"<pre><code{attr}>{buf}</code></pre>")
-        return chunks
-    else:
-        # regular <pre>...</pre>
-        inner = pre_block[5:-6]
-        lines = inner.splitlines(keepends=True)
-        chunks, buf = [], ""
-        overhead = len('<pre></pre>')
-        for line in lines:
-            if len(buf) + len(line) + overhead > max_length:
-                chunks.append(f"<pre>{buf}</pre>")
-                buf = ""
-            buf += line
-        if buf:
-            chunks.append(f"<pre>{buf}</pre>")
-        return chunks
-
-
-def _is_only_tags(block: str) -> bool:
-    return bool(re.fullmatch(r'(?:\s*<[^>]+>\s*)+', block))
-
-
-def _effective_length(content: str) -> int:
-    tracker = HTMLTagTracker()
-    tracker.feed(content)
-    return len(tracker.get_open_tags_html()) + len(content) + len(tracker.get_closing_tags_html())
-
-
-def split_html_for_telegram(text: str, trim_empty_leading_lines: bool = False, max_length: int = MAX_LENGTH) -> list[str]:
+    Attributes
+    ----------
+    html: str
+        The chunk itself, as :func:`split_html_for_telegram` returns it.
+    visible_length: int
+        Length of the text Telegram shows, in UTF-16 code units, after
+        entities such as ``&amp;`` are decoded.
+    raw_length: int
+        Length of ``html``.
+    reopened_tags: str
+        Tags reopened at the start of the chunk because they were still open
+        where the previous chunk was cut; empty when nothing was open.
+    source_start, source_end: int
+        Range of the input text the chunk was cut from. Text the split
+        drops, such as the newlines removed by ``trim_empty_leading_lines``,
+        can fall outside every range.
+    """
+
+    __slots__ = ("html", "visible_length", "raw_length", "reopened_tags", "source_start", "source_end")
+
+    def __init__(self, html: str, visible_length: int, raw_length: int, reopened_tags: str,
+                 source_start: int, source_end: int):
+        self.html = html
+        self.visible_length = visible_length
+        self.raw_length = raw_length
+        self.reopened_tags = reopened_tags
+        self.source_start = source_start
+        self.source_end = source_end
+
+    def __repr__(self) -> str:
+        return (f"Chunk(html={self.html!r}, visible_length={self.visible_length}, "
+                f"raw_length={self.raw_length}, reopened_tags={self.reopened_tags!r}, "
+                f"source_start={self.source_start}, source_end={self.source_end})")
+
+
+def _strip_leading_newlines(chunk: Chunk, count_visible: bool) -> int:
+    """Drop the newlines ``chunk`` starts with and return how many there were."""
+    html = chunk.html.lstrip("\n")
+    stripped = len(chunk.html) - len(html)
+    chunk.html = html
+    chunk.raw_length -= stripped
+    if count_visible:
+        chunk.visible_length -= stripped
+    chunk.source_start += stripped
+    return stripped
+
+
+def split_html_for_telegram(text: str, trim_empty_leading_lines: bool = False, max_length: int = MAX_LENGTH,
+                            length_mode: str = "html", packing: str = "greedy") -> list[str]:
     """Split long HTML-formatted text into Telegram-compatible chunks.
 
     Parameters
@@ -101,139 +353,466 @@ def split_html_for_telegram(text: str, trim_empty_leading_lines: bool = False, m
     text: str
         Input HTML text.
     trim_empty_leading_lines: bool, optional
-        If True, removes `\n` sybmols from start of chunks.
+        If True, removes `\\n` sybmols from start of chunks.
     max_length: int, optional
         Maximum allowed length for a single chunk (must be >= ``MIN_LENGTH = 500``).
         Default = 4096 (symbols)
+    length_mode: str, optional
+        ``"html"`` (default) counts every character of the chunk, markup
+        included. ``"telegram"`` counts only the visible text in UTF-16 code
+        units, after entities such as ``&amp;`` are decoded, which is what
+        Telegram limits; chunks then hold more text when the markup is heavy
+        and never overflow on emoji.
+    packing: str, optional
+        ``"greedy"`` (default) fills chunks one after another and merges
+        neighbours that fit together. ``"optimal"`` chooses among all
+        paragraph, line, sentence and word breaks the split with the fewest
+        chunks, then the least markup spent closing and reopening tags, then
+        the most natural breaks. It never returns more chunks than
+        ``"greedy"``: when the greedy split is shorter, that one is returned.
 
     Returns
     -------
     list[str]
         List of HTML chunks.
     """
+    return list(iter_split_html_for_telegram(text, trim_empty_leading_lines, max_length, length_mode, packing))
 
-    if max_length < MIN_LENGTH:
-        raise ValueError("max_length should be at least %d" % MIN_LENGTH)
 
-    pattern = re.compile(r"(<pre>.*?</pre>|<pre><code.*?</code></pre>)", re.DOTALL)
-    parts = pattern.split(text)
+def iter_split_html_for_telegram(text: str, trim_empty_leading_lines: bool = False, max_length: int = MAX_LENGTH,
+                                 length_mode: str = "html", packing: str = "greedy") -> Iterator[str]:
+    """Yield the chunks of :func:`split_html_for_telegram` one at a time.
+
+    A chunk is yielded as soon as the next one can no longer be merged into
+    it, so the first message can be sent while the rest of ``text`` is still
+    being split. Only the chunk being built and the one waiting to be merged
+    are held in memory.
+
+    Parameters are the same as for :func:`split_html_for_telegram`; an invalid
+    ``max_length``, ``length_mode`` or ``packing`` raises ``ValueError``
+    immediately, not on the first ``next()``. ``packing="optimal"`` has to see
+    the whole text before it yields the first chunk.
+    """
+    chunks = _split_chunks(text, trim_empty_leading_lines, max_length, length_mode, packing, False)
+    return (chunk.html for chunk in chunks)
+
+
+def split_html_chunks_for_telegram(text: str, trim_empty_leading_lines: bool = False,
+                                   max_length: int = MAX_LENGTH, length_mode: str = "html",
+                                   packing: str = "greedy") -> list[Chunk]:
+    """Split like :func:`split_html_for_telegram`, returning :class:`Chunk` objects.
+
+    The ``html`` of each chunk is the string :func:`split_html_for_telegram`
+    returns. Its lengths, reopened tags and source range are collected while
+    splitting, so a chunk does not have to be parsed again before sending.
 
-    chunks: list[str] = []
+    Parameters are the same as for :func:`split_html_for_telegram`.
+
+    Returns
+    -------
+    list[Chunk]
+        List of chunks with their metadata.
+    """
+    return list(_split_chunks(text, trim_empty_leading_lines, max_length, length_mode, packing, True))
+
+
+def _split_chunks(text: str, trim_empty_leading_lines: bool, max_length: int, length_mode: str,
+                  packing: str, count_visible: bool) -> Iterator[Chunk]:
+    if max_length < MIN_LENGTH:
+        raise ValueError("max_length should be at least %d" % MIN_LENGTH)
+    if length_mode not in _LENGTH_MODES:
+        raise ValueError(f"unknown length_mode {length_mode!r}, expected one of {_LENGTH_MODES}")
+    if packing not in _PACKINGS:
+        raise ValueError(f"unknown packing {packing!r}, expected one of {_PACKINGS}")
+    visible = length_mode == "telegram"
+    if packing == "optimal":
+        return _iter_optimal_chunks(text, trim_empty_leading_lines, max_length, visible, count_visible)
+    return _iter_chunks(text, trim_empty_leading_lines, max_length, visible, count_visible)
+
+
+def _iter_chunks(text: str, trim_empty_leading_lines: bool, max_length: int, visible: bool,
+                 count_visible: bool) -> Iterator[Chunk]:
+    count_visible = count_visible or visible
+    # Chunks finished by the last piece, waiting for the merge step.
+    ready: list[Chunk] = []
     prefix = ""
-    current = ""
-    whitespace_re = re.compile(r"(\\s+)")
-    tag_re = re.compile(r"(<[^>]+>)")
+    current: list[str] = []
+    # Running state of prefix + current: its length and a tracker fed with
+    # exactly that text, so each candidate piece is parsed on its own.
+    length = 0
+    tracker = HTMLTagTracker(count_visible)
+    # Where the piece being placed comes from: piece[skip:] is text[body_start:]
+    # and the whole piece ends at text[source_end]. Committed text reaches
+    # source_reached; the chunk being built started at chunk_start.
+    body_start = skip = source_end = piece_length = 0
+    source_reached = chunk_start = 0
+
+    def measure(piece: str) -> tuple[int, HTMLTagTracker]:
+        """Chunk length with ``piece`` appended and closed, and the tracker after it."""
+        candidate = tracker.copy()
+        candidate.feed(piece)
+        if visible:
+            return candidate.visible_length, candidate
+        size = (candidate.open_tags_length + length + len(piece)
+                + candidate.closing_tags_length)
+        return size, candidate
+
+    def commit(piece: str, fed: HTMLTagTracker, reached: int):
+        """Append ``piece``, which ends at offset ``reached`` of the piece being placed."""
+        nonlocal length, tracker, source_reached
+        current.append(piece)
+        length += len(piece)
+        tracker = fed
+        if reached >= piece_length:
+            source_reached = source_end
+        else:
+            # Tags repeated around the lines of a long <pre> map to their ends.
+            source_reached = min(body_start + max(reached - skip, 0), source_end)
 
     def finalize():
-        nonlocal current, prefix
-        tracker = HTMLTagTracker()
-        tracker.feed(prefix + current)
-        chunk = prefix + current + tracker.get_closing_tags_html()
-        chunks.append(chunk)
+        nonlocal current, prefix, length, tracker, chunk_start
+        html = prefix + "".join(current) + tracker.get_closing_tags_html()
+        visible_length = tracker.visible_length
+        if count_visible and tracker._pending:
+            # A tag cut off by the split is sent as text, before the closing tags.
+            committed = HTMLTagTracker(True)
+            committed.feed(html)
+            visible_length = committed.visible_length
+        ready.append(Chunk(html, visible_length, len(html), prefix, chunk_start, source_reached))
+        chunk_start = source_reached
         prefix = tracker.get_open_tags_html()
-        current = ""
-
-    def append_piece(piece: str):
-        nonlocal current, prefix
-
-        def split_on_whitespace(chunk: str) -> list[str] | None:
-            parts = [part for part in whitespace_re.split(chunk) if part]
-            if len(parts) <= 1:
-                return None
-            return parts
-
-        def split_on_tags(chunk: str) -> list[str] | None:
-            parts = [part for part in tag_re.split(chunk) if part]
-            if len(parts) <= 1:
-                return None
-            return parts
-
-        def fittable_prefix_length(chunk: str) -> int:
-            low, high = 1, len(chunk)
-            best = 0
-            while low <= high:
-                mid = (low + high) // 2
-                candidate = chunk[:mid]
-                if _effective_length(prefix + current + candidate) <= max_length:
-                    best = mid
-                    low = mid + 1
-                else:
-                    high = mid - 1
-            return best
-
-        while piece:
-            if _effective_length(prefix + current + piece) <= max_length:
-                current += piece
-                return
-
-            if len(piece) > max_length:
-                if _is_only_tags(piece):
-                    raise ValueError("block contains only html tags")
-                splitted = split_on_whitespace(piece)
-                if splitted:
-                    for part in splitted:
-                        append_piece(part)
-                    return
-                tag_split = split_on_tags(piece)
-                if tag_split:
-                    for part in tag_split:
-                        append_piece(part)
-                    return
-            elif current:
-                finalize()
+        current = []
+        length = len(prefix)
+        tracker = HTMLTagTracker(count_visible)
+        tracker.feed(prefix)
+
+    def piece_size(piece: str) -> int:
+        """Size of ``piece`` on its own, in the chunk's length mode."""
+        if not visible:
+            return len(piece)
+        fed = HTMLTagTracker(visible)
+        fed.feed(piece)
+        return fed.visible_length
+
+    def size_floor(piece: str, remaining: int) -> int:
+        """Lower bound of ``piece_size`` for the last ``remaining`` characters of ``piece``."""
+        if not visible or ("<" not in piece and "&" not in piece):
+            return remaining
+        return 0
+
+    def fittable_prefix(piece: str, start: int, floor: int) -> tuple[int, HTMLTagTracker | None]:
+        """Longest prefix of ``piece[start:]`` that still fits, by binary search."""
+        # A prefix longer than this cannot fit; its step of the search is
+        # known to fail and is skipped, so the search visits the same prefixes.
+        if not visible:
+            cap = max_length - length
+        elif floor and not tracker._pending:
+            cap = max_length - tracker.visible_length
+        else:
+            cap = len(piece) - start
+        low, high = 1, len(piece) - start
+        best, best_tracker = 0, None
+        while low <= high:
+            mid = (low + high) // 2
+            if mid > cap:
+                high = mid - 1
                 continue
+            size, fed = measure(piece[start:start + mid])
+            if size <= max_length:
+                best, best_tracker = mid, fed
+                low = mid + 1
             else:
-                splitted = split_on_whitespace(piece)
-                if splitted:
-                    for part in splitted:
-                        append_piece(part)
-                    return
-                tag_split = split_on_tags(piece)
-                if tag_split:
-                    for part in tag_split:
-                        append_piece(part)
-                    return
-
-            fitted = fittable_prefix_length(piece)
+                high = mid - 1
+        return best, best_tracker
+
+    def place(piece: str, start: int, patterns: list | None, base: int) -> Iterator[tuple] | None:
+        """Commit ``piece[start:]`` until it is placed or a chunk is finished.
+
+        ``piece`` starts at offset ``base`` of the piece being placed. Returns
+        the work left as an iterator of ``(piece, start, patterns, base)``
+        items: the rest of ``piece`` after a finished chunk, or its parts when
+        it has to be split on whitespace or tags first.
+        """
+        while start < len(piece):
+            remaining = len(piece) - start
+            floor = size_floor(piece, remaining)
+            used = tracker.visible_length if visible else length
+            # Measuring feeds the whole rest; skip it when its text alone is too long.
+            if used + floor <= max_length or (visible and tracker._pending):
+                rest = piece[start:]
+                size, fed = measure(rest)
+                if size <= max_length:
+                    commit(rest, fed, base + len(piece))
+                    return None
+
+            too_long = floor > max_length or piece_size(piece[start:]) > max_length
+            if too_long and _is_only_tags(piece, start):
+                raise ValueError("block contains only html tags")
+            if not too_long and current:
+                finalize()
+                continue
+            if patterns is None:
+                # Patterns that can still split what is left: a suffix can
+                # only match where the whole piece does.
+                patterns = [pattern for pattern in (_WHITESPACE_SPLIT_RE, _TAG_SPLIT_RE) if pattern.search(piece)]
+            for pattern in patterns:
+                rest = piece[start:]
+                if pattern.search(rest) and not pattern.fullmatch(rest):
+                    return _split_work(pattern, rest, base + start)
+
+            fitted, fed = fittable_prefix(piece, start, floor)
             if fitted == 0:
                 if current:
                     finalize()
                     continue
                 raise ValueError("unable to split content within max_length")
 
-            current += piece[:fitted]
-            piece = piece[fitted:]
+            commit(piece[start:start + fitted], fed, base + start + fitted)
+            start += fitted
 
-            if piece:
+            if start < len(piece):
                 finalize()
-
-
-    for part in parts:
-        if not part:
-            continue
-        if part.startswith("<pre>") or part.startswith("<pre><code"):
-            pre_chunks = split_pre_block(part, max_length=max_length)
-            for pc in pre_chunks:
-                append_piece(pc)
-            continue
-        blocks = re.split(r"(\n\s*\n|<br\s*/?>|\n)", part)
-        for block in blocks:
-            if block:
-                append_piece(block)
+                return iter(((piece, start, patterns, base),))
+        return None
+
+    def append_piece(piece: str) -> Iterator[Chunk]:
+        """Place ``piece``, yielding merged chunks as soon as they are final."""
+        # Work left, as a stack of iterators: the parts of a split piece are
+        # placed before the rest of its siblings.
+        stack = [iter(((piece, 0, None, 0),))]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+                continue
+            work = place(*item)
+            if work is not None:
+                stack.append(work)
+            yield from merged()
+
+    def pieces() -> Iterator[tuple[str, int, int, int]]:
+        """Yield ``(piece, body_start, skip, source_end)`` for each piece to place."""
+        position = 0
+        for part in _iter_split(_PRE_RE, text):
+            part_start = position
+            position += len(part)
+            if not part:
+                continue
+            if part.startswith("<pre>") or part.startswith("<pre><code"):
+                # Each chunk of a long block repeats the tags around its lines.
+                opening, closing = _pre_tags(part)
+                start = part_start + len(opening)
+                last = None
+                first_length = None
+                content = part[len(opening):len(part) - len(closing)]
+                if current and _has_line_longer_than(content, max_length - len(opening) - len(closing)):
+                    # The block is cut inside a line anyway, so it starts by
+                    # filling what is left of the chunk being built.
+                    if not visible:
+                        first_length = max_length - (tracker.open_tags_length + length
+                                                     + tracker.closing_tags_length)
+                    elif not tracker._pending:
+                        first_length = max_length - tracker.visible_length
+                for chunk in _iter_pre_chunks(part, max_length, first_length):
+                    if last is not None:
+                        yield last
+                    end = start + len(chunk) - len(opening) - len(closing)
+                    last = (chunk, start, len(opening), end)
+                    start = end
+                if last is not None:
+                    yield last[:3] + (position,)
+                continue
+            for block in _iter_split(_BLOCK_RE, part):
+                if block:
+                    yield block, part_start, 0, part_start + len(block)
+                part_start += len(block)
+
+    buf: Chunk | None = None
+    buf_size = 0
+    emitted = False
+
+    def merged() -> Iterator[Chunk]:
+        """Merge finished chunks into ``buf``, yielding it once the next one no longer fits."""
+        nonlocal buf, buf_size, emitted
+        for chunk in ready:
+            size = chunk.visible_length if visible else chunk.raw_length
+            if buf is not None and buf_size + size <= max_length:
+                buf.html += chunk.html
+                buf.visible_length += chunk.visible_length
+                buf.raw_length += chunk.raw_length
+                buf.source_end = chunk.source_end
+                buf_size += size
+            else:
+                if buf is not None and buf.html:
+                    yield buf
+                    emitted = True
+                # Stripped newlines count one unit in either mode.
+                buf_size = size - (_strip_leading_newlines(chunk, count_visible)
+                                   if trim_empty_leading_lines and emitted else 0)
+                buf = chunk
+        ready.clear()
+
+    for piece, body_start, skip, source_end in pieces():
+        piece_length = len(piece)
+        yield from append_piece(piece)
 
     if current:
         finalize()
-
-    merged: list[str] = []
-    buf = ""
-    for chunk in chunks:
-        if len(buf) + len(chunk) <= max_length:
-            buf += chunk
-        else:
-            if buf:
-                merged.append(buf)
-            buf = chunk.lstrip("\n") if trim_empty_leading_lines and merged else chunk
-    if buf:
-        merged.append(buf.lstrip("\n") if trim_empty_leading_lines and merged else buf)
-
-    return merged
+    yield from merged()
+    if buf is not None and buf.html:
+        yield buf
+
+
+# Tokens for optimal packing; a message may end after any of them. Outside
+# <pre> a word carries the spaces after it, inside <pre> a token is a line.
+_PACK_TEXT_RE = re.compile(r"<[^>]*>|\n\s*\n|\n|[^<\s]*[^\S\n]+|[^<\s]+|<")
+_PACK_PRE_RE = re.compile(r"<[^>]*>|[^<\n]*\n|[^<\n]+|<")
+# Cost of ending a message after a token, from best to worst break.
+_PARAGRAPH, _LINE, _SENTENCE, _WORD, _OTHER, _HARD = range(6)
+_BR_RE = re.compile(r"<br\s*/?>")
+# A run with no break is offered to the search in steps of this fraction of
+# max_length, so a message can end close to wherever its budget runs out.
+_HARD_STEPS = 64
+
+
+def _iter_optimal_chunks(text: str, trim_empty_leading_lines: bool, max_length: int,
+                         visible: bool, count_visible: bool) -> Iterator[Chunk]:
+    """Chunks of :func:`_iter_packed_chunks`, or the greedy ones when those are fewer.
+
+    The search cuts runs without breaks only at its step size, so on such
+    text greedy packing can need fewer messages, or succeed where the search
+    finds no split at all.
+    """
+    try:
+        greedy = list(_iter_chunks(text, trim_empty_leading_lines, max_length, visible, count_visible))
+    except ValueError:
+        greedy = None
+    try:
+        packed = list(_iter_packed_chunks(text, trim_empty_leading_lines, max_length, visible,
+                                          count_visible))
+    except ValueError:
+        if greedy is None:
+            raise
+        packed = greedy
+    if greedy is not None and len(greedy) < len(packed):
+        packed = greedy
+    yield from packed
+
+
+def _packing_tokens(text: str, max_length: int) -> Iterator[tuple[str, int]]:
+    """Yield ``(token, break_cost)`` pairs covering ``text``."""
+    hard_size = max(max_length // _HARD_STEPS, 1)
+    for index, part in enumerate(_iter_split(_PRE_RE, text)):
+        in_pre = index % 2 == 1
+        for match in (_PACK_PRE_RE if in_pre else _PACK_TEXT_RE).finditer(part):
+            token = match.group()
+            if token[0] == "<" and len(token) > 1:
+                cost = _LINE if _BR_RE.fullmatch(token) else _OTHER
+            elif token[-1] == "\n":
+                cost = _PARAGRAPH if not in_pre and token.count("\n") > 1 else _LINE
+            elif token[-1].isspace():
+                cost = _SENTENCE if token.rstrip()[-1:] in (".", "!", "?", "…") else _WORD
+            else:
+                cost = _OTHER
+            while len(token) > hard_size and token[0] != "<":
+                cut = _entity_safe_cut(token, hard_size)
+                yield token[:cut], _HARD
+                token = token[cut:]
+            yield token, cost
+
+
+def _iter_packed_chunks(text: str, trim_empty_leading_lines: bool, max_length: int,
+                        visible: bool, count_visible: bool) -> Iterator[Chunk]:
+    """Chunks with the fewest messages, then the least tag overhead, then the best breaks.
+
+    A message may end after any token. For every boundary the tracker gives
+    the length of the tags to reopen after it and to close before it, so a
+    message's size is a prefix-sum difference plus those two. The search
+    keeps a sliding-window minimum over the starts that fit whatever their
+    tags and checks only starts within the largest tag overhead one by one,
+    which keeps it close to linear.
+    """
+    tokens: list[str] = []
+    # Per boundary k, before tokens[k]: size of tokens[:k] in the length mode,
+    # rendered length of the tags open there and of their closing tags,
+    # whether a message may end there, and the cost of ending it there.
+    sizes, opens, closes, allowed, costs = [0], [0], [0], [True], [_PARAGRAPH]
+    tracker = HTMLTagTracker(visible)
+    raw = 0
+    for token, cost in _packing_tokens(text, max_length):
+        tokens.append(token)
+        tracker.feed(token)
+        raw += len(token)
+        sizes.append(tracker.visible_length if visible else raw)
+        opens.append(tracker.open_tags_length)
+        closes.append(tracker.closing_tags_length)
+        allowed.append(not tracker._pending)
+        costs.append(cost)
+    count = len(tokens)
+    if not count:
+        return
+    allowed[count] = True
+    costs[count] = _PARAGRAPH
+
+    # Reopened and closing tags only take up room in "html" mode.
+    slack = 0 if visible else max(opens) + max(closes)
+    # keys[i]: (messages, overhead, break cost) of the best split of
+    # tokens[:i], with the tags reopened at i already added to the overhead.
+    keys: list[tuple[int, int, int] | None] = [None] * (count + 1)
+    keys[0] = (0, opens[0], 0)
+    parents = [0] * (count + 1)
+    window: deque[int] = deque()
+    low_start = sure_start = 0
+    for end in range(1, count + 1):
+        start = end - 1
+        if keys[start] is not None:
+            while window and keys[window[-1]] >= keys[start]:
+                window.pop()
+            window.append(start)
+        if not allowed[end]:
+            continue
+        # Starts from sure_start on fit with any tags; the ones from
+        # low_start up to it fit only if their own tags leave room.
+        need = sizes[end] - max_length
+        while sizes[low_start] < need:
+            low_start += 1
+        while sure_start < end and sizes[sure_start] < need + slack:
+            sure_start += 1
+        while window and window[0] < sure_start:
+            window.popleft()
+        best, parent = (keys[window[0]], window[0]) if window else (None, 0)
+        tail = closes[end] if not visible else 0
+        for start in range(low_start, sure_start):
+            key = keys[start]
+            if key is None or (best is not None and key >= best):
+                continue
+            head = opens[start] if not visible else 0
+            if head + sizes[end] - sizes[start] + tail <= max_length:
+                best, parent = key, start
+        if best is None:
+            continue
+        messages, overhead, penalty = best
+        keys[end] = (messages + 1, overhead + closes[end] + opens[end], penalty + costs[end])
+        parents[end] = parent
+
+    if keys[count] is None:
+        raise ValueError("unable to split content within max_length")
+    breaks = [count]
+    while breaks[-1]:
+        breaks.append(parents[breaks[-1]])
+    breaks.reverse()
+
+    tracker = HTMLTagTracker(count_visible)
+    source_start = 0
+    for index, (start, end) in enumerate(zip(breaks, breaks[1:])):
+        prefix = tracker.get_open_tags_html()
+        body = "".join(tokens[start:end])
+        visible_start = tracker.visible_length
+        tracker.feed(body)
+        html = prefix + body + tracker.get_closing_tags_html()
+        chunk = Chunk(html, tracker.visible_length - visible_start, len(html), prefix,
+                      source_start, source_start + len(body))
+        source_start += len(body)
+        if trim_empty_leading_lines and index:
+            _strip_leading_newlines(chunk, count_visible)
+        yield chunk
@@ -0,0 +1,117 @@
+"""Split Markdown into pieces that convert to Telegram-sized HTML on their own."""
+
+import re
+from bisect import bisect_left
+from itertools import accumulate
+
+from .html_splitter import MAX_LENGTH
+from .telegram_entities.entity import EntityType
+from .telegram_entities.extractors import (find_inline_formatting_spans,
+                                           find_link_spans)
+from .telegram_markdown.code_blocks import close_fences
+from .telegram_markdown.tokenizer import find_safe_cuts
+
+# Characters the converter escapes: "&" grows by 4 ("&amp;"), "<" and ">" by 3.
+_ESCAPED_RE = re.compile(r"[&<>]")
+_HEADING_RE = re.compile(r"^#{1,6}\s", re.MULTILINE)
+_QUOTE_LINE_RE = re.compile(r"^(?:\*\*)?>", re.MULTILINE)
+# Tags rendered around an entity, by type; the rest are like <b></b>.
+_TAG_LENGTHS = {
+    EntityType.SPOILER: len('<span class="tg-spoiler"></span>'),
+    EntityType.TEXT_LINK: len('<a href=""></a>'),
+}
+_SIMPLE_TAG_LENGTH = len("<b></b>")
+
+
+def split_markdown_for_telegram(markdown: str, max_length: int = MAX_LENGTH) -> list[str]:
+    """Split Markdown into pieces that can each be converted on their own.
+
+    Pieces end only at blank lines that no code, quote, heading, list item,
+    formatting, citation or link of :func:`telegram_format` runs across, as
+    found by the converter's own rules, so the converted pieces joined with
+    blank lines give the HTML of the whole answer. Neighbouring blocks are
+    packed while their estimated HTML length stays within ``max_length``;
+    no HTML is produced or parsed.
+
+    Parameters
+    ----------
+    markdown: str
+        Input Markdown text.
+    max_length: int, optional
+        Budget for the HTML of a piece. Default = 4096 (symbols)
+
+    Returns
+    -------
+    list[str]
+        Markdown pieces, without the blank lines between them.
+
+    Notes
+    -----
+    The estimate adds the tags and escapes each construct renders to, so it
+    is close to, and usually above, the real length. A single block can
+    still be longer than ``max_length``: check ``len()`` of each converted
+    piece and pass the rare long one to :func:`split_html_for_telegram`.
+    """
+    if not markdown.strip():
+        return []
+
+    closed = close_fences(markdown)
+    inline_code = closed.inline_code(closed.blocks)
+    code = sorted([(block.start, min(block.end, len(markdown))) for block in closed.blocks]
+                  + inline_code)
+    # Markers inside code do not format anything.
+    masked = []
+    position = 0
+    for start, end in code:
+        masked.append(markdown[position:start])
+        masked.append("\x00" * (end - start))
+        position = end
+    masked.append(markdown[position:])
+    masked = "".join(masked)
+    deletions, entities = find_inline_formatting_spans(masked, "tokenizer")
+    link_deletions, links = find_link_spans(masked)
+
+    # Growth of the rendered HTML over the Markdown, recorded at the position
+    # of each construct, so any slice is estimated from two prefix sums.
+    events = [(match.start(), 4 if match.group() == "&" else 3)
+              for match in _ESCAPED_RE.finditer(markdown)]
+    events += [(match.start(), _SIMPLE_TAG_LENGTH - 2) for match in _HEADING_RE.finditer(markdown)]
+    previous_quote_line = -1
+    for match in _QUOTE_LINE_RE.finditer(markdown):
+        start = match.start()
+        if not start or markdown.rfind("\n", 0, start - 1) + 1 != previous_quote_line:
+            expandable = match.group().startswith("**")
+            events.append((start, len("<blockquote expandable></blockquote>" if expandable
+                                      else "<blockquote></blockquote>")))
+        previous_quote_line = start
+    for block in closed.blocks:
+        tags = f'<pre><code class="language-{block.language}"></code></pre>' if block.language \
+            else "<pre><code></code></pre>"
+        fences = block.code_start - block.start + block.end - block.code_end
+        events.append((block.start, len(tags) - fences))
+    events += [(start, len("<code></code>") - 2) for start, _ in inline_code]
+    events += [(edit.start, edit.start - edit.end) for edit in deletions + link_deletions]
+    events += [(entity.offset, _TAG_LENGTHS.get(entity.type, _SIMPLE_TAG_LENGTH) + len(entity.url or ""))
+               for entity in entities + links]
+    events.sort()
+    positions = [position for position, _ in events]
+    totals = [0, *accumulate(delta for _, delta in events)]
+
+    def estimate(start: int, end: int) -> int:
+        return end - start + totals[bisect_left(positions, end)] - totals[bisect_left(positions, start)]
+
+    starts, ends = [0], []
+    for end, next_start in find_safe_cuts(markdown):
+        ends.append(end)
+        starts.append(next_start)
+    ends.append(len(markdown))
+
+    pieces = []
+    piece_start = 0
+    for index in range(1, len(starts)):
+        if estimate(piece_start, ends[index]) > max_length:
+            pieces.append(markdown[piece_start:ends[index - 1]])
+            piece_start = starts[index]
+    pieces.append(markdown[piece_start:])
+    return [piece for piece in pieces if piece.strip()]
+
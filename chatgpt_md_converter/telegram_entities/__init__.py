@@ -9,9 +9,14 @@ from typing import List, Tuple
 
 from .entity import EntityType, TelegramEntity
 from .parser import parse_entities
+from .splitter import split_entities_for_telegram
+from .streaming import StreamingEntityFormatter
+from .utf16 import Utf16Index
 
 
-def telegram_format_entities(text: str) -> Tuple[str, List[dict]]:
+def telegram_format_entities(
+    text: str, engine: str = "regex"
+) -> Tuple[str, List[dict]]:
     """
     Convert Markdown text to Telegram format with entities.
 
@@ -36,6 +41,8 @@ def telegram_format_entities(text: str) -> Tuple[str, List[dict]]:
 
     Args:
         text: Markdown-formatted text
+        engine: ``"regex"`` (default) or ``"tokenizer"``, which pairs inline
+            formatting delimiters in a single scan; both give the same result
 
     Returns:
         Tuple of (plain_text, entities) where:
@@ -56,7 +63,7 @@ def telegram_format_entities(text: str) -> Tuple[str, List[dict]]:
         # Use with aiogram:
         await message.answer(text, entities=entities)
     """
-    plain_text, entity_objects = parse_entities(text)
+    plain_text, entity_objects = parse_entities(text, engine)
     return plain_text, [e.to_dict() for e in entity_objects]
 
 
@@ -65,4 +72,7 @@ __all__ = [
     "TelegramEntity",
     "EntityType",
     "parse_entities",
+    "StreamingEntityFormatter",
+    "split_entities_for_telegram",
+    "Utf16Index",
 ]
@@ -1,13 +1,18 @@
 """Entity extractors for different Markdown elements."""
 
-from .blockquotes import extract_blockquote_entities
-from .headings import extract_heading_entities
-from .inline import extract_inline_formatting_entities
-from .links import extract_link_entities
+from .blockquotes import extract_blockquote_entities, find_blockquote_spans
+from .headings import extract_heading_entities, find_heading_spans
+from .inline import (extract_inline_formatting_entities,
+                     find_inline_formatting_spans)
+from .links import extract_link_entities, find_link_spans
 
 __all__ = [
     "extract_inline_formatting_entities",
     "extract_link_entities",
     "extract_blockquote_entities",
     "extract_heading_entities",
+    "find_inline_formatting_spans",
+    "find_link_spans",
+    "find_blockquote_spans",
+    "find_heading_spans",
 ]
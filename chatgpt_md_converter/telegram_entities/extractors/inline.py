@@ -1,9 +1,11 @@
 """Inline formatting entity extraction (bold, italic, underline, etc.)."""
 
 import re
-from typing import List, Tuple
+import string
+from typing import Dict, List, Tuple
 
 from ..entity import EntityType, TelegramEntity
+from ..spans import Edit, SpanText, deletion
 
 # Patterns for different formatting types
 # Order matters - longer markers first to avoid partial matches
@@ -71,6 +73,28 @@ _PATTERNS = [
 ]
 
 
+_ENGINES = ("regex", "tokenizer")
+
+_MARKER_RE = re.compile(r"[*_~|]")
+_ALNUM = frozenset(string.ascii_letters + string.digits)
+
+# The same constructs as ``_PATTERNS``, in the same order, as delimiter rules
+# for the single-scan tokenizer: (marker, length, entity_types,
+# not_before_opener, not_before_closer, not_after_closer, single_line).
+# An opener must also be followed by a non-space character other than the
+# marker, and a closer preceded by a non-space character.
+_DELIMITERS = [
+    ("*", 3, [EntityType.BOLD, EntityType.ITALIC], {"\\", "*"}, set(), {"*"}, False),
+    ("_", 3, [EntityType.UNDERLINE, EntityType.ITALIC], {"\\", "_"}, set(), {"_"}, False),
+    ("*", 2, [EntityType.BOLD], {"\\", "*"}, {"*"}, {"*"}, False),
+    ("_", 2, [EntityType.UNDERLINE], {"\\", "_"}, {"_"}, {"_"}, False),
+    ("~", 2, [EntityType.STRIKETHROUGH], {"\\", "~"}, {"~"}, {"~"}, False),
+    ("|", 2, [EntityType.SPOILER], {"\\", "|"}, {"|"}, {"|"}, True),
+    ("*", 1, [EntityType.ITALIC], _ALNUM | {"\\", "*"}, {"*"}, _ALNUM | {"*"}, False),
+    ("_", 1, [EntityType.ITALIC], _ALNUM | {"\\", "_"}, {"_"}, _ALNUM | {"_"}, False),
+]
+
+
 class _Match:
     """Represents a formatting match with its properties."""
 
@@ -119,51 +143,136 @@ def _find_all_matches(text: str) -> List[_Match]:
     return matches
 
 
+def _scan_all_matches(text: str) -> List[_Match]:
+    """Find the same matches as :func:`_find_all_matches` in one scan.
+
+    Marker positions are collected once, then each construct pairs its
+    delimiter runs over those positions. A lazy pattern always takes the
+    first valid closer, and a later opener can only see a subset of an
+    earlier opener's closers, so one pending opener per construct stands in
+    for the regex backtracking.
+    """
+    positions: Dict[str, List[int]] = {"*": [], "_": [], "~": [], "|": []}
+    for marker in _MARKER_RE.finditer(text):
+        positions[marker.group()].append(marker.start())
+
+    length = len(text)
+    matches = []
+    for (
+        marker, marker_len, entity_types,
+        not_before_opener, not_before_closer, not_after_closer, single_line,
+    ) in _DELIMITERS:
+        run = marker * marker_len
+        resume = 0
+        opener = -1
+        limit = length
+        for pos in positions[marker]:
+            if pos < resume:
+                continue
+            if opener >= 0:
+                if pos > limit:
+                    opener = -1
+                elif pos >= opener + marker_len and text.startswith(run, pos):
+                    before = text[pos - 1]
+                    after = text[pos + marker_len] if pos + marker_len < length else None
+                    if (
+                        not before.isspace()
+                        and before not in not_before_closer
+                        and after not in not_after_closer
+                    ):
+                        matches.append(
+                            _Match(
+                                start=opener,
+                                end=pos + marker_len,
+                                inner_start=opener + marker_len,
+                                inner_end=pos,
+                                entity_types=list(entity_types),
+                                marker_len=marker_len,
+                            )
+                        )
+                        resume = pos + marker_len
+                        opener = -1
+                        continue
+            if opener < 0 and text.startswith(run, pos):
+                before = text[pos - 1] if pos else None
+                after = text[pos + marker_len] if pos + marker_len < length else None
+                if (
+                    before not in not_before_opener
+                    and after is not None
+                    and after != marker
+                    and not after.isspace()
+                ):
+                    opener = pos
+                    limit = length
+                    if single_line:
+                        newline = text.find("\n", pos + marker_len)
+                        if newline >= 0:
+                            limit = newline
+
+    # Sort by start position, then by length descending (longer first)
+    matches.sort(key=lambda m: (m.start, -(m.end - m.start)))
+
+    return matches
+
+
 def _build_match_tree(matches: List[_Match]) -> List[_Match]:
     """
     Build a tree of matches where nested matches are children.
     Returns only top-level matches (others are nested as children).
+
+    ``matches`` must be sorted by start. Anything that ends at or before the
+    current start can no longer contain or overlap it, so only the top-level
+    matches still open (a nested chain, kept as a stack) are compared.
     """
     if not matches:
         return []
 
     result: List[_Match] = []
+    open_matches: List[_Match] = []
 
     for match in matches:
+        while open_matches and open_matches[-1].end <= match.start:
+            open_matches.pop()
+
         # Find if this match should be nested inside an existing result
-        placed = False
-        for existing in result:
+        contained = False
+        for existing in open_matches:
             if existing.contains(match):
-                # Recursively try to place in existing's children
-                placed = _try_place_in_children(existing, match)
-                if placed:
-                    break
+                # Recursively try to place in existing's children; a match
+                # that clashes with one of them is dropped like any overlap
+                contained = True
+                _try_place_in_children(existing, match)
+                break
 
-        if not placed:
+        if not contained:
             # Check if this match overlaps with any existing (invalid)
             overlaps = False
-            for existing in result:
+            for existing in open_matches:
                 if _matches_overlap(match, existing):
                     overlaps = True
                     break
 
             if not overlaps:
                 result.append(match)
+                open_matches.append(match)
 
     return result
 
 
 def _try_place_in_children(parent: _Match, child: _Match) -> bool:
-    """Try to place a child match in the parent's children list."""
-    # First check if it fits in any existing child
-    for existing_child in parent.children:
-        if existing_child.contains(child):
-            return _try_place_in_children(existing_child, child)
-
-    # Check for overlaps with existing children
-    for existing_child in parent.children:
-        if _matches_overlap(child, existing_child):
+    """Try to place a child match in the parent's children list.
+
+    Siblings never overlap and arrive in start order, so every child but the
+    last ends before ``child`` starts; only the last one needs checking.
+    """
+    while parent.children:
+        last_child = parent.children[-1]
+        if last_child.contains(child):
+            parent = last_child
+            continue
+        if _matches_overlap(child, last_child):
             return False
+        break
 
     # Can add as a direct child
     parent.children.append(child)
@@ -185,111 +294,79 @@ def _matches_overlap(m1: _Match, m2: _Match) -> bool:
     return True
 
 
-def _process_match(
-    text: str,
+def _collect_spans(
     match: _Match,
-    base_offset: int,
-) -> Tuple[str, List[TelegramEntity]]:
+    deletions: List[Edit],
+    entities: List[TelegramEntity],
+) -> None:
     """
-    Process a single match and its children, returning plain text and entities.
+    Record the markers and entities of a match and its children.
 
-    Args:
-        text: The text containing the match
-        match: The match to process
-        base_offset: Offset in the final output where this match starts
-
-    Returns:
-        Tuple of (processed_text, entities)
+    Children come first, so entities keep their inside-out order.
     """
-    inner_text = text[match.inner_start : match.inner_end]
-    entities: List[TelegramEntity] = []
-
-    # If there are children, process them
-    if match.children:
-        # Sort children by position
-        match.children.sort(key=lambda m: m.start)
-
-        # Process children recursively
-        processed_parts: List[str] = []
-        child_entities: List[TelegramEntity] = []
-        last_end = match.inner_start
-
-        for child in match.children:
-            # Add text before this child
-            processed_parts.append(text[last_end : child.start])
-
-            # Calculate child's offset in the final output
-            child_offset = base_offset + sum(len(p) for p in processed_parts)
-
-            # Process child recursively
-            child_text, child_ents = _process_match(text, child, child_offset)
-            processed_parts.append(child_text)
-            child_entities.extend(child_ents)
-
-            last_end = child.end
-
-        # Add remaining text after last child
-        processed_parts.append(text[last_end : match.inner_end])
-
-        inner_text = "".join(processed_parts)
-        entities.extend(child_entities)
-
-    # Create entities for this match
+    deletions.append(deletion(match.start, match.inner_start))
+    match.children.sort(key=lambda m: m.start)
+    for child in match.children:
+        _collect_spans(child, deletions, entities)
+    deletions.append(deletion(match.inner_end, match.end))
     for entity_type in match.entity_types:
         entities.append(
             TelegramEntity(
                 type=entity_type,
-                offset=base_offset,
-                length=len(inner_text),
+                offset=match.inner_start,
+                length=match.inner_end - match.inner_start,
             )
         )
 
-    return inner_text, entities
-
 
-def extract_inline_formatting_entities(
+def find_inline_formatting_spans(
     text: str,
-) -> Tuple[str, List[TelegramEntity]]:
+    engine: str = "regex",
+) -> Tuple[List[Edit], List[TelegramEntity]]:
     """
-    Extract inline formatting (bold, italic, etc.) and return plain text with entities.
-
-    Handles nested formatting where one style is fully contained within another.
+    Find inline formatting markers and entities without rewriting ``text``.
 
     Args:
         text: Input text with Markdown formatting markers
+        engine: ``"regex"`` runs one pattern per construct, ``"tokenizer"``
+            pairs delimiter runs in a single scan; both find the same matches
 
     Returns:
-        Tuple of (text_without_markers, list_of_entities)
+        Tuple of (marker_deletions, entities), both in ``text`` offsets
     """
-    matches = _find_all_matches(text)
+    if engine == "tokenizer":
+        matches = _scan_all_matches(text)
+    elif engine == "regex":
+        matches = _find_all_matches(text)
+    else:
+        raise ValueError(f"unknown engine {engine!r}, expected one of {_ENGINES}")
     top_level_matches = _build_match_tree(matches)
-
-    if not top_level_matches:
-        return text, []
-
-    # Sort by position
     top_level_matches.sort(key=lambda m: m.start)
 
-    # Process all matches
-    result_parts: List[str] = []
-    all_entities: List[TelegramEntity] = []
-    last_end = 0
-
+    deletions: List[Edit] = []
+    entities: List[TelegramEntity] = []
     for match in top_level_matches:
-        # Add text before this match
-        result_parts.append(text[last_end : match.start])
+        _collect_spans(match, deletions, entities)
+    return deletions, entities
 
-        # Calculate offset for this match
-        current_offset = sum(len(p) for p in result_parts)
 
-        # Process match and its children
-        processed_text, entities = _process_match(text, match, current_offset)
-        result_parts.append(processed_text)
-        all_entities.extend(entities)
+def extract_inline_formatting_entities(
+    text: str,
+    engine: str = "regex",
+) -> Tuple[str, List[TelegramEntity]]:
+    """
+    Extract inline formatting (bold, italic, etc.) and return plain text with entities.
 
-        last_end = match.end
+    Handles nested formatting where one style is fully contained within another.
 
-    # Add remaining text
-    result_parts.append(text[last_end:])
+    Args:
+        text: Input text with Markdown formatting markers
+        engine: ``"regex"`` runs one pattern per construct, ``"tokenizer"``
+            pairs delimiter runs in a single scan; both find the same matches
 
-    return "".join(result_parts), all_entities
+    Returns:
+        Tuple of (text_without_markers, list_of_entities)
+    """
+    span = SpanText(text)
+    span.apply(*find_inline_formatting_spans(text, engine))
+    return span.materialize()
@@ -3,25 +3,29 @@
 import re
 from typing import List, Tuple
 
+from ..telegram_markdown.fences import FenceScan, scan_fences
 from .entity import EntityType, TelegramEntity
-from .extractors import (extract_blockquote_entities, extract_heading_entities,
-                         extract_inline_formatting_entities,
-                         extract_link_entities)
-from .utf16 import utf16_len
+from .extractors import (find_blockquote_spans, find_heading_spans,
+                         find_inline_formatting_spans, find_link_spans)
+from .spans import Edit, SpanText, strip_entities
+from .utf16 import Utf16Index
 
 # Placeholder prefix for protected content
 _CODE_BLOCK_PLACEHOLDER = "\x00CODEBLOCK"
 _INLINE_CODE_PLACEHOLDER = "\x00INLINECODE"
+# Cleanup applied outside code once all formatting is extracted
+_LIST_MARKER_RE = re.compile(r"^(\s*)[\-\*]\s+", re.MULTILINE)
+_CITATION_RE = re.compile(r"【[^】]+】")
+_MULTIPLE_NEWLINES_RE = re.compile(r"\n{3,}")
 
 
-def _convert_list_markers(text: str) -> str:
-    """Convert Markdown list markers (* or -) to bullet points."""
-    return re.sub(r"^(\s*)[\-\*]\s+", r"\1• ", text, flags=re.MULTILINE)
-
-
-def _remove_citation_markers(text: str) -> str:
-    """Remove ChatGPT-style citation markers like 【1】."""
-    return re.sub(r"【[^】]+】", "", text)
+def _replacements(text: str, pattern: re.Pattern, replacement: str) -> List[Edit]:
+    """Edits replacing every match of ``pattern``, after its group 1 if any."""
+    edits = []
+    for match in pattern.finditer(text):
+        start = match.end(1) if pattern.groups else match.start()
+        edits.append(Edit(start, match.end(), replacement, replacement))
+    return edits
 
 
 def _adjust_entities_to_utf16(
@@ -32,6 +36,7 @@ def _adjust_entities_to_utf16(
 
     Telegram requires UTF-16 code units for entity positions.
     """
+    index = Utf16Index(text)
     adjusted = []
     for entity in entities:
         # Clamp offset and length to text bounds
@@ -41,13 +46,9 @@ def _adjust_entities_to_utf16(
         if length <= 0:
             continue
 
-        # Get the text portions
-        before_text = text[:offset]
-        entity_text = text[offset : offset + length]
-
         # Convert to UTF-16 units
-        utf16_offset = utf16_len(before_text)
-        utf16_length = utf16_len(entity_text)
+        utf16_offset = index.char_to_utf16(offset)
+        utf16_length = index.char_to_utf16(offset + length) - utf16_offset
 
         if utf16_length > 0:
             adjusted.append(
@@ -78,160 +79,72 @@ def _validate_and_sort_entities(
     return entities
 
 
-def _clean_multiple_newlines(text: str) -> str:
-    """Reduce 3+ consecutive newlines to just 2."""
-    return re.sub(r"\n{3,}", "\n\n", text)
-
-
-def _extract_with_placeholders(
-    text: str, pattern: re.Pattern, placeholder_prefix: str
-) -> Tuple[str, dict]:
-    """
-    Extract matches and replace with placeholders.
-    Returns (modified_text, {placeholder: (content, entity_info)})
-    """
-    extractions = {}
-    counter = [0]
-
-    def replacer(match):
-        placeholder = f"{placeholder_prefix}{counter[0]}\x00"
-        counter[0] += 1
-        extractions[placeholder] = match
-        return placeholder
-
-    modified = pattern.sub(replacer, text)
-    return modified, extractions
-
-
-def parse_entities(text: str) -> Tuple[str, List[TelegramEntity]]:
+def parse_entities(
+    text: str, engine: str = "regex"
+) -> Tuple[str, List[TelegramEntity]]:
     """
     Parse Markdown text and return plain text with Telegram entities.
 
     Uses a placeholder-based approach to handle the order of extraction correctly:
     1. Replace code blocks and inline code with placeholders
     2. Extract all other formatting (blockquotes, headings, links, inline styles)
-    3. Restore placeholders and calculate final offsets
+    3. Build the plain text once, restoring code, and map every entity into it
+
+    Stages never rewrite the source; they record deleted markers and entity
+    spans against it (see :class:`~.spans.SpanText`).
 
     Args:
         text: Markdown-formatted text
+        engine: Inline formatting extractor, ``"regex"`` or ``"tokenizer"``
 
     Returns:
         Tuple of (plain_text, list_of_entities)
         Entities have offsets/lengths in UTF-16 code units.
     """
-    all_entities: List[TelegramEntity] = []
-
-    # Phase 1: Extract code blocks to placeholders
-    code_block_pattern = re.compile(
-        r"(?P<fence>`{3,})(?P<lang>\w+)?\n(?P<code>[\s\S]*?)(?P=fence)",
-        flags=re.MULTILINE,
-    )
-    code_block_map = {}
-    code_block_counter = [0]
-
-    def replace_code_block(match):
-        placeholder = f"{_CODE_BLOCK_PLACEHOLDER}{code_block_counter[0]}\x00"
-        code_block_counter[0] += 1
+    # Phase 1 & 2: Replace code blocks, then inline code, with placeholders
+    scan = _close_fences(text)
+    text = scan.text
+    blocks = scan.strict_blocks()
+    code_edits = []
+    for index, block in enumerate(blocks):
         # Strip trailing newline from code content (appears before closing fence)
-        code_content = match.group("code").rstrip("\n")
-        language = match.group("lang") or None
-        code_block_map[placeholder] = (code_content, language)
-        return placeholder
-
-    # Ensure closing delimiters
-    text = _ensure_closing_delimiters(text)
-    text = code_block_pattern.sub(replace_code_block, text)
-
-    # Phase 2: Extract inline code to placeholders
-    inline_code_pattern = re.compile(r"`([^`\n]+)`")
-    inline_code_map = {}
-    inline_code_counter = [0]
-
-    def replace_inline_code(match):
-        placeholder = f"{_INLINE_CODE_PLACEHOLDER}{inline_code_counter[0]}\x00"
-        inline_code_counter[0] += 1
-        code_content = match.group(1)
-        inline_code_map[placeholder] = code_content
-        return placeholder
-
-    text = inline_code_pattern.sub(replace_inline_code, text)
-
-    # Phase 3: Extract other formatting (on text with placeholders)
-    # Order matters: inline formatting first (removes markers), then links
-    text, blockquote_entities = extract_blockquote_entities(text)
-    all_entities.extend(blockquote_entities)
-
-    text, heading_entities = extract_heading_entities(text)
-    all_entities.extend(heading_entities)
-
-    text, inline_entities = extract_inline_formatting_entities(text)
-    all_entities.extend(inline_entities)
-
-    # Extract links AFTER inline formatting, adjusting existing entity offsets
-    text, link_entities, all_entities = extract_link_entities(text, all_entities)
-    all_entities.extend(link_entities)
-
-    # Phase 4: Restore code placeholders and create entities
-    # Collect all placeholders with their info
-    all_placeholders = []
-
-    for placeholder, (code_content, language) in code_block_map.items():
-        if placeholder in text:
-            pos = text.find(placeholder)
-            all_placeholders.append({
-                'placeholder': placeholder,
-                'content': code_content,
-                'position': pos,
-                'type': EntityType.PRE,
-                'language': language,
-            })
-
-    for placeholder, code_content in inline_code_map.items():
-        if placeholder in text:
-            pos = text.find(placeholder)
-            all_placeholders.append({
-                'placeholder': placeholder,
-                'content': code_content,
-                'position': pos,
-                'type': EntityType.CODE,
-                'language': None,
-            })
-
-    # Sort by position ascending (restore from start to end)
-    # This way, when we shift entities, the later entities get adjusted correctly
-    all_placeholders.sort(key=lambda x: x['position'])
-
-    code_entities: List[TelegramEntity] = []
-
-    for ph_info in all_placeholders:
-        placeholder = ph_info['placeholder']
-        code_content = ph_info['content']
-        offset = text.find(placeholder)
-        text = text.replace(placeholder, code_content, 1)
-
-        code_entities.append(
-            TelegramEntity(
-                type=ph_info['type'],
-                offset=offset,
-                length=len(code_content),
-                language=ph_info['language'],
+        code_content = text[block.code_start : block.code_end].rstrip("\n")
+        code_edits.append(
+            Edit(
+                block.start,
+                block.end,
+                f"{_CODE_BLOCK_PLACEHOLDER}{index}\x00",
+                code_content,
+                EntityType.PRE,
+                block.language,
             )
         )
+    for index, (start, end) in enumerate(scan.inline_code(blocks)):
+        code_edits.append(
+            Edit(
+                start,
+                end,
+                f"{_INLINE_CODE_PLACEHOLDER}{index}\x00",
+                text[start + 1 : end - 1],
+                EntityType.CODE,
+            )
+        )
+    span = SpanText(text)
+    span.apply(_outermost(code_edits))
 
-        # Adjust existing entities (both all_entities and code_entities) after this position
-        placeholder_len = len(placeholder)
-        content_len = len(code_content)
-        shift = content_len - placeholder_len
-        all_entities = _shift_entities_after(all_entities, offset, shift)
-        # Also shift already-created code entities (except the one we just added)
-        code_entities = _shift_entities_after(code_entities[:-1], offset, shift) + [code_entities[-1]]
+    # Phase 3: Extract other formatting (on text with placeholders)
+    span.apply(*find_blockquote_spans(span.view))
+    span.apply(*find_heading_spans(span.view))
+    span.apply(*find_inline_formatting_spans(span.view, engine))
+    span.apply(*find_link_spans(span.view))
 
-    all_entities.extend(code_entities)
+    # Phase 4: Clean up everything outside code
+    span.apply(_replacements(span.view, _LIST_MARKER_RE, "• "))
+    span.apply(_replacements(span.view, _CITATION_RE, ""))
+    span.apply(_replacements(span.view, _MULTIPLE_NEWLINES_RE, "\n\n"))
 
-    # Phase 5: Clean up
-    text = _convert_list_markers(text)
-    text = _remove_citation_markers(text)
-    text = _clean_multiple_newlines(text)
+    # Phase 5: Build the plain text and map every entity into it
+    text, all_entities = strip_entities(*span.materialize())
 
     # Validate and sort entities
     all_entities = _validate_and_sort_entities(all_entities)
@@ -239,62 +152,33 @@ def parse_entities(text: str) -> Tuple[str, List[TelegramEntity]]:
     # Convert to UTF-16 offsets
     all_entities = _adjust_entities_to_utf16(text, all_entities)
 
-    return text.strip(), all_entities
+    return text, all_entities
 
 
-def _shift_entities_after(
-    entities: List[TelegramEntity], position: int, shift: int
-) -> List[TelegramEntity]:
-    """Shift entity offsets that come after a given position."""
-    result = []
-    for e in entities:
-        if e.offset >= position:
-            result.append(
-                TelegramEntity(
-                    type=e.type,
-                    offset=e.offset + shift,
-                    length=e.length,
-                    url=e.url,
-                    language=e.language,
-                )
-            )
-        else:
-            result.append(e)
+def _outermost(edits: List[Edit]) -> List[Edit]:
+    """Sort code edits, dropping blocks that sit inside inline code."""
+    result: List[Edit] = []
+    for edit in sorted(edits):
+        if result and edit.start < result[-1].end:
+            if edit.end <= result[-1].end:
+                continue
+            result.pop()
+        result.append(edit)
     return result
 
 
-def _ensure_closing_delimiters(text: str) -> str:
-    """Append any missing closing backtick fences for Markdown code blocks."""
-    code_block_re = re.compile(
-        r"(?P<fence>`{3,})(?P<lang>\w+)?\n?[\s\S]*?(?<=\n)?(?P=fence)",
-        flags=re.DOTALL,
-    )
-
-    open_fence = None
-    for line in text.splitlines():
-        stripped = line.strip()
-        if open_fence is None:
-            match = re.match(r"^(?P<fence>`{3,})(?P<lang>\w+)?$", stripped)
-            if match:
-                open_fence = match.group("fence")
-        else:
-            if stripped == open_fence:
-                open_fence = None
-
-    if open_fence is not None:
-        if not text.endswith("\n"):
-            text += "\n"
-        text += open_fence
-
+def _close_fences(text: str) -> FenceScan:
+    """Scan ``text`` and append any missing closing fences and backticks."""
+    scan = scan_fences(text)
+    if scan.open_fence_exact is not None:
+        scan = scan.extend(
+            ("" if text.endswith("\n") else "\n") + scan.open_fence_exact
+        )
     # Check for unclosed triple backticks
-    temp = code_block_re.sub("", text)
-    if temp.count("```") % 2 != 0:
-        text += "\n```"
-
+    if scan.triple_backticks % 2 != 0:
+        scan = scan.extend("\n```")
     # Check for unclosed single backticks (inline code)
-    temp = code_block_re.sub("", text)
-    temp = re.sub(r"``+", "", temp)
-    if temp.count("`") % 2 != 0:
-        text += "`"
+    if scan.single_backticks % 2 != 0:
+        scan = scan.extend("`")
+    return scan
 
-    return text
@@ -0,0 +1,223 @@
+"""Offset-preserving span representation for the entity parser pipeline."""
+
+from bisect import bisect_right
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from .entity import EntityType, TelegramEntity
+
+
+class Edit(NamedTuple):
+    """
+    Replacement of ``source[start:end]``.
+
+    ``view`` is what later stages see in its place and ``final`` what ends up
+    in the plain text; both are empty for a plain deletion. Code edits also
+    carry the entity that covers their final text.
+    """
+
+    start: int
+    end: int
+    view: str = ""
+    final: str = ""
+    entity_type: Optional[EntityType] = None
+    language: Optional[str] = None
+
+
+def deletion(start: int, end: int) -> Edit:
+    """Return an edit that removes ``[start, end)``."""
+    return Edit(start, end)
+
+
+class SpanText:
+    """
+    The parser's working text as edits and entity spans over the source.
+
+    The source string is never rewritten. Each stage looks at :attr:`view`
+    (the source with every edit so far applied) and hands back edits and
+    entities in view coordinates; :meth:`apply` converts both to source
+    coordinates. :meth:`materialize` then builds the plain text and maps all
+    entities once, so an entity keeps the right length however many markers
+    later stages remove inside it.
+    """
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.view = source
+        self._edits: List[Edit] = []
+        # (type, start, end, url, language) in source coordinates.
+        self._spans: List[Tuple[EntityType, int, int, Optional[str], Optional[str]]] = []
+        # View pieces: view start, source start, edit index or -1 for source.
+        self._piece_views: List[int] = [0]
+        self._piece_sources: List[int] = [0]
+        self._piece_edits: List[int] = [-1]
+
+    def apply(
+        self, edits: Sequence[Edit], entities: Sequence[TelegramEntity] = ()
+    ) -> None:
+        """
+        Record one stage's edits and entities, both in view coordinates.
+
+        Args:
+            edits: Non-overlapping edits sorted by start
+            entities: Entities whose offset and length refer to the view
+        """
+        for entity in entities:
+            self._spans.append(
+                (
+                    entity.type,
+                    self._to_source(entity.offset, at_end=False),
+                    self._to_source(entity.offset + entity.length, at_end=True),
+                    entity.url,
+                    entity.language,
+                )
+            )
+        if not edits:
+            return
+
+        merged: List[Edit] = []
+        old = self._edits
+        index = 0
+        previous_end = 0
+        for edit in edits:
+            if edit.start < previous_end:
+                raise ValueError("edits must be sorted and must not overlap")
+            previous_end = edit.end
+            start = self._to_source(edit.start, at_end=False)
+            end = max(start, self._to_source(edit.end, at_end=True))
+            # Earlier edits covered by this one disappear with it.
+            while index < len(old) and old[index].start < start:
+                merged.append(old[index])
+                index += 1
+            while index < len(old) and old[index].end <= end:
+                index += 1
+            merged.append(edit._replace(start=start, end=end))
+        merged.extend(old[index:])
+        self._edits = merged
+        self._rebuild_view()
+
+    def materialize(self) -> Tuple[str, List[TelegramEntity]]:
+        """
+        Return the plain text and all entities, in code points.
+
+        Stage entities come first in the order they were recorded, followed
+        by the entities of code edits in text order.
+        """
+        source = self.source
+        parts: List[str] = []
+        starts: List[int] = []
+        out_starts: List[int] = []
+        code_entities: List[TelegramEntity] = []
+        position = 0
+        out = 0
+        for edit in self._edits:
+            parts.append(source[position : edit.start])
+            out += edit.start - position
+            starts.append(edit.start)
+            out_starts.append(out)
+            if edit.entity_type is not None:
+                code_entities.append(
+                    TelegramEntity(
+                        type=edit.entity_type,
+                        offset=out,
+                        length=len(edit.final),
+                        language=edit.language,
+                    )
+                )
+            parts.append(edit.final)
+            out += len(edit.final)
+            position = edit.end
+        parts.append(source[position:])
+
+        def to_output(offset: int, at_end: bool) -> int:
+            index = bisect_right(starts, offset) - 1
+            if index < 0:
+                return offset
+            edit = self._edits[index]
+            if offset >= edit.end:
+                return out_starts[index] + len(edit.final) + offset - edit.end
+            if at_end and offset > edit.start:
+                return out_starts[index] + len(edit.final)
+            return out_starts[index]
+
+        entities = []
+        for entity_type, start, end, url, language in self._spans:
+            offset = to_output(start, at_end=False)
+            entities.append(
+                TelegramEntity(
+                    type=entity_type,
+                    offset=offset,
+                    length=to_output(end, at_end=True) - offset,
+                    url=url,
+                    language=language,
+                )
+            )
+        entities.extend(code_entities)
+        return "".join(parts), entities
+
+    def _rebuild_view(self) -> None:
+        source = self.source
+        parts: List[str] = []
+        self._piece_views = []
+        self._piece_sources = []
+        self._piece_edits = []
+        position = 0
+        view_length = 0
+        for index, edit in enumerate(self._edits):
+            if edit.start > position:
+                self._add_piece(view_length, position, -1)
+                parts.append(source[position : edit.start])
+                view_length += edit.start - position
+            if edit.view:
+                self._add_piece(view_length, edit.start, index)
+                parts.append(edit.view)
+                view_length += len(edit.view)
+            position = edit.end
+        self._add_piece(view_length, position, -1)
+        parts.append(source[position:])
+        self.view = "".join(parts)
+
+    def _add_piece(self, view_start: int, source_start: int, edit_index: int) -> None:
+        self._piece_views.append(view_start)
+        self._piece_sources.append(source_start)
+        self._piece_edits.append(edit_index)
+
+    def _to_source(self, offset: int, at_end: bool) -> int:
+        """Map a view offset to the source; ``at_end`` looks at the char before."""
+        char = offset - 1 if at_end else offset
+        if char < 0:
+            return 0
+        if char >= len(self.view):
+            return len(self.source)
+        index = bisect_right(self._piece_views, char) - 1
+        edit_index = self._piece_edits[index]
+        if edit_index >= 0:
+            edit = self._edits[edit_index]
+            return edit.end if at_end else edit.start
+        source = self._piece_sources[index] + char - self._piece_views[index]
+        return source + 1 if at_end else source
+
+
+def strip_entities(
+    text: str, entities: List[TelegramEntity]
+) -> Tuple[str, List[TelegramEntity]]:
+    """Strip surrounding whitespace from ``text``, moving entities with it."""
+    stripped = text.strip()
+    if not stripped:
+        return "", []
+    leading = len(text) - len(text.lstrip())
+    length = len(stripped)
+    result = []
+    for entity in entities:
+        start = min(max(entity.offset - leading, 0), length)
+        end = min(max(entity.offset + entity.length - leading, 0), length)
+        result.append(
+            TelegramEntity(
+                type=entity.type,
+                offset=start,
+                length=end - start,
+                url=entity.url,
+                language=entity.language,
+            )
+        )
+    return stripped, result
+
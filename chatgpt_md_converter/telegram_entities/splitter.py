@@ -0,0 +1,126 @@
+"""Split (text, entities) payloads into Telegram-sized messages."""
+
+import re
+from typing import List, Sequence, Tuple, Union
+
+from .entity import EntityType, TelegramEntity
+from .utf16 import Utf16Index
+
+MAX_LENGTH = 4096
+
+_WORD_SEPARATOR_RE = re.compile(r"[ \t]+")
+
+
+def split_entities_for_telegram(
+    text: str,
+    entities: Sequence[Union[dict, TelegramEntity]],
+    max_length: int = MAX_LENGTH,
+) -> List[Tuple[str, List[dict]]]:
+    """
+    Split plain text and its entities into messages of at most ``max_length``.
+
+    Lengths are measured in UTF-16 code units, like Telegram does. A cut goes
+    on the last paragraph break of the message if there is one in its second
+    half, otherwise on the last line break, then on the last run of spaces,
+    and only then in the middle of a word. The separator at a cut is dropped.
+    Inside a ``pre`` entity only line breaks are used, so code keeps its
+    indentation and each part keeps the block's ``language``.
+
+    Entities crossing a cut are clipped to each message and re-based to its
+    start. The offsets already computed are reused, so the whole split is
+    linear in the text plus the entities it returns.
+
+    Args:
+        text: Plain text, as returned by ``telegram_format_entities``
+        entities: Entity dicts or :class:`TelegramEntity` objects with
+            offsets in UTF-16 code units
+        max_length: Maximum message length in UTF-16 code units
+
+    Returns:
+        List of ``(text, entities)`` pairs, entities as dicts
+    """
+    if max_length < 2:
+        raise ValueError("max_length should be at least 2")
+
+    index = Utf16Index(text)
+    pending = sorted(
+        (
+            e if isinstance(e, TelegramEntity) else TelegramEntity.from_dict(e)
+            for e in entities
+        ),
+        key=lambda e: e.offset,
+    )
+    messages: List[Tuple[str, List[dict]]] = []
+    # Entities starting before the current window that may still reach into it.
+    active: List[TelegramEntity] = []
+    next_entity = 0
+    start = 0
+
+    while start < len(text):
+        start_utf16 = index.char_to_utf16(start)
+        limit = index.utf16_to_char(start_utf16 + max_length)
+        if index.char_to_utf16(limit) > start_utf16 + max_length:
+            # The window ends inside a surrogate pair.
+            limit -= 1
+
+        limit_utf16 = index.char_to_utf16(limit)
+        while next_entity < len(pending) and pending[next_entity].offset < limit_utf16:
+            active.append(pending[next_entity])
+            next_entity += 1
+
+        if limit >= len(text):
+            end = next_start = len(text)
+        else:
+            in_pre = any(
+                e.type == EntityType.PRE and e.offset < limit_utf16 < e.offset + e.length
+                for e in active
+            )
+            end, next_start = _find_cut(text, start, limit, in_pre)
+
+        end_utf16 = index.char_to_utf16(end)
+        chunk_entities = []
+        for e in active:
+            clipped_start = max(e.offset, start_utf16)
+            clipped_end = min(e.offset + e.length, end_utf16)
+            if clipped_end > clipped_start:
+                chunk_entities.append(
+                    TelegramEntity(
+                        type=e.type,
+                        offset=clipped_start - start_utf16,
+                        length=clipped_end - clipped_start,
+                        url=e.url,
+                        language=e.language,
+                    ).to_dict()
+                )
+        chunk = text[start:end]
+        if chunk:
+            messages.append((chunk, chunk_entities))
+
+        next_start_utf16 = index.char_to_utf16(next_start)
+        active = [e for e in active if e.offset + e.length > next_start_utf16]
+        start = next_start
+
+    return messages
+
+
+def _find_cut(text: str, start: int, limit: int, in_pre: bool) -> Tuple[int, int]:
+    """
+    Return ``(end, next_start)`` for a message starting at ``start``.
+
+    ``text[end:next_start]`` is the separator dropped at the cut; ``end`` is
+    never past ``limit`` and always past ``start``.
+    """
+    if not in_pre:
+        paragraph = text.rfind("\n\n", start + 1, limit + 2)
+        if paragraph >= start + (limit - start) // 2:
+            return paragraph, paragraph + 2
+    line = text.rfind("\n", start + 1, limit + 1)
+    if line != -1:
+        return line, line + 1
+    if not in_pre:
+        last_space = None
+        for match in _WORD_SEPARATOR_RE.finditer(text, start + 1, limit + 1):
+            last_space = match
+        if last_space is not None:
+            return last_space.start(), last_space.end()
+    return limit, limit
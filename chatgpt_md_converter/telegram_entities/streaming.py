@@ -0,0 +1,90 @@
+"""Incremental Markdown → (text, entities) conversion for streamed text."""
+
+from typing import List, Tuple
+
+from ..telegram_markdown.fences import scan_fences
+from ..telegram_markdown.streaming import BlockCutter
+from .entity import TelegramEntity
+from .extractors.inline import _ENGINES
+from .parser import parse_entities
+from .utf16 import utf16_len
+
+
+class StreamingEntityFormatter:
+    """Convert a growing Markdown buffer without re-parsing finished blocks.
+
+    Finished blocks are found the same way as in
+    :class:`~chatgpt_md_converter.StreamingTelegramFormatter`. Their plain
+    text and entities, with offsets already in UTF-16 code units, are frozen
+    once. Each :meth:`snapshot` parses only the open tail and shifts its
+    entities past the frozen text.
+    """
+
+    def __init__(self, engine: str = "regex") -> None:
+        if engine not in _ENGINES:
+            raise ValueError(f"unknown engine {engine!r}, expected one of {_ENGINES}")
+        self._engine = engine
+        self._cutter = BlockCutter(exact_fences=True)
+        self._text_parts: List[str] = []
+        self._entities: List[TelegramEntity] = []
+        self._utf16_length = 0
+
+    @property
+    def text(self) -> str:
+        """The Markdown that has not been frozen yet."""
+        return self._cutter.text
+
+    def feed(self, delta: str) -> None:
+        """Append ``delta`` to the buffer and freeze any finished blocks."""
+        if not delta:
+            return
+        boundary = self._cutter.feed(delta)
+        if boundary is None:
+            return
+        scan = scan_fences(self.text[:boundary])
+        if (
+            scan.open_fence_exact is not None
+            or scan.triple_backticks % 2
+            or scan.single_backticks % 2
+        ):
+            return
+        text, entities = parse_entities(self._cutter.cut(boundary), self._engine)
+        if not text:
+            return
+        shift = self._separator_length()
+        self._entities.extend(_shifted(entities, shift))
+        self._text_parts.append(text)
+        self._utf16_length = shift + utf16_len(text)
+
+    def snapshot(self) -> Tuple[str, List[dict]]:
+        """Return ``(plain_text, entities)`` for everything fed so far.
+
+        The result has the same shape as
+        :func:`~chatgpt_md_converter.telegram_format_entities`.
+        """
+        parts = list(self._text_parts)
+        entities = list(self._entities)
+        text, tail_entities = parse_entities(self.text, self._engine)
+        if text:
+            entities.extend(_shifted(tail_entities, self._separator_length()))
+            parts.append(text)
+        return "\n\n".join(parts), [e.to_dict() for e in entities]
+
+    def _separator_length(self) -> int:
+        """UTF-16 offset at which the next block starts."""
+        return self._utf16_length + 2 if self._text_parts else 0
+
+
+def _shifted(entities: List[TelegramEntity], shift: int) -> List[TelegramEntity]:
+    if not shift:
+        return entities
+    return [
+        TelegramEntity(
+            type=e.type,
+            offset=e.offset + shift,
+            length=e.length,
+            url=e.url,
+            language=e.language,
+        )
+        for e in entities
+    ]
@@ -1,5 +1,115 @@
 """UTF-16 encoding utilities for Telegram entity offset calculation."""
 
+import re
+from bisect import bisect_left
+from typing import List, Optional
+
+try:  # Optional vectorised backend for very large texts.
+    import numpy as _np
+except ImportError:  # pragma: no cover - depends on the environment
+    _np = None
+
+# Characters outside the Basic Multilingual Plane take two UTF-16 code units.
+_ASTRAL_RE = re.compile("[\U00010000-\U0010FFFF]")
+# Texts at least this long use numpy, when it is installed.
+_VECTORIZE_FROM = 1 << 16
+
+
+def _is_bmp(text: str) -> bool:
+    """Return True if every character of ``text`` is a single UTF-16 unit."""
+    return text.isascii() or _ASTRAL_RE.search(text) is None
+
+
+class Utf16Index:
+    """
+    Precomputed mapping between Python string indices and UTF-16 offsets.
+
+    Build it once per text, then convert any number of positions. Texts
+    without characters outside the BMP map one to one and store nothing.
+    Otherwise a prefix table gives O(1) char → UTF-16 lookups and
+    O(log n) UTF-16 → char lookups.
+
+    Args:
+        text: The full text string
+        vectorized: Build the table with numpy. ``None`` (the default) uses
+            numpy for long texts when it is installed.
+    """
+
+    def __init__(self, text: str, vectorized: Optional[bool] = None):
+        if vectorized and _np is None:
+            raise ImportError("vectorized Utf16Index requires numpy")
+        self.text = text
+        self._prefix = None
+        if _is_bmp(text):
+            self.utf16_length = len(text)
+            return
+        if vectorized is None:
+            vectorized = _np is not None and len(text) >= _VECTORIZE_FROM
+        if vectorized:
+            self._prefix = _numpy_prefix(text)
+        else:
+            self._prefix = _python_prefix(text)
+        self.utf16_length = int(self._prefix[-1])
+
+    def char_to_utf16(self, char_index: int) -> int:
+        """
+        Convert a Python string index to a UTF-16 offset.
+
+        Indices outside ``0..len(text)`` are clamped to that range.
+
+        Args:
+            char_index: Python string index, from 0 to ``len(text)``
+
+        Returns:
+            UTF-16 offset for the same position
+        """
+        char_index = min(max(char_index, 0), len(self.text))
+        if self._prefix is None:
+            return char_index
+        return int(self._prefix[char_index])
+
+    def utf16_to_char(self, utf16_offset: int) -> int:
+        """
+        Convert a UTF-16 offset to a Python string index.
+
+        An offset inside a surrogate pair maps to the character after it.
+
+        Args:
+            utf16_offset: UTF-16 offset
+
+        Returns:
+            Python string index for the same position
+        """
+        if utf16_offset <= 0:
+            return 0
+        if self._prefix is None:
+            return min(utf16_offset, len(self.text))
+        if isinstance(self._prefix, list):
+            index = bisect_left(self._prefix, utf16_offset)
+        else:
+            index = int(_np.searchsorted(self._prefix, utf16_offset, side="left"))
+        return min(index, len(self.text))
+
+
+def _python_prefix(text: str) -> List[int]:
+    """UTF-16 offset of every position in ``text``, built with slice fills."""
+    prefix = list(range(len(text) + 1))
+    astral = [match.start() for match in _ASTRAL_RE.finditer(text)]
+    # Positions after the n-th astral character are shifted by n.
+    for count, position in enumerate(astral, start=1):
+        end = astral[count] + 1 if count < len(astral) else len(text) + 1
+        prefix[position + 1 : end] = range(position + 1 + count, end + count)
+    return prefix
+
+
+def _numpy_prefix(text: str):
+    """Same as :func:`_python_prefix`, as a numpy array."""
+    code_points = _np.frombuffer(text.encode("utf-32-le"), dtype=_np.uint32)
+    widths = (code_points > 0xFFFF).astype(_np.int64) + 1
+    prefix = _np.zeros(len(text) + 1, dtype=_np.int64)
+    _np.cumsum(widths, out=prefix[1:])
+    return prefix
+
 
 def utf16_len(text: str) -> int:
     """
@@ -14,6 +124,8 @@ def utf16_len(text: str) -> int:
     Returns:
         Length in UTF-16 code units
     """
+    if _is_bmp(text):
+        return len(text)
     return len(text.encode("utf-16-le")) // 2
 
 
@@ -21,6 +133,11 @@ def char_to_utf16_offset(text: str, char_index: int) -> int:
     """
     Convert a Python string index to a UTF-16 offset.
 
+    ``char_index`` is read like a slice end, so it may be negative or past
+    the end. Only ``text[:char_index]`` is measured, which for a single
+    lookup is cheaper than building an index of the whole text; code that
+    converts many positions should build a :class:`Utf16Index` once.
+
     Args:
         text: The full text string
         char_index: Python string index (0-based)
@@ -42,9 +159,4 @@ def utf16_to_char_offset(text: str, utf16_offset: int) -> int:
     Returns:
         Python string index for the same position
     """
-    current_utf16 = 0
-    for i, char in enumerate(text):
-        if current_utf16 >= utf16_offset:
-            return i
-        current_utf16 += len(char.encode("utf-16-le")) // 2
-    return len(text)
+    return Utf16Index(text).utf16_to_char(utf16_offset)
@@ -1,5 +1,6 @@
 """Modular Telegram Markdown → HTML conversion helpers."""
 
 from .renderer import telegram_format
+from .streaming import StreamingTelegramFormatter
 
-__all__ = ["telegram_format"]
+__all__ = ["telegram_format", "StreamingTelegramFormatter"]
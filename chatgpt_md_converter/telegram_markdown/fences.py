@@ -0,0 +1,349 @@
+"""Single-pass scanner for Markdown code fences and backticks.
+
+Both converters need the same facts about backticks before they can touch
+anything else: where fenced blocks are, whether a fence line was left open,
+how many stray backticks remain outside blocks and where single-line inline
+code spans sit. :func:`scan_fences` collects all of them from one pass over
+the backtick runs of the text.
+"""
+
+from __future__ import annotations
+
+import re
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+_RUN_RE = re.compile(r"`+")
+_WORD_RE = re.compile(r"\w+")
+_FENCE_LINE_RE = re.compile(r"(?P<fence>`{3,})(?P<lang>\w+)?")
+# Line boundaries recognised by ``str.splitlines``.
+_LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+_LINE_BREAK_RE = re.compile(f"[{_LINE_BREAKS}]")
+
+
+@dataclass
+class FenceBlock:
+    """A fenced code block; ``code`` excludes the fences and language tag."""
+
+    start: int
+    end: int
+    fence: str
+    language: Optional[str]
+    code_start: int
+    code_end: int
+
+
+@dataclass
+class _Tally:
+    """Backtick counts over the text with fenced blocks removed."""
+
+    triple: int = 0
+    unescaped: int = 0
+    single: int = 0
+
+
+@dataclass
+class FenceScan:
+    """Result of :func:`scan_fences`.
+
+    Attributes:
+        text: The scanned text.
+        blocks: Fenced blocks; the newline after the fence is optional.
+        open_fence: Fence left open by a line-based scan in which any line
+            ending with the fence closes it, or ``None``.
+        open_fence_exact: Same, but only a line equal to the fence closes it.
+    """
+
+    text: str
+    blocks: List[FenceBlock]
+    open_fence: Optional[str]
+    open_fence_exact: Optional[str]
+    _runs: List[Tuple[int, int]] = field(repr=False)
+    _tally: _Tally = field(repr=False)
+
+    @property
+    def triple_backticks(self) -> int:
+        """Non-overlapping ````` occurrences outside :attr:`blocks`."""
+        return self._tally.triple
+
+    @property
+    def unescaped_backticks(self) -> int:
+        """Backticks outside :attr:`blocks` not escaped by a backslash."""
+        return self._tally.unescaped
+
+    @property
+    def single_backticks(self) -> int:
+        """Backticks outside :attr:`blocks` that are not part of a longer run."""
+        return self._tally.single
+
+    def extend(self, suffix: str) -> "FenceScan":
+        """Return the scan of ``text + suffix`` without rescanning ``text``.
+
+        Only the suffix is searched for backticks. Blocks are re-matched over
+        the known runs, since a longer closing run can change which fence an
+        earlier opener settles on. The line-based open-fence state is carried
+        over unchanged.
+        """
+        old_length = len(self.text)
+        text = self.text + suffix
+        runs = list(self._runs)
+        rescan_from = old_length
+        if runs and runs[-1][1] == old_length and suffix.startswith("`"):
+            rescan_from = runs.pop()[0]
+        runs.extend(m.span() for m in _RUN_RE.finditer(text, rescan_from))
+        blocks = _match_blocks(text, runs)
+        return FenceScan(
+            text,
+            blocks,
+            self.open_fence,
+            self.open_fence_exact,
+            runs,
+            _count_backticks(text, runs, blocks),
+        )
+
+    def strict_blocks(self) -> List[FenceBlock]:
+        """Fenced blocks whose fence must be followed by a newline.
+
+        The newline ends the opening line and is not part of ``code``.
+        """
+        text = self.text
+        runs = self._runs
+        longest_after = _longest_after(runs)
+        blocks: List[FenceBlock] = []
+        pos = 0
+        index = 0
+        while index < len(runs):
+            start, end = runs[index]
+            start = max(start, pos)
+            fence_length = min(end - start, longest_after[index + 1])
+            if fence_length < 3:
+                index += 1
+                continue
+            lang = _WORD_RE.match(text, end)
+            lang_end = lang.end() if lang else end
+            if lang_end >= len(text) or text[lang_end] != "\n":
+                index += 1
+                continue
+            closer = index + 1
+            while runs[closer][1] - runs[closer][0] < fence_length:
+                closer += 1
+            close_start = runs[closer][0]
+            blocks.append(
+                FenceBlock(
+                    start=end - fence_length,
+                    end=close_start + fence_length,
+                    fence="`" * fence_length,
+                    language=lang.group() if lang else None,
+                    code_start=lang_end + 1,
+                    code_end=close_start,
+                )
+            )
+            pos = close_start + fence_length
+            index = closer
+        return blocks
+
+    def inline_code(self, blocks: List[FenceBlock]) -> List[Tuple[int, int]]:
+        """Spans of single-line ```code``` outside ``blocks``, backticks included.
+
+        Each block counts as one opaque, newline-free character, as if it had
+        been replaced by a placeholder.
+        """
+        text = self.text
+        spans: List[Tuple[int, int]] = []
+        opener = -1
+        block_index = 0
+        for start, end in _clip_runs(self._runs, blocks):
+            if opener >= 0 and not _has_newline(text, opener + 1, start, blocks, block_index):
+                spans.append((opener, start + 1))
+                start += 1
+                opener = -1
+            while block_index < len(blocks) and blocks[block_index].end <= start:
+                block_index += 1
+            if start < end:
+                opener = end - 1
+        return spans
+
+
+def scan_fences(text: str) -> FenceScan:
+    """Scan ``text`` for code fences, open fence lines and stray backticks."""
+    runs = [m.span() for m in _RUN_RE.finditer(text)]
+    blocks = _match_blocks(text, runs)
+    open_fence, open_fence_exact = _open_fences(text, runs)
+    return FenceScan(
+        text,
+        blocks,
+        open_fence,
+        open_fence_exact,
+        runs,
+        _count_backticks(text, runs, blocks),
+    )
+
+
+def _longest_after(runs: List[Tuple[int, int]]) -> List[int]:
+    """``longest_after[i]`` is the longest run among ``runs[i:]``."""
+    longest = [0] * (len(runs) + 1)
+    for index in range(len(runs) - 1, -1, -1):
+        start, end = runs[index]
+        longest[index] = max(longest[index + 1], end - start)
+    return longest
+
+
+def _match_blocks(text: str, runs: List[Tuple[int, int]]) -> List[FenceBlock]:
+    """Find fenced blocks, leftmost first.
+
+    A fence of ``n`` backticks is closed by the next ``n`` backticks, and a
+    longer opening run gives up backticks until a closer exists, exactly as
+    the backtracking pattern ```(`{3,})(\\w+)?\\n?[\\s\\S]*?\\1``` would.
+    """
+    longest_after = _longest_after(runs)
+    blocks: List[FenceBlock] = []
+    pos = 0
+    index = 0
+    while index < len(runs):
+        start, end = runs[index]
+        start = max(start, pos)
+        available = end - start
+        fence_length = max(min(available, longest_after[index + 1]), available // 2)
+        if fence_length < 3:
+            index += 1
+            continue
+        if 2 * fence_length <= available:
+            close_start = start + fence_length
+            closer = index
+        else:
+            closer = index + 1
+            while runs[closer][1] - runs[closer][0] < fence_length:
+                closer += 1
+            close_start = runs[closer][0]
+
+        code_start = start + fence_length
+        lang = _WORD_RE.match(text, code_start, close_start)
+        if lang:
+            code_start = lang.end()
+        if code_start < close_start and text[code_start] == "\n":
+            code_start += 1
+        blocks.append(
+            FenceBlock(
+                start=start,
+                end=close_start + fence_length,
+                fence="`" * fence_length,
+                language=lang.group() if lang else None,
+                code_start=code_start,
+                code_end=close_start,
+            )
+        )
+        pos = close_start + fence_length
+        index = closer
+    return blocks
+
+
+def _clip_runs(
+    runs: List[Tuple[int, int]], blocks: List[FenceBlock]
+) -> List[Tuple[int, int]]:
+    """Return the parts of ``runs`` that lie outside ``blocks``."""
+    clipped: List[Tuple[int, int]] = []
+    block_index = 0
+    for start, end in runs:
+        while block_index < len(blocks) and blocks[block_index].end <= start:
+            block_index += 1
+        while start < end:
+            if block_index < len(blocks) and blocks[block_index].start < end:
+                block = blocks[block_index]
+                if block.start > start:
+                    clipped.append((start, block.start))
+                start = max(start, block.end)
+                if block.end <= end:
+                    block_index += 1
+                continue
+            clipped.append((start, end))
+            break
+    return clipped
+
+
+def _count_backticks(
+    text: str, runs: List[Tuple[int, int]], blocks: List[FenceBlock]
+) -> _Tally:
+    """Count backticks as if ``blocks`` were cut out of ``text``.
+
+    A run left after a block's closing fence cannot merge with backticks
+    before the block: a block starts at the beginning of a run or right
+    where the previous block ended.
+    """
+    tally = _Tally()
+    ends = [block.end for block in blocks]
+    for start, end in _clip_runs(runs, blocks):
+        length = end - start
+        tally.triple += length // 3
+        tally.single += length == 1
+        tally.unescaped += length - (_backslashes_before(text, start, blocks, ends) % 2)
+    return tally
+
+
+def _backslashes_before(
+    text: str, pos: int, blocks: List[FenceBlock], ends: List[int]
+) -> int:
+    """Count backslashes before ``pos``, skipping over removed blocks."""
+    count = 0
+    while True:
+        index = bisect_left(ends, pos + 1) - 1
+        floor = ends[index] if index >= 0 else 0
+        while pos > floor and text[pos - 1] == "\\":
+            pos -= 1
+            count += 1
+        if pos != floor or index < 0:
+            return count
+        pos = blocks[index].start
+
+
+def _has_newline(
+    text: str, start: int, end: int, blocks: List[FenceBlock], block_index: int
+) -> bool:
+    """Return True if ``text[start:end]`` has a newline outside ``blocks``."""
+    while block_index < len(blocks) and blocks[block_index].start < end:
+        block = blocks[block_index]
+        if block.end > start:
+            if text.find("\n", start, block.start) >= 0:
+                return True
+            start = block.end
+        block_index += 1
+    return text.find("\n", start, end) >= 0
+
+
+def _open_fences(
+    text: str, runs: List[Tuple[int, int]]
+) -> Tuple[Optional[str], Optional[str]]:
+    """Replay the line-by-line fence tracking of both converters.
+
+    Only lines containing three or more backticks can open or close a
+    fence, so lines are located from the backtick runs instead of walking
+    every line of the text.
+    """
+    open_fence: Optional[str] = None
+    open_fence_exact: Optional[str] = None
+    line_end = -1
+    for start, end in runs:
+        if end - start < 3 or start <= line_end:
+            continue
+        line_start = max(text.rfind(ch, line_end + 1, start) for ch in _LINE_BREAKS) + 1
+        line_start = max(line_start, line_end + 1)
+        if line_start and text[line_start - 1] == "\r" and text.startswith("\n", line_start):
+            line_start += 1
+        newline = _LINE_BREAK_RE.search(text, end)
+        line_end = newline.start() if newline else len(text)
+        stripped = text[line_start:line_end].strip()
+
+        if open_fence is None:
+            match = _FENCE_LINE_RE.fullmatch(stripped)
+            if match:
+                open_fence = match.group("fence")
+        elif stripped.endswith(open_fence):
+            open_fence = None
+
+        if open_fence_exact is None:
+            match = _FENCE_LINE_RE.fullmatch(stripped)
+            if match:
+                open_fence_exact = match.group("fence")
+        elif stripped == open_fence_exact:
+            open_fence_exact = None
+    return open_fence, open_fence_exact
@@ -10,9 +10,23 @@ from .inline import (apply_custom_italic, convert_html_chars,
                      extract_inline_code_snippets, split_by_tag)
 from .postprocess import remove_blockquote_escaping, remove_spoiler_escaping
 from .preprocess import combine_blockquotes
+from .tokenizer import tokenize_format
 
+_ENGINES = ("regex", "tokenizer")
+
+
+def telegram_format(text: str, engine: str = "regex") -> str:
+    """Convert Markdown to Telegram HTML.
+
+    ``engine`` selects the implementation: ``"regex"`` (default) applies one
+    substitution per construct, ``"tokenizer"`` resolves everything in a
+    single scan and emits the HTML in one join. Both produce the same output.
+    """
+    if engine == "tokenizer":
+        return tokenize_format(text)
+    if engine != "regex":
+        raise ValueError(f"unknown engine {engine!r}, expected one of {_ENGINES}")
 
-def telegram_format(text: str) -> str:
     output, block_map = extract_and_convert_code_blocks(text)
     output = combine_blockquotes(output)
     output, inline_snippets = extract_inline_code_snippets(output)
@@ -0,0 +1,134 @@
+"""Incremental Telegram Markdown → HTML rendering for streamed text."""
+
+from __future__ import annotations
+
+import re
+from typing import List, Optional
+
+from .fences import FenceScan, scan_fences
+from .renderer import _ENGINES, telegram_format
+
+_FENCE_LINE_RE = re.compile(r"(?P<fence>`{3,})(?P<lang>\w+)?")
+
+
+class BlockCutter:
+    """Find the point up to which a growing Markdown buffer is finished.
+
+    Complete lines are scanned once, tracking fences line by line. A cut is
+    the start of a blank line that lies outside a fence and is followed by
+    at least one more complete line. ``exact_fences`` selects the closing
+    rule: a line equal to the fence, instead of any line ending with it.
+    """
+
+    def __init__(self, exact_fences: bool = False) -> None:
+        self.text = ""
+        self._exact_fences = exact_fences
+        self._line_start = 0
+        self._fence: Optional[str] = None
+        self._blank_at: Optional[int] = None
+
+    def feed(self, delta: str) -> Optional[int]:
+        """Append ``delta`` and return the last new cut, if any."""
+        self.text += delta
+        text = self.text
+        boundary = None
+        while True:
+            line_end = text.find("\n", self._line_start)
+            if line_end < 0:
+                break
+            line = text[self._line_start : line_end]
+            stripped = line.strip()
+            if self._fence is None:
+                if not line:
+                    if self._line_start:
+                        self._blank_at = self._line_start
+                    self._line_start = line_end + 1
+                    continue
+                if self._blank_at is not None:
+                    boundary = self._blank_at
+                    self._blank_at = None
+                match = _FENCE_LINE_RE.fullmatch(stripped)
+                if match:
+                    self._fence = match.group("fence")
+            elif (
+                stripped == self._fence
+                if self._exact_fences
+                else stripped.endswith(self._fence)
+            ):
+                self._fence = None
+            self._line_start = line_end + 1
+        return boundary
+
+    def cut(self, boundary: int) -> str:
+        """Remove and return ``text[:boundary]``."""
+        head = self.text[:boundary]
+        self.text = self.text[boundary:]
+        self._line_start -= boundary
+        if self._blank_at is not None:
+            self._blank_at -= boundary
+        return head
+
+
+def _is_balanced(scan: FenceScan) -> bool:
+    """Return True if closing delimiters would leave the scanned text as is."""
+    return (
+        scan.open_fence is None
+        and scan.triple_backticks % 2 == 0
+        and scan.unescaped_backticks % 2 == 0
+    )
+
+
+class StreamingTelegramFormatter:
+    """Render a growing Markdown buffer without re-rendering finished blocks.
+
+    Text is split at blank lines that lie outside code fences. Once a blank
+    line is followed by more text and everything before it is balanced (no
+    open fence, no dangling backtick), that prefix is rendered once and
+    cached. Each :meth:`snapshot` renders only the open tail, with missing
+    fences closed exactly as :func:`telegram_format` closes them.
+
+    Formatting never spans a cached boundary, so ``**bold`` that runs over a
+    blank line stays literal in the cached block.
+
+    Example:
+        >>> formatter = StreamingTelegramFormatter()
+        >>> for delta in ("Hello **wor", "ld**\\n\\n```py\\nprint(1)"):
+        ...     formatter.feed(delta)
+        ...     html = formatter.snapshot()
+        >>> print(html)
+        Hello <b>world</b>
+        <BLANKLINE>
+        <pre><code class="language-py">print(1)
+        </code></pre>
+    """
+
+    def __init__(self, engine: str = "regex") -> None:
+        if engine not in _ENGINES:
+            raise ValueError(f"unknown engine {engine!r}, expected one of {_ENGINES}")
+        self._engine = engine
+        self._blocks: List[str] = []
+        self._cutter = BlockCutter()
+
+    @property
+    def text(self) -> str:
+        """The Markdown that has not been cached yet."""
+        return self._cutter.text
+
+    def feed(self, delta: str) -> None:
+        """Append ``delta`` to the buffer and cache any finished blocks."""
+        if not delta:
+            return
+        boundary = self._cutter.feed(delta)
+        if boundary is None or not _is_balanced(scan_fences(self.text[:boundary])):
+            return
+        html = telegram_format(self._cutter.cut(boundary), engine=self._engine)
+        if html:
+            self._blocks.append(html)
+
+    def snapshot(self) -> str:
+        """Return Telegram HTML for everything fed so far."""
+        parts = list(self._blocks)
+        tail = telegram_format(self.text, engine=self._engine)
+        if tail:
+            parts.append(tail)
+        return "\n\n".join(parts)
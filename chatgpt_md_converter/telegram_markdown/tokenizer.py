@@ -0,0 +1,565 @@
+"""Single-scan tokenizer engine for Telegram Markdown → HTML conversion.
+
+The regex engine in :mod:`.renderer` rewrites the whole message once per
+construct. This engine builds one working string, records every conversion
+as an edit against that string's coordinates and splices the HTML together
+in a single join at the end. Delimiters are resolved over the positions of
+marker characters only, using the same precedence and boundary rules as the
+regex engine, and rules the regex engine applies to an already rewritten
+string (citations are removed before links are matched) are applied to the
+same view of the text here.
+"""
+
+from __future__ import annotations
+
+import re
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .code_blocks import close_fences, extract_and_convert_code_blocks
+from .fences import scan_fences
+from .html_escape import escape_code_content
+from .inline import convert_html_chars
+from .postprocess import remove_blockquote_escaping, remove_spoiler_escaping
+from .preprocess import combine_blockquotes
+
+_INLINE_CODE_RE = re.compile(r"`([^`]+)`")
+_PLACEHOLDER_RE = re.compile(r"(CODEBLOCK|INLINECODE)PLACEHOLDER_(\d+)_")
+_HEADING_RE = re.compile(r"^#{1,6}\s+(?P<title>.+)$", flags=re.MULTILINE)
+_BULLET_RE = re.compile(r"^\s*(?P<bullet>[\-\*])\s+(?P<item>.+)$", flags=re.MULTILINE)
+_MARKER_RE = re.compile(r"[*_~|]")
+_CITATION_RE = re.compile(r"【[^】]+】")
+_EMOJI_RE = re.compile(r"!\[(?P<alt>[^\]]*)\]\(tg://emoji\?id=(?P<emoji_id>\d+)\)")
+_LINK_RE = re.compile(r"!?\[(?P<label>(?:[^\[\]]|\[.*?\])*)\]\((?P<url>[^)]+)\)")
+_BLOCKQUOTE_RE = re.compile(r"<blockquote(?: expandable)?>.*?</blockquote>", flags=re.DOTALL)
+_BLANK_LINES_RE = re.compile(r"\n{2,}")
+
+# Stand-in for a position already rewritten into an HTML tag: non-space,
+# not alphanumeric, not a backslash and not a Markdown marker.
+_TAG = ">"
+_WORD = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_")
+_ALNUM_OR_BACKSLASH = (_WORD - {"_"}) | {"\\"}
+
+
+def _is_space(char: Optional[str]) -> bool:
+    return char is None or char.isspace()
+
+
+class _Delimiter:
+    """Opening/closing rules of one inline construct, mirroring its regex."""
+
+    __slots__ = ("marker", "length", "single_line", "open_html", "close_html", "opens", "closes")
+
+    def __init__(
+        self,
+        marker: str,
+        length: int,
+        open_html: str,
+        close_html: str,
+        opens: Callable[["_Document", int], bool],
+        closes: Callable[["_Document", int], bool],
+        single_line: bool = False,
+    ) -> None:
+        self.marker = marker
+        self.length = length
+        self.single_line = single_line
+        self.open_html = open_html
+        self.close_html = close_html
+        self.opens = opens
+        self.closes = closes
+
+
+def _always(doc: "_Document", pos: int) -> bool:
+    return True
+
+
+def _bold_opens(doc: "_Document", pos: int) -> bool:
+    return doc.before(pos) != "\\" and not _is_space(doc.after(pos + 2))
+
+
+def _pair_closes(doc: "_Document", pos: int) -> bool:
+    return not _is_space(doc.before(pos))
+
+
+def _underline_opens(doc: "_Document", pos: int) -> bool:
+    before = doc.before(pos)
+    return before != "\\" and before not in _WORD and not _is_space(doc.after(pos + 2))
+
+
+def _underline_closes(doc: "_Document", pos: int) -> bool:
+    return not _is_space(doc.before(pos)) and doc.after(pos + 2) not in _WORD
+
+
+def _star_italic_opens(doc: "_Document", pos: int) -> bool:
+    if doc.before(pos) in _ALNUM_OR_BACKSLASH:
+        return False
+    after = doc.after(pos + 1)
+    return after != "*" and not _is_space(after)
+
+
+def _star_italic_closes(doc: "_Document", pos: int) -> bool:
+    before = doc.before(pos)
+    return not _is_space(before) and before != "\\" and doc.after(pos + 1) not in _ALNUM_OR_BACKSLASH
+
+
+def _underscore_italic_opens(doc: "_Document", pos: int) -> bool:
+    before = doc.before(pos)
+    return before != "\\" and before not in _WORD and not _is_space(doc.after(pos + 1))
+
+
+def _underscore_italic_closes(doc: "_Document", pos: int) -> bool:
+    return not _is_space(doc.before(pos)) and doc.after(pos + 1) not in _WORD
+
+
+# Same order as the substitutions in ``renderer.telegram_format``.
+_DELIMITERS: Tuple[_Delimiter, ...] = (
+    _Delimiter("*", 3, "<b><i>", "</i></b>", _always, _always, single_line=True),
+    _Delimiter("_", 3, "<u><i>", "</i></u>", _always, _always, single_line=True),
+    _Delimiter("*", 2, "<b>", "</b>", _bold_opens, _pair_closes),
+    _Delimiter("_", 2, "<u>", "</u>", _underline_opens, _underline_closes),
+    _Delimiter("~", 2, "<s>", "</s>", _bold_opens, _pair_closes),
+    _Delimiter(
+        "|", 2, '<span class="tg-spoiler">', "</span>", _bold_opens, _pair_closes,
+        single_line=True,
+    ),
+    _Delimiter("*", 1, "<i>", "</i>", _star_italic_opens, _star_italic_closes),
+    _Delimiter("_", 1, "<i>", "</i>", _underscore_italic_opens, _underscore_italic_closes),
+)
+
+
+class _Document:
+    """Working string plus the edits that turn it into Telegram HTML."""
+
+    def __init__(self, text: str, code_html: List[str], snippets: List[str]) -> None:
+        self.text = text
+        self.length = len(text)
+        self.code_html = code_html
+        self.snippets = snippets
+        # Positions already rewritten by an earlier stage read as a tag.
+        self.tagged = bytearray(self.length)
+        self.tag_before: set[int] = set()
+        self.tag_after: set[int] = set()
+        # (start, end, html, renderer) against ``text`` coordinates.
+        self.edits: List[Tuple[int, int, str, Optional[Callable[[], str]]]] = []
+        # Ranges of the constructs found, kept only for ``find_safe_cuts``.
+        self.spans: Optional[List[Tuple[int, int]]] = None
+        self.citations: List[Tuple[int, int]] = []
+
+    def before(self, pos: int) -> Optional[str]:
+        """Character the regex engine would see just before ``pos``."""
+        if pos in self.tag_before:
+            return _TAG
+        if pos <= 0:
+            return None
+        if self.tagged[pos - 1]:
+            return _TAG
+        return self.text[pos - 1]
+
+    def after(self, pos: int) -> Optional[str]:
+        """Character the regex engine would see at ``pos``."""
+        if pos in self.tag_after:
+            return _TAG
+        if pos >= self.length:
+            return None
+        if self.tagged[pos]:
+            return _TAG
+        return self.text[pos]
+
+    def is_run(self, pos: int, delimiter: _Delimiter) -> bool:
+        end = pos + delimiter.length
+        if end > self.length:
+            return False
+        if self.text[pos:end] != delimiter.marker * delimiter.length:
+            return False
+        return not any(self.tagged[pos:end])
+
+    def scan_lines(self) -> None:
+        """Record heading and list edits."""
+        headings: List[Tuple[int, int]] = []
+        if "#" in self.text:
+            for match in _HEADING_RE.finditer(self.text):
+                title_start, title_end = match.span("title")
+                self.edits.append((match.start(), title_start, "<b>", None))
+                self.edits.append((title_end, title_end, "</b>", None))
+                self.tag_before.add(title_start)
+                self.tag_after.add(title_end)
+                headings.append(match.span())
+        if self.spans is not None:
+            self.spans.extend(headings)
+
+        index = 0
+        for match in _BULLET_RE.finditer(self.text):
+            bullet = match.start("bullet")
+            # A heading has already turned its lines into ``<b>...</b>``.
+            while index < len(headings) and headings[index][1] <= bullet:
+                index += 1
+            if index < len(headings) and headings[index][0] <= bullet:
+                continue
+            self.edits.append((bullet, match.start("item"), "• ", None))
+            self.tagged[bullet] = 1
+            if self.spans is not None:
+                self.spans.append((bullet, match.end()))
+
+    def resolve_inline(self) -> None:
+        """Pair delimiter runs construct by construct over marker positions."""
+        positions: Dict[str, List[int]] = {"*": [], "_": [], "~": [], "|": []}
+        for match in _MARKER_RE.finditer(self.text):
+            positions[match.group()].append(match.start())
+
+        for delimiter in _DELIMITERS:
+            pairs = self._pair(positions[delimiter.marker], delimiter)
+            length = delimiter.length
+            for opener, closer in pairs:
+                self.edits.append((opener, opener + length, delimiter.open_html, None))
+                self.edits.append((closer, closer + length, delimiter.close_html, None))
+                self.tagged[opener : opener + length] = b"\x01" * length
+                self.tagged[closer : closer + length] = b"\x01" * length
+            if self.spans is not None:
+                self.spans.extend((opener, closer + length) for opener, closer in pairs)
+
+    def _pair(self, positions: List[int], delimiter: _Delimiter) -> List[Tuple[int, int]]:
+        # A lazy ``(.*?)`` match always takes the first valid closer, and a
+        # later opener can only see a subset of an earlier opener's closers,
+        # so one pending opener per construct is enough.
+        pairs: List[Tuple[int, int]] = []
+        length = delimiter.length
+        resume = 0
+        opener = -1
+        limit = self.length
+        for pos in positions:
+            if pos < resume or self.tagged[pos]:
+                continue
+            if opener >= 0:
+                if pos > limit:
+                    opener = -1
+                elif (
+                    pos >= opener + length
+                    and self.is_run(pos, delimiter)
+                    and delimiter.closes(self, pos)
+                ):
+                    pairs.append((opener, pos))
+                    resume = pos + length
+                    opener = -1
+                    continue
+            if opener < 0 and self.is_run(pos, delimiter) and delimiter.opens(self, pos):
+                opener = pos
+                limit = self.length
+                if delimiter.single_line:
+                    newline = self.text.find("\n", pos + length)
+                    if newline >= 0:
+                        limit = newline
+        return pairs
+
+    def scan_placeholders(self) -> None:
+        """Swap intact code placeholders for their rendered HTML."""
+        used_blocks: set[int] = set()
+        for match in _PLACEHOLDER_RE.finditer(self.text):
+            start, end = match.span()
+            if any(self.tagged[start:end]):
+                continue
+            index = int(match.group(2))
+            if match.group(1) == "CODEBLOCK":
+                if index >= len(self.code_html) or index in used_blocks:
+                    continue
+                used_blocks.add(index)
+                html_block = self.code_html[index]
+            else:
+                if index >= len(self.snippets):
+                    continue
+                html_block = f"<code>{escape_code_content(self.snippets[index])}</code>"
+                if "CODEBLOCKPLACEHOLDER_" in html_block:
+                    html_block = self._fill_code_blocks(html_block, used_blocks)
+            self.edits.append((start, end, html_block, None))
+
+    def _fill_code_blocks(self, html_text: str, used_blocks: set[int]) -> str:
+        # Fences inside an inline code span are still reinserted, exactly
+        # like the regex engine's final placeholder replacement.
+        def replace(match: re.Match[str]) -> str:
+            index = int(match.group(2))
+            if match.group(1) != "CODEBLOCK" or index >= len(self.code_html) or index in used_blocks:
+                return match.group(0)
+            used_blocks.add(index)
+            return self.code_html[index]
+
+        return _PLACEHOLDER_RE.sub(replace, html_text)
+
+    def scan_links(self) -> None:
+        """Record citation removals, custom emoji and links."""
+        spans: List[Tuple[int, int]] = []
+        if "【" in self.text:
+            for match in _CITATION_RE.finditer(self.text):
+                spans.append(match.span())
+                self.edits.append((match.start(), match.end(), "", _empty))
+            self.citations = spans
+
+        if "[" not in self.text:
+            return
+
+        # The regex engine removes citations before it matches emoji and
+        # links, so they are matched on the text without them and mapped back.
+        source = _SourceMap(self.text, spans)
+        link_text = source.text
+        if "](tg://emoji" in link_text:
+            emoji_spans: List[Tuple[int, int]] = []
+            masked: List[Tuple[int, int]] = []
+            for match in _EMOJI_RE.finditer(link_text):
+                start, end = source.span(*match.span())
+                if self._crosses(spans, start, end):
+                    continue
+                masked.append(match.span())
+                emoji_spans.append((start, end))
+                if self.spans is not None:
+                    self.spans.append((start, end))
+                renderer = self._emoji_renderer(source.span(*match.span("alt")), match.group("emoji_id"))
+                self.edits.append((start, end, "", renderer))
+            # Links are matched after emoji are rendered, so the emoji markup
+            # must not supply brackets or parentheses to a link.
+            link_text = _mask_emoji(link_text, masked)
+            spans = sorted(spans + emoji_spans)
+
+        for match in _LINK_RE.finditer(link_text):
+            start, end = source.span(*match.span())
+            if self._crosses(spans, start, end):
+                continue
+            renderer = self._link_renderer(source.span(*match.span("label")), source.span(*match.span("url")))
+            self.edits.append((start, end, "", renderer))
+            if self.spans is not None:
+                self.spans.append((start, end))
+
+    @staticmethod
+    def _crosses(spans: List[Tuple[int, int]], start: int, end: int) -> bool:
+        """Return True if ``start:end`` is not cleanly nested with ``spans``."""
+        index = max(bisect_left(spans, (start, start)) - 1, 0)
+        while index < len(spans) and spans[index][0] < end:
+            span_start, span_end = spans[index]
+            if span_end > start and not (start <= span_start and span_end <= end):
+                return True
+            index += 1
+        return False
+
+    def _emoji_renderer(self, alt: Tuple[int, int], emoji_id: str) -> Callable[[], str]:
+        def render() -> str:
+            return f'<tg-emoji emoji-id="{emoji_id}">{self.emit(*alt)}</tg-emoji>'
+
+        return render
+
+    def _link_renderer(self, label: Tuple[int, int], url: Tuple[int, int]) -> Callable[[], str]:
+        def render() -> str:
+            url_html = self.emit(*url)
+            return f'<a href="{url_html}">{self.emit(*label)}</a>'
+
+        return render
+
+    def finish(self) -> None:
+        self.edits.sort(key=lambda edit: (edit[0], edit[1]))
+        self._starts = [edit[0] for edit in self.edits]
+
+    def emit(self, start: int, end: int, include_end: bool = False) -> str:
+        """Render ``text[start:end]`` with every edit inside it applied."""
+        edits = self.edits
+        text = self.text
+        parts: List[str] = []
+        pos = start
+        index = bisect_left(self._starts, start)
+        while index < len(edits):
+            edit_start, edit_end, html_text, render = edits[index]
+            if edit_start > end or (edit_start == end and not (include_end and edit_end == end)):
+                break
+            if edit_end > end or edit_start < pos:
+                index += 1
+                continue
+            if pos < edit_start:
+                parts.append(convert_html_chars(text[pos:edit_start]))
+            if render is None:
+                parts.append(html_text)
+                index += 1
+            else:
+                parts.append(render())
+                index = bisect_left(self._starts, edit_end, index + 1)
+            pos = edit_end
+        if pos < end:
+            parts.append(convert_html_chars(text[pos:end]))
+        return "".join(parts)
+
+
+def _empty() -> str:
+    return ""
+
+
+class _SourceMap:
+    """``text`` with some spans removed, and positions mapped back to ``text``."""
+
+    __slots__ = ("text", "_starts", "_sources")
+
+    def __init__(self, text: str, removed: List[Tuple[int, int]]) -> None:
+        # Start of each kept segment here and in the original text.
+        self._starts = [0]
+        self._sources = [0]
+        if not removed:
+            self.text = text
+            return
+        pieces: List[str] = []
+        position = 0
+        for start, end in removed:
+            pieces.append(text[position:start])
+            self._starts.append(self._starts[-1] + start - position)
+            self._sources.append(end)
+            position = end
+        pieces.append(text[position:])
+        self.text = "".join(pieces)
+
+    @classmethod
+    def replaced(cls, replacements: List[Tuple[int, int, int]]) -> "_SourceMap":
+        """Map of a text in which each ``(start, end, length)`` was replaced by ``length`` characters."""
+        source_map = cls("", [])
+        position = 0
+        for start, end, length in replacements:
+            source_map._starts.append(source_map._starts[-1] + start - position + length)
+            source_map._sources.append(end)
+            position = end
+        return source_map
+
+    def source(self, position: int) -> int:
+        """Original position of ``position``, which lies outside any replacement."""
+        segment = bisect_right(self._starts, position) - 1
+        return self._sources[segment] + position - self._starts[segment]
+
+    def span(self, start: int, end: int) -> Tuple[int, int]:
+        """Original span of ``self.text[start:end]``, excluding removed text at its edges."""
+        starts = self._starts
+        if len(starts) == 1:
+            return start, end
+        # An end, and an empty span, stay before removed text that follows;
+        # a start moves past removed text before it.
+        after = bisect_left(starts, end) - 1
+        end_source = self._sources[max(after, 0)] + end - starts[max(after, 0)]
+        if start == end:
+            return end_source, end_source
+        before = bisect_right(starts, start) - 1
+        return self._sources[before] + start - starts[before], end_source
+
+
+def _mask_emoji(text: str, spans: List[Tuple[int, int]]) -> str:
+    """Blank out emoji markup while keeping offsets and the alt text."""
+    pieces: List[str] = []
+    last_end = 0
+    for start, end in spans:
+        alt_end = text.index("](tg://emoji", start)
+        pieces.append(text[last_end:start])
+        pieces.append("\x00\x00")
+        pieces.append(text[start + 2 : alt_end])
+        pieces.append("\x00" * (end - alt_end))
+        last_end = end
+    pieces.append(text[last_end:])
+    return "".join(pieces)
+
+
+def _build_document(text: str) -> _Document:
+    output, block_map = extract_and_convert_code_blocks(text)
+    code_html = list(block_map.values())
+    combined = combine_blockquotes(output)
+
+    pieces: List[str] = []
+    snippets: List[str] = []
+    last_end = 0
+    for match in _INLINE_CODE_RE.finditer(combined):
+        pieces.append(combined[last_end : match.start()])
+        pieces.append(f"INLINECODEPLACEHOLDER_{len(snippets)}_")
+        snippets.append(match.group(1))
+        last_end = match.end()
+    pieces.append(combined[last_end:])
+
+    return _Document("".join(pieces), code_html, snippets)
+
+
+def find_safe_cuts(text: str) -> List[Tuple[int, int]]:
+    """Blank-line runs at which ``text`` can be cut without changing its HTML.
+
+    Each ``(start, end)`` is a run of newlines in ``text`` with no other
+    whitespace next to it that no code, quote, heading, list item,
+    formatting, citation or link runs across, found by the same rules as the
+    conversion, and before which no fence or backtick is left open.
+    ``text[:start]`` and ``text[end:]`` then convert to the HTML before and
+    after the blank line of the whole conversion, with either engine.
+    """
+    document = _build_document(text)
+    document.spans = []
+    document.scan_lines()
+    document.resolve_inline()
+    document.scan_links()
+    spans = document.spans + document.citations
+    spans.extend(match.span() for match in _BLOCKQUOTE_RE.finditer(document.text))
+    spans.sort()
+    # A removed citation would leave the whitespace before it at the cut.
+    citation_edges = {edge for span in document.citations for edge in span}
+
+    # The document replaced code with placeholders and rewrote quote lines,
+    # so a run is mapped back in three steps, each keeping runs intact.
+    scan = close_fences(text)
+    output_map = _SourceMap.replaced(
+        [(block.start, block.end, len(f"CODEBLOCKPLACEHOLDER_{index}_"))
+         for index, block in enumerate(scan.blocks)])
+    output, _ = extract_and_convert_code_blocks(text)
+    combined = combine_blockquotes(output)
+    combined_map = _SourceMap.replaced(
+        [(match.start(), match.end(), len(f"INLINECODEPLACEHOLDER_{index}_"))
+         for index, match in enumerate(_INLINE_CODE_RE.finditer(combined))])
+    # Quote lines change length but not the number of lines.
+    combined_newlines = [match.start() for match in re.finditer("\n", combined)]
+    output_newlines = [match.start() for match in re.finditer("\n", output)]
+
+    doc_text = document.text
+    cuts: List[Tuple[int, int]] = []
+    index = 0
+    reach = 0
+    segment_start = triple = unescaped = 0
+    open_fence = None
+    for match in _BLANK_LINES_RE.finditer(doc_text):
+        start, end = match.span()
+        while index < len(spans) and spans[index][0] < end:
+            reach = max(reach, spans[index][1])
+            index += 1
+        if (reach > start or start == 0 or end == len(doc_text)
+                or doc_text[start - 1].isspace() or doc_text[end].isspace()
+                or start in citation_edges or end in citation_edges):
+            continue
+        first = bisect_left(combined_newlines, combined_map.source(start))
+        last = bisect_left(combined_newlines, combined_map.source(end - 1))
+        start = output_map.source(output_newlines[first])
+        end = output_map.source(output_newlines[last]) + 1
+        if end > len(text):
+            break
+        # Closing fences and backticks are appended for the whole text, so
+        # the text before a cut must not leave one open. No code crosses a
+        # run kept so far, so the counts of the segments between them add
+        # up, and a fence line left open is replayed before the next one.
+        segment = text[segment_start:start]
+        scan = scan_fences(segment)
+        triple += scan.triple_backticks
+        unescaped += scan.unescaped_backticks
+        if open_fence is not None:
+            scan = scan_fences(open_fence + "\n" + segment)
+        open_fence = scan.open_fence
+        segment_start = start
+        if open_fence is None and not triple % 2 and not unescaped % 2:
+            cuts.append((start, end))
+    return cuts
+
+
+def tokenize_format(text: str) -> str:
+    """Convert Markdown to Telegram HTML with the single-scan engine."""
+    document = _build_document(text)
+    document.scan_lines()
+    document.resolve_inline()
+    if "PLACEHOLDER_" in document.text:
+        document.scan_placeholders()
+    document.scan_links()
+    document.finish()
+
+    output = document.emit(0, document.length, include_end=True)
+    if "&lt;" in output:
+        output = remove_blockquote_escaping(output)
+        output = remove_spoiler_escaping(output)
+    if "\n\n\n" in output:
+        output = re.sub(r"\n{3,}", "\n\n", output)
+    return output.strip()
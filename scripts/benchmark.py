@@ -8,20 +8,29 @@ import json
 import sys
 import textwrap
 import time
+import tracemalloc
+from dataclasses import dataclass, field
 from datetime import datetime
+from html.parser import HTMLParser
 from pathlib import Path
-from typing import Dict
+from typing import Callable, Dict, List, Optional
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
 import chatgpt_md_converter  # noqa: E402
+from chatgpt_md_converter.html_markdown.tree import (  # noqa: E402
+    build_flat_tree, build_tree)
 
 telegram_format = chatgpt_md_converter.telegram_format
 html_to_telegram_markdown = chatgpt_md_converter.html_to_telegram_markdown
 
 
+def _tokenizer_format(markdown: str) -> str:
+    return telegram_format(markdown, engine="tokenizer")
+
+
 def _build_samples(multiplier: int) -> Dict[str, str]:
     base = {
         "short_inline": "Hello, **bold** _italic_ __underline__ [link](http://example.com)",
@@ -87,11 +96,133 @@ def run_benchmarks(iterations: int, long_multiplier: int) -> Dict[str, Dict[str,
         html = telegram_format(markdown)
         results[name] = {
             "md_to_html": _benchmark(telegram_format, markdown, iterations),
+            "md_to_html_tok": _benchmark(_tokenizer_format, markdown, iterations),
             "html_to_md": _benchmark(html_to_telegram_markdown, html, iterations),
         }
     return results
 
 
+ENGINE_SIZES_KB = (1, 5, 20, 100, 200, 500)
+
+
+def run_engine_comparison(sizes_kb=ENGINE_SIZES_KB, repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    """Best-of-``repeat`` ms per call of both ``telegram_format`` engines by input size."""
+    unit = _build_samples(1)["long_mixed"] + "\n\n"
+    results: Dict[str, Dict[str, float]] = {}
+    for size in sizes_kb:
+        markdown = unit * max(size * 1024 // len(unit), 1)
+        timings = {}
+        for name, fn in (("regex", telegram_format), ("tokenizer", _tokenizer_format)):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn(markdown)
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best * 1000
+        results[f"{size}KB"] = timings
+    return results
+
+
+def _format_engine_summary(engines: Dict[str, Dict[str, float]]) -> str:
+    lines = ["Input     regex ms   tokenizer ms   tokenizer/regex"]
+    for size, timings in engines.items():
+        ratio = timings["tokenizer"] / timings["regex"]
+        lines.append(f"{size:<10}{timings['regex']:<11.2f}{timings['tokenizer']:<15.2f}{ratio:.2f}")
+    return "\n".join(lines)
+
+
+@dataclass
+class DataclassNode:
+    """The former tree node: a dataclass with a dict and a list per node."""
+
+    kind: str
+    text: str = ""
+    tag: str = ""
+    attrs: Dict[str, Optional[str]] = field(default_factory=dict)
+    children: List["DataclassNode"] = field(default_factory=list)
+
+
+class DataclassTreeBuilder(HTMLParser):
+    """The former tree builder, kept to compare memory with."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=False)
+        self.root = DataclassNode(kind="element", tag="__root__")
+        self._stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "br":
+            self._stack[-1].children.append(DataclassNode(kind="text", text="\n"))
+            return
+        node = DataclassNode(kind="element", tag=tag, attrs=dict(attrs))
+        self._stack[-1].children.append(node)
+        self._stack.append(node)
+
+    def handle_endtag(self, tag):
+        for index in range(len(self._stack) - 1, 0, -1):
+            if self._stack[index].tag == tag:
+                del self._stack[index:]
+                return
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "br":
+            self.handle_starttag(tag, attrs)
+            return
+        self._stack[-1].children.append(DataclassNode(kind="element", tag=tag, attrs=dict(attrs)))
+
+    def handle_data(self, data):
+        if data:
+            self._stack[-1].children.append(DataclassNode(kind="text", text=data))
+
+    def handle_entityref(self, name):
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name):
+        self.handle_data(f"&#{name};")
+
+
+def _build_dataclass_tree(html: str) -> List[DataclassNode]:
+    builder = DataclassTreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root.children
+
+
+def _peak_memory(callable_fn: Callable[[str], object], payload: str) -> float:
+    """Peak traced allocation of one call, in MB, while its result is alive."""
+    tracemalloc.start()
+    try:
+        result = callable_fn(payload)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak / 1e6
+
+
+def run_memory_comparison(long_multiplier: int) -> Dict[str, float]:
+    html = telegram_format(_build_samples(long_multiplier)["long_mixed"])
+    return {
+        "html_kb": len(html) / 1000,
+        "dataclass_tree_mb": _peak_memory(_build_dataclass_tree, html),
+        "slotted_tree_mb": _peak_memory(build_tree, html),
+        "flat_tree_mb": _peak_memory(build_flat_tree, html),
+        "html_to_md_mb": _peak_memory(html_to_telegram_markdown, html),
+    }
+
+
+def _format_memory_summary(memory: Dict[str, float]) -> str:
+    lines = [f"Peak memory on long_mixed HTML ({memory['html_kb']:.0f} KB)"]
+    for key, label in (
+        ("dataclass_tree_mb", "dataclass tree"),
+        ("slotted_tree_mb", "slotted tree"),
+        ("flat_tree_mb", "flat tree"),
+        ("html_to_md_mb", "html_to_md"),
+    ):
+        lines.append(f"{label:<16}{memory[key]:.2f} MB")
+    return "\n".join(lines)
+
+
 def _format_summary(results: Dict[str, Dict[str, Dict[str, float]]]) -> str:
     lines = [
         f"Benchmark run: {datetime.utcnow().isoformat(timespec='seconds')}Z",
@@ -114,6 +245,16 @@ def main() -> None:
         default=5,
         help="repeat the long sample this many times (default: 5)",
     )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="also compare peak memory of the HTML trees with tracemalloc",
+    )
+    parser.add_argument(
+        "--engines",
+        action="store_true",
+        help="also time both telegram_format engines on inputs from 1 KB to 500 KB",
+    )
     parser.add_argument("--json", type=Path, help="optional path to write JSON results")
     parser.add_argument("--summary", type=Path, help="optional path to write text summary")
     args = parser.parse_args()
@@ -121,6 +262,14 @@ def main() -> None:
     results = run_benchmarks(args.iterations, args.long_multiplier)
 
     summary = _format_summary(results)
+    if args.memory:
+        memory = run_memory_comparison(args.long_multiplier * 100)
+        summary += "\n\n" + _format_memory_summary(memory)
+        results["memory"] = memory
+    if args.engines:
+        engines = run_engine_comparison()
+        summary += "\n\n" + _format_engine_summary(engines)
+        results["engines"] = engines
     if args.summary:
         args.summary.write_text(summary + "\n", encoding="utf-8")
     else:
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Compare the splitter's tag scanner with an html.parser based tracker."""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from html import unescape
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Callable, Dict
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from chatgpt_md_converter import html_splitter, telegram_format  # noqa: E402
+from chatgpt_md_converter.telegram_entities.utf16 import utf16_len  # noqa: E402
+
+_PARAGRAPH = """# Section
+
+Some **bold _nested_ text** with a [link](https://example.com/?a=1&b=2) and `code`.
+> quoted line with ||spoiler||
+
+- item with ~~strike~~ and __underline__
+
+```python
+for i in range(10):
+    print(i)
+```
+"""
+
+
+class HTMLParserTracker(HTMLParser):
+    """The splitter's former tracker, built on html.parser."""
+
+    def __init__(self, count_visible=False):
+        super().__init__(convert_charrefs=False)
+        self.count_visible = count_visible
+        self.open_tags = []
+        self.open_tags_length = 0
+        self.closing_tags_length = 0
+        self.visible_length = 0
+
+    @property
+    def _pending(self):
+        """Input html.parser holds back, such as a tag cut off at the end."""
+        return self.rawdata
+
+    def handle_starttag(self, tag, attrs):
+        if tag in html_splitter._TRACKED_TAGS:
+            self.open_tags.append((tag, attrs))
+            self.open_tags_length += len(html_splitter._open_tag_html(tag, attrs))
+            self.closing_tags_length += len(tag) + 3
+
+    def handle_endtag(self, tag):
+        for i in range(len(self.open_tags) - 1, -1, -1):
+            if self.open_tags[i][0] == tag:
+                self.open_tags_length -= len(html_splitter._open_tag_html(*self.open_tags[i]))
+                self.closing_tags_length -= len(tag) + 3
+                del self.open_tags[i]
+                break
+
+    def handle_data(self, data):
+        if self.count_visible:
+            self.visible_length += utf16_len(data)
+
+    def handle_entityref(self, name):
+        self.handle_data(unescape(f"&{name};"))
+
+    def handle_charref(self, name):
+        self.handle_data(unescape(f"&#{name};"))
+
+    def copy(self):
+        clone = HTMLParserTracker(self.count_visible)
+        clone.__dict__.update(self.__dict__)
+        clone.open_tags = list(self.open_tags)
+        return clone
+
+    def get_open_tags_html(self):
+        return "".join(html_splitter._open_tag_html(tag, attrs) for tag, attrs in self.open_tags)
+
+    def get_closing_tags_html(self):
+        return "".join(f"</{tag}>" for tag, _ in reversed(self.open_tags))
+
+
+def _time(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _feed_all(tracker_cls, html: str) -> None:
+    tracker_cls().feed(html)
+
+
+def _split_with(tracker_cls, html: str) -> list[str]:
+    original = html_splitter.HTMLTagTracker
+    html_splitter.HTMLTagTracker = tracker_cls
+    try:
+        return html_splitter.split_html_for_telegram(html)
+    finally:
+        html_splitter.HTMLTagTracker = original
+
+
+def run_benchmarks(sizes: list[int], repeat: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    for size in sizes:
+        html = telegram_format(_PARAGRAPH * size)
+        if _split_with(HTMLParserTracker, html) != _split_with(html_splitter.HTMLTagTracker, html):
+            raise SystemExit(f"chunks differ for {size} paragraphs")
+        results[f"{len(html) // 1024} KB"] = {
+            "feed_htmlparser": _time(lambda: _feed_all(HTMLParserTracker, html), repeat),
+            "feed_scanner": _time(lambda: _feed_all(html_splitter.HTMLTagTracker, html), repeat),
+            "split_htmlparser": _time(lambda: _split_with(HTMLParserTracker, html), repeat),
+            "split_scanner": _time(lambda: _split_with(html_splitter.HTMLTagTracker, html), repeat),
+        }
+    return results
+
+
+def _format_summary(results: Dict[str, Dict[str, float]]) -> str:
+    lines = ["Size      Step    HTMLParser ms   Scanner ms   Speedup"]
+    for size, stats in results.items():
+        for step in ("feed", "split"):
+            old = stats[f"{step}_htmlparser"] * 1000
+            new = stats[f"{step}_scanner"] * 1000
+            lines.append(f"{size:<10}{step:<8}{old:>13.1f}{new:>13.1f}{old / new:>9.1f}x")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 4000],
+        help="document sizes in repeated paragraphs (default: 100 1000 4000)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs (default: 3)")
+    args = parser.parse_args()
+    print(_format_summary(run_benchmarks(args.sizes, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
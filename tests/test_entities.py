@@ -1,12 +1,26 @@
 """Tests for Telegram entity conversion."""
 
-from chatgpt_md_converter import telegram_format_entities
-from chatgpt_md_converter.telegram_entities.utf16 import utf16_len
+import pytest
 
+from chatgpt_md_converter import telegram_entities
+from chatgpt_md_converter.telegram_entities.entity import (EntityType,
+                                                           TelegramEntity)
+from chatgpt_md_converter.telegram_entities.extractors.inline import \
+    extract_inline_formatting_entities
+from chatgpt_md_converter.telegram_entities.spans import SpanText, deletion
+from chatgpt_md_converter.telegram_entities.utf16 import (Utf16Index,
+                                                          char_to_utf16_offset,
+                                                          utf16_len,
+                                                          utf16_to_char_offset)
 
-def test_bold_entity():
+telegram_format_entities = telegram_entities.telegram_format_entities
+ENGINES = ["regex", "tokenizer"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_bold_entity(engine):
     """Test bold text conversion to entity."""
-    text, entities = telegram_format_entities("**bold** text")
+    text, entities = telegram_format_entities("**bold** text", engine=engine)
     assert text == "bold text"
     assert len(entities) == 1
     assert entities[0]["type"] == "bold"
@@ -14,9 +28,10 @@ def test_bold_entity():
     assert entities[0]["length"] == 4
 
 
-def test_italic_entity_underscore():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_italic_entity_underscore(engine):
     """Test italic text with underscores."""
-    text, entities = telegram_format_entities("_italic_ text")
+    text, entities = telegram_format_entities("_italic_ text", engine=engine)
     assert text == "italic text"
     assert len(entities) == 1
     assert entities[0]["type"] == "italic"
@@ -24,9 +39,10 @@ def test_italic_entity_underscore():
     assert entities[0]["length"] == 6
 
 
-def test_italic_entity_asterisk():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_italic_entity_asterisk(engine):
     """Test italic text with asterisks."""
-    text, entities = telegram_format_entities("*italic* text")
+    text, entities = telegram_format_entities("*italic* text", engine=engine)
     assert text == "italic text"
     assert len(entities) == 1
     assert entities[0]["type"] == "italic"
@@ -34,9 +50,10 @@ def test_italic_entity_asterisk():
     assert entities[0]["length"] == 6
 
 
-def test_underline_entity():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_underline_entity(engine):
     """Test underline text conversion."""
-    text, entities = telegram_format_entities("__underline__ text")
+    text, entities = telegram_format_entities("__underline__ text", engine=engine)
     assert text == "underline text"
     assert len(entities) == 1
     assert entities[0]["type"] == "underline"
@@ -44,9 +61,10 @@ def test_underline_entity():
     assert entities[0]["length"] == 9
 
 
-def test_strikethrough_entity():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_strikethrough_entity(engine):
     """Test strikethrough text conversion."""
-    text, entities = telegram_format_entities("~~strikethrough~~ text")
+    text, entities = telegram_format_entities("~~strikethrough~~ text", engine=engine)
     assert text == "strikethrough text"
     assert len(entities) == 1
     assert entities[0]["type"] == "strikethrough"
@@ -54,9 +72,10 @@ def test_strikethrough_entity():
     assert entities[0]["length"] == 13
 
 
-def test_spoiler_entity():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_spoiler_entity(engine):
     """Test spoiler text conversion."""
-    text, entities = telegram_format_entities("||spoiler|| text")
+    text, entities = telegram_format_entities("||spoiler|| text", engine=engine)
     assert text == "spoiler text"
     assert len(entities) == 1
     assert entities[0]["type"] == "spoiler"
@@ -64,9 +83,10 @@ def test_spoiler_entity():
     assert entities[0]["length"] == 7
 
 
-def test_inline_code_entity():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_inline_code_entity(engine):
     """Test inline code conversion."""
-    text, entities = telegram_format_entities("`code` text")
+    text, entities = telegram_format_entities("`code` text", engine=engine)
     assert text == "code text"
     assert len(entities) == 1
     assert entities[0]["type"] == "code"
@@ -74,27 +94,30 @@ def test_inline_code_entity():
     assert entities[0]["length"] == 4
 
 
-def test_code_block_entity():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_code_block_entity(engine):
     """Test code block conversion."""
-    text, entities = telegram_format_entities("```python\nprint('hello')\n```")
+    text, entities = telegram_format_entities("```python\nprint('hello')\n```", engine=engine)
     assert "print('hello')" in text
     assert len(entities) == 1
     assert entities[0]["type"] == "pre"
     assert entities[0]["language"] == "python"
 
 
-def test_code_block_no_language():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_code_block_no_language(engine):
     """Test code block without language specification."""
-    text, entities = telegram_format_entities("```\ncode here\n```")
+    text, entities = telegram_format_entities("```\ncode here\n```", engine=engine)
     assert "code here" in text
     assert len(entities) == 1
     assert entities[0]["type"] == "pre"
     assert entities[0].get("language") is None
 
 
-def test_link_entity():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_link_entity(engine):
     """Test link conversion to text_link entity."""
-    text, entities = telegram_format_entities("[click here](https://example.com)")
+    text, entities = telegram_format_entities("[click here](https://example.com)", engine=engine)
     assert text == "click here"
     assert len(entities) == 1
     assert entities[0]["type"] == "text_link"
@@ -103,9 +126,10 @@ def test_link_entity():
     assert entities[0]["url"] == "https://example.com"
 
 
-def test_heading_to_bold():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_heading_to_bold(engine):
     """Test heading conversion to bold entity."""
-    text, entities = telegram_format_entities("# Heading")
+    text, entities = telegram_format_entities("# Heading", engine=engine)
     assert text == "Heading"
     assert len(entities) == 1
     assert entities[0]["type"] == "bold"
@@ -113,9 +137,10 @@ def test_heading_to_bold():
     assert entities[0]["length"] == 7
 
 
-def test_multiple_entities():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_multiple_entities(engine):
     """Test multiple formatting in one text."""
-    text, entities = telegram_format_entities("**bold** and *italic*")
+    text, entities = telegram_format_entities("**bold** and *italic*", engine=engine)
     assert text == "bold and italic"
     assert len(entities) == 2
 
@@ -129,9 +154,10 @@ def test_multiple_entities():
     assert italic["length"] == 6
 
 
-def test_nested_formatting():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_formatting(engine):
     """Test nested formatting (bold with italic inside)."""
-    text, entities = telegram_format_entities("**bold *italic* text**")
+    text, entities = telegram_format_entities("**bold *italic* text**", engine=engine)
     assert text == "bold italic text"
 
     # Should have both bold and italic entities
@@ -140,9 +166,10 @@ def test_nested_formatting():
     assert "italic" in types
 
 
-def test_utf16_offset_with_emoji():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_utf16_offset_with_emoji(engine):
     """Test that offsets are correctly calculated in UTF-16 for emoji."""
-    text, entities = telegram_format_entities("Hello 😀 **world**")
+    text, entities = telegram_format_entities("Hello 😀 **world**", engine=engine)
     assert text == "Hello 😀 world"
 
     # Find the bold entity
@@ -157,9 +184,10 @@ def test_utf16_offset_with_emoji():
     assert bold["length"] == 5
 
 
-def test_utf16_offset_multiple_emoji():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_utf16_offset_multiple_emoji(engine):
     """Test UTF-16 offsets with multiple emoji."""
-    text, entities = telegram_format_entities("🎉🎊 **party**")
+    text, entities = telegram_format_entities("🎉🎊 **party**", engine=engine)
     assert text == "🎉🎊 party"
 
     bold = next(e for e in entities if e["type"] == "bold")
@@ -178,21 +206,168 @@ def test_utf16_len_helper():
     assert utf16_len("🎉🎊") == 4
 
 
-def test_list_conversion():
+def test_utf16_index_lookups():
+    """Test char <-> UTF-16 conversion through a prebuilt index."""
+    text = "a😀b🎉c"
+    index = Utf16Index(text)
+    assert index.utf16_length == utf16_len(text) == 7
+    assert [index.char_to_utf16(i) for i in range(len(text) + 1)] == [
+        0, 1, 3, 4, 6, 7
+    ]
+    assert [index.utf16_to_char(u) for u in range(8)] == [0, 1, 2, 2, 3, 4, 4, 5]
+    assert utf16_to_char_offset(text, 2) == 2
+    assert [char_to_utf16_offset(text, i) for i in range(len(text) + 1)] == [
+        0, 1, 3, 4, 6, 7
+    ]
+    # Out-of-range indices behave like slice ends, or are clamped by the index.
+    assert char_to_utf16_offset("a😀", 5) == 3
+    assert char_to_utf16_offset("abc", 10) == 3
+    assert char_to_utf16_offset(text, -1) == 6
+    assert [index.char_to_utf16(i) for i in (-1, 10)] == [0, 7]
+    assert Utf16Index("abc").char_to_utf16(10) == 3
+
+
+def test_utf16_index_bmp_fast_path():
+    """Test that BMP-only text maps offsets one to one."""
+    index = Utf16Index("héllo wörld")
+    assert index.char_to_utf16(5) == 5
+    assert index.utf16_to_char(100) == len("héllo wörld")
+
+
+def test_utf16_index_vectorized_matches_python():
+    """Test that the numpy backend builds the same table."""
+    pytest.importorskip("numpy")
+    text = "x😀yz🎉" * 50
+    python_index = Utf16Index(text, vectorized=False)
+    numpy_index = Utf16Index(text, vectorized=True)
+    for i in range(len(text) + 1):
+        assert numpy_index.char_to_utf16(i) == python_index.char_to_utf16(i)
+    for u in range(python_index.utf16_length + 1):
+        assert numpy_index.utf16_to_char(u) == python_index.utf16_to_char(u)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_entity_lengths_skip_markers_removed_inside_them(engine):
+    """Test that markers stripped by later stages shrink enclosing entities."""
+    text, entities = telegram_format_entities("**a `code` b**", engine=engine)
+    assert text == "a code b"
+    assert entities == [
+        {"type": "bold", "offset": 0, "length": 8},
+        {"type": "code", "offset": 2, "length": 4},
+    ]
+
+    text, entities = telegram_format_entities("# **T** x", engine=engine)
+    assert text == "T x"
+    assert entities == [
+        {"type": "bold", "offset": 0, "length": 3},
+        {"type": "bold", "offset": 0, "length": 1},
+    ]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_cleanup_keeps_entities_aligned_and_code_intact(engine):
+    """Test that stripping and newline collapsing move entities, not code."""
+    text, entities = telegram_format_entities("  a\n\n\n\n**b** 【1】`c`", engine=engine)
+    assert text == "a\n\nb c"
+    assert entities == [
+        {"type": "bold", "offset": 3, "length": 1},
+        {"type": "code", "offset": 5, "length": 1},
+    ]
+
+    text, entities = telegram_format_entities("```\n- a\n\n\n\nb\n```", engine=engine)
+    assert text == "- a\n\n\n\nb"
+    assert entities == [{"type": "pre", "offset": 0, "length": 8}]
+
+
+def test_span_text_maps_stage_offsets_to_source():
+    """Test that spans recorded against a later view land in the output."""
+    span = SpanText("**a** [b](u)")
+    span.apply([deletion(0, 2), deletion(3, 5)], [TelegramEntity(EntityType.BOLD, 2, 1)])
+    assert span.view == "a [b](u)"
+    span.apply(
+        [deletion(2, 3), deletion(4, 8)],
+        [TelegramEntity(EntityType.TEXT_LINK, 3, 1, url="u")],
+    )
+    text, entities = span.materialize()
+    assert text == "a b"
+    assert [(e.type, e.offset, e.length) for e in entities] == [
+        (EntityType.BOLD, 0, 1),
+        (EntityType.TEXT_LINK, 2, 1),
+    ]
+    with pytest.raises(ValueError):
+        span.apply([deletion(1, 2), deletion(0, 1)])
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_many_code_spans_and_links(engine):
+    """Test offsets stay aligned with hundreds of placeholders and links."""
+    parts = [f"**b{i}** [l{i}](https://x.io/{i}) `c{i}`" for i in range(300)]
+    text, entities = telegram_format_entities(" ".join(parts), engine=engine)
+    by_type = {}
+    for entity in entities:
+        by_type.setdefault(entity["type"], []).append(entity)
+    assert {k: len(v) for k, v in by_type.items()} == {
+        "bold": 300, "text_link": 300, "code": 300
+    }
+    for entity in entities:
+        piece = text[entity["offset"] : entity["offset"] + entity["length"]]
+        assert piece[0] in "blc" and piece[1:].isdigit()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_inline_nesting_scales_to_10k_spans(engine):
+    """Test that 10k formatted spans resolve and keep their nesting."""
+    spans = [f"**b{i} _i{i}_**" for i in range(5000)]
+    text, entities = telegram_format_entities(" ".join(spans), engine=engine)
+    assert len(entities) == 10000
+    bold = [e for e in entities if e["type"] == "bold"]
+    italic = [e for e in entities if e["type"] == "italic"]
+    for outer, inner in zip(bold, italic):
+        assert outer["offset"] < inner["offset"]
+        assert inner["offset"] + inner["length"] == outer["offset"] + outer["length"]
+    assert text.startswith("b0 i0 b1 i1")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_tokenizer_handles_stray_asterisks(engine):
+    """Test that runs of unmatched markers yield no entities in either engine."""
+    text = "* a ** b *** c " * 2000 + "**bold**"
+    plain, entities = extract_inline_formatting_entities(text, engine)
+    assert plain.endswith("bold")
+    assert len(entities) == 1
+
+
+def test_tokenizer_is_linear_on_unclosed_openers():
+    """Test that openers without closers do not rescan the rest of the text."""
+    text = "**a ~~b *c " * 20000
+    plain, entities = extract_inline_formatting_entities(text, "tokenizer")
+    assert (plain, entities) == (text, [])
+
+
+def test_unknown_inline_engine_rejected():
+    """Test that an unknown engine name raises ValueError."""
+    with pytest.raises(ValueError):
+        extract_inline_formatting_entities("**x**", engine="nope")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_list_conversion(engine):
     """Test list marker conversion."""
-    text, entities = telegram_format_entities("- item 1\n* item 2")
+    text, entities = telegram_format_entities("- item 1\n* item 2", engine=engine)
     assert "• item 1" in text
     assert "• item 2" in text
 
 
-def test_citation_removal():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_citation_removal(engine):
     """Test ChatGPT citation marker removal."""
-    text, entities = telegram_format_entities("Some text【1】 with citation")
+    text, entities = telegram_format_entities("Some text【1】 with citation", engine=engine)
     assert "【" not in text
     assert "】" not in text
 
 
-def test_combined_formatting():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_combined_formatting(engine):
     """Test combined text with multiple formatting types."""
     markdown = """# Title
 This is **bold** and *italic*.
@@ -204,7 +379,7 @@ Check out [this link](https://example.com).
 print("hello")
 ```
 """
-    text, entities = telegram_format_entities(markdown)
+    text, entities = telegram_format_entities(markdown, engine=engine)
 
     # Should have entities for: heading (bold), bold, italic, link, code, pre
     types = {e["type"] for e in entities}
@@ -216,23 +391,26 @@ print("hello")
     assert "pre" in types
 
 
-def test_empty_text():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_empty_text(engine):
     """Test empty text handling."""
-    text, entities = telegram_format_entities("")
+    text, entities = telegram_format_entities("", engine=engine)
     assert text == ""
     assert entities == []
 
 
-def test_plain_text():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_plain_text(engine):
     """Test plain text without any formatting."""
-    text, entities = telegram_format_entities("Just plain text")
+    text, entities = telegram_format_entities("Just plain text", engine=engine)
     assert text == "Just plain text"
     assert entities == []
 
 
-def test_bold_italic_combined():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_bold_italic_combined(engine):
     """Test ***bold and italic*** syntax."""
-    text, entities = telegram_format_entities("***bold italic***")
+    text, entities = telegram_format_entities("***bold italic***", engine=engine)
     assert text == "bold italic"
 
     types = {e["type"] for e in entities}
@@ -240,9 +418,10 @@ def test_bold_italic_combined():
     assert "italic" in types
 
 
-def test_entity_dict_format():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_entity_dict_format(engine):
     """Test that entity dicts have correct format for Telegram API."""
-    text, entities = telegram_format_entities("**bold**")
+    text, entities = telegram_format_entities("**bold**", engine=engine)
 
     entity = entities[0]
     assert "type" in entity
@@ -253,9 +432,10 @@ def test_entity_dict_format():
     assert isinstance(entity["length"], int)
 
 
-def test_link_with_url_field():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_link_with_url_field(engine):
     """Test that link entities have the url field."""
-    text, entities = telegram_format_entities("[text](https://example.com)")
+    text, entities = telegram_format_entities("[text](https://example.com)", engine=engine)
 
     entity = entities[0]
     assert entity["type"] == "text_link"
@@ -263,9 +443,10 @@ def test_link_with_url_field():
     assert entity["url"] == "https://example.com"
 
 
-def test_code_block_with_language_field():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_code_block_with_language_field(engine):
     """Test that code block entities have the language field."""
-    text, entities = telegram_format_entities("```python\ncode\n```")
+    text, entities = telegram_format_entities("```python\ncode\n```", engine=engine)
 
     entity = entities[0]
     assert entity["type"] == "pre"
@@ -273,26 +454,79 @@ def test_code_block_with_language_field():
     assert entity["language"] == "python"
 
 
-def test_special_chars_in_text():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_special_chars_in_text(engine):
     """Test that special characters are preserved in plain text."""
-    text, entities = telegram_format_entities("**bold with < > & chars**")
+    text, entities = telegram_format_entities("**bold with < > & chars**", engine=engine)
     assert "< > &" in text
 
 
-def test_multiple_lines():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_multiple_lines(engine):
     """Test multiline text handling."""
-    text, entities = telegram_format_entities("**line 1**\n\n**line 2**")
+    text, entities = telegram_format_entities("**line 1**\n\n**line 2**", engine=engine)
     assert "line 1" in text
     assert "line 2" in text
     assert len(entities) == 2
 
 
-def test_escaped_markers():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_escaped_markers(engine):
     """Test that escaped markers are not converted."""
     # Backslash-escaped markers should remain as-is
-    text, entities = telegram_format_entities(r"\*\*not bold\*\*")
+    text, entities = telegram_format_entities(r"\*\*not bold\*\*", engine=engine)
     # The escaped asterisks should not create a bold entity
     # (depending on implementation, the backslashes may or may not be stripped)
     bold_entities = [e for e in entities if e["type"] == "bold"]
     # Should have no bold entities for escaped markers
     assert len(bold_entities) == 0 or "not bold" not in text[:10]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_split_entities_clips_and_rebases_across_cuts(engine):
+    """Entities crossing a cut are clipped to each message and re-based."""
+    text, entities = telegram_format_entities(
+        "😀 **" + "bold words " * 29 + "bold**\n\nafter [link](https://x.io)", engine=engine
+    )
+    parts = telegram_entities.split_entities_for_telegram(text, entities, 100)
+    assert len(parts) > 1
+    for part_text, part_entities in parts:
+        assert utf16_len(part_text) <= 100
+        for entity in part_entities:
+            assert entity["offset"] + entity["length"] <= utf16_len(part_text)
+    assert " ".join(t for t, _ in parts).split() == text.split()
+    assert [e["type"] for e in parts[0][1]] == ["bold"]
+    # The emoji takes two UTF-16 units, so the bold run starts at 3.
+    assert parts[0][1][0]["offset"] == 3
+    assert parts[1][1][0] == {"type": "bold", "offset": 0, "length": parts[1][1][0]["length"]}
+    assert parts[-1][0].endswith("after link")
+    assert parts[-1][1][-1]["url"] == "https://x.io"
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_split_entities_cuts_pre_by_line_and_keeps_language(engine):
+    """Long code blocks are split between lines and keep their language."""
+    code = "\n".join(f"    line_{i} = {i}" for i in range(40))
+    text, entities = telegram_format_entities(f"Code:\n```python\n{code}\n```", engine=engine)
+    parts = telegram_entities.split_entities_for_telegram(text, entities, 200)
+    assert len(parts) > 1
+    assert parts[0][0].startswith("Code:\n")
+    lines = []
+    for part_text, part_entities in parts:
+        [pre] = part_entities
+        assert pre["language"] == "python"
+        assert pre["offset"] + pre["length"] == len(part_text)
+        lines.extend(part_text[pre["offset"]:].split("\n"))
+    assert lines == code.split("\n")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_split_entities_short_text_and_min_length(engine):
+    """Text that fits stays in one message; tiny limits are rejected."""
+    text, entities = telegram_format_entities("**Hello** world", engine=engine)
+    assert telegram_entities.split_entities_for_telegram(text, entities) == [
+        (text, entities)
+    ]
+    assert telegram_entities.split_entities_for_telegram("", []) == []
+    with pytest.raises(ValueError):
+        telegram_entities.split_entities_for_telegram(text, entities, 1)
@@ -1,58 +1,74 @@
-from chatgpt_md_converter.telegram_formatter import telegram_format
-from chatgpt_md_converter.telegram_markdown.code_blocks import \
-    ensure_closing_delimiters
 
+import pytest
 
-def test_split_by_tag_bold():
+from chatgpt_md_converter import telegram_formatter
+from chatgpt_md_converter.telegram_markdown.fences import scan_fences
+from chatgpt_md_converter.telegram_markdown.code_blocks import (
+    ensure_closing_delimiters, extract_and_convert_code_blocks,
+    reinsert_code_blocks)
+
+telegram_format = telegram_formatter.telegram_format
+ENGINES = ["regex", "tokenizer"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_split_by_tag_bold(engine):
     text = "This is **bold** text"
-    assert telegram_format(text) == "This is <b>bold</b> text"
+    assert telegram_format(text, engine=engine) == "This is <b>bold</b> text"
 
 
-def test_telegram_format_italic():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_telegram_format_italic(engine):
     text = "This is _italic_ text"
-    output = telegram_format(text)
+    output = telegram_format(text, engine=engine)
     assert output == "This is <i>italic</i> text"
 
 
-def test_telegram_format_italic_star():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_telegram_format_italic_star(engine):
     text = "This is *italic* text"
-    output = telegram_format(text)
+    output = telegram_format(text, engine=engine)
     assert output == "This is <i>italic</i> text"
 
 
-def test_triple_backticks_with_language():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_triple_backticks_with_language(engine):
     input_text = "```python\nprint('Hello, world!')\n```"
     expected_output = (
         "<pre><code class=\"language-python\">print('Hello, world!')\n</code></pre>"
     )
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output == expected_output
     ), "Failed converting triple backticks with language to <pre><code> tags"
 
 
-def test_bold_and_underline_conversion():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_bold_and_underline_conversion(engine):
     input_text = "This is **bold** and this is __underline__."
     expected_output = "This is <b>bold</b> and this is <u>underline</u>."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed converting ** and __ to <b> and <u> tags"
 
 
-def test_escaping_special_characters():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_escaping_special_characters(engine):
     input_text = "Avoid using < or > in your HTML."
     expected_output = "Avoid using &lt; or &gt; in your HTML."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed escaping < and > characters"
 
 
-def test_nested_markdown_syntax():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_markdown_syntax(engine):
     input_text = "This is **bold and _italic_** text."
     expected_output = "This is <b>bold and <i>italic</i></b> text."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed handling nested markdown syntax"
 
 
-def test_combination_of_markdown_elements():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_combination_of_markdown_elements(engine):
     input_text = """
 # Heading
 This is a test of **bold**, __underline__, and `inline code`.
@@ -78,38 +94,42 @@ This is a test of <b>bold</b>, <u>underline</u>, and <code>inline code</code>.
 
 <a href="http://example.com">Link</a>
 """
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output.strip() == expected_output.strip()
     ), "Failed combining multiple markdown elements into HTML"
 
 
-def test_nested_bold_within_italic():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_bold_within_italic(engine):
     input_text = "This is *__bold within italic__* text."
     expected_output = "This is <i><u>bold within italic</u></i> text."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output == expected_output
     ), "Failed converting nested bold within italic markdown to HTML"
 
 
-def test_italic_within_bold():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_italic_within_bold(engine):
     input_text = "This is **bold and _italic_ together**."
     expected_output = "This is <b>bold and <i>italic</i> together</b>."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output == expected_output
     ), "Failed converting italic within bold markdown to HTML"
 
 
-def test_inline_code_within_bold_text():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_inline_code_within_bold_text(engine):
     input_text = "This is **bold and `inline code` together**."
     expected_output = "This is <b>bold and <code>inline code</code> together</b>."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed handling inline code within bold text"
 
 
-def test_mixed_formatting_tags_with_lists_and_links():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_mixed_formatting_tags_with_lists_and_links(engine):
     input_text = """
 - This is a list item with **bold**, __underline__, and [a link](http://example.com)
 - Another item with ***bold and italic*** text
@@ -118,56 +138,62 @@ def test_mixed_formatting_tags_with_lists_and_links():
 • This is a list item with <b>bold</b>, <u>underline</u>, and <a href="http://example.com">a link</a>
 • Another item with <b><i>bold and italic</i></b> text
 """
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output.strip() == expected_output.strip()
     ), "Failed handling mixed formatting tags with lists and links"
 
 
-def test_special_characters_within_code_blocks():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_special_characters_within_code_blocks(engine):
     input_text = "Here is a code block: ```<script>alert('Hello')</script>```"
     expected_output = "Here is a code block: <pre><code>&lt;script&gt;alert('Hello')&lt;/script&gt;</code></pre>"
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output == expected_output
     ), "Failed escaping special characters within code blocks"
 
 
-def test_code_block_within_bold_text():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_code_block_within_bold_text(engine):
     input_text = "This is **bold with a `code block` inside**."
     expected_output = "This is <b>bold with a <code>code block</code> inside</b>."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed handling code block within bold text"
 
 
-def test_triple_backticks_with_nested_markdown():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_triple_backticks_with_nested_markdown(engine):
     input_text = "```python\n**bold text** and __underline__ in code block```"
     expected_output = '<pre><code class="language-python">**bold text** and __underline__ in code block</code></pre>'
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output == expected_output
     ), "Failed handling markdown within triple backtick code blocks"
 
 
-def test_unmatched_code_delimiters():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_unmatched_code_delimiters(engine):
     input_text = "This has an `unmatched code delimiter."
     expected_output = "This has an <code>unmatched code delimiter.</code>"
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed handling unmatched code delimiters"
 
 
-def test_preformatted_block_with_unusual_language_specification():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_preformatted_block_with_unusual_language_specification(engine):
     input_text = "```weirdLang\nSome weirdLang code\n```"
     expected_output = (
         '<pre><code class="language-weirdLang">Some weirdLang code\n</code></pre>'
     )
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output == expected_output
     ), "Failed handling preformatted block with unusual language specification"
 
 
-def test_inline_code_within_lists():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_inline_code_within_lists(engine):
     input_text = """
 - List item with `code`
 * Another `code` item
@@ -176,13 +202,14 @@ def test_inline_code_within_lists():
 • List item with <code>code</code>
 • Another <code>code</code> item
 """
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output.strip() == expected_output.strip()
     ), "Failed handling inline code within lists"
 
 
-def test_vector_storage_links_trim():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_vector_storage_links_trim(engine):
     input_text = """
 - List item with `code`
 * Another `code` item【4:0†source】
@@ -191,66 +218,88 @@ def test_vector_storage_links_trim():
 • List item with <code>code</code>
 • Another <code>code</code> item
 """
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output.strip() == expected_output.strip(), "Failed trim storage links"
 
 
-def test_strikethrough_conversion():
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Check it out!【4†source】[docs](https://x.io)", 'Check it out<a href="https://x.io">docs</a>'),
+        ("[docs]【4†source】(https://x.io)", '<a href="https://x.io">docs</a>'),
+        ("[do【1】cs](https://x.io)【2】", '<a href="https://x.io">docs</a>'),
+        ("!【1】[👍](tg://emoji?id=5)", '<tg-emoji emoji-id="5">👍</tg-emoji>'),
+    ],
+)
+def test_citations_are_removed_before_links(text, expected, engine):
+    assert telegram_format(text, engine=engine) == expected
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_strikethrough_conversion(engine):
     input_text = "This is ~~strikethrough~~ text."
     expected_output = "This is <s>strikethrough</s> text."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed converting ~~ to <s> tags"
 
 
-def test_blockquote_conversion():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_blockquote_conversion(engine):
     input_text = "> This is a blockquote."
     expected_output = "<blockquote>This is a blockquote.</blockquote>"
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed converting > to <blockquote> tags"
 
 
-def test_inline_url_conversion():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_inline_url_conversion(engine):
     input_text = "[example](http://example.com)"
     expected_output = '<a href="http://example.com">example</a>'
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed converting [text](URL) to <a> tags"
 
 
-def test_inline_mention_conversion():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_inline_mention_conversion(engine):
     input_text = "[User](tg://user?id=123456789)"
     expected_output = '<a href="tg://user?id=123456789">User</a>'
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output == expected_output
     ), "Failed converting [text](tg://user?id=ID) to <a> tags"
 
 
-def test_escaping_ampersand():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_escaping_ampersand(engine):
     input_text = "Use & in your HTML."
     expected_output = "Use &amp; in your HTML."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed escaping & character"
 
 
-def test_pre_and_code_tags_with_html_entities():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_pre_and_code_tags_with_html_entities(engine):
     input_text = "```html\n<div>Content</div>\n```"
     expected_output = (
         '<pre><code class="language-html">&lt;div&gt;Content&lt;/div&gt;\n</code></pre>'
     )
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output == expected_output
     ), "Failed handling pre and code tags with HTML entities"
 
 
-def test_code_with_multiple_lines():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_code_with_multiple_lines(engine):
     input_text = "```\ndef example():\n    return 'example'\n```"
     expected_output = "<pre><code>def example():\n    return 'example'\n</code></pre>"
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed handling code with multiple lines"
 
 
-def test_combined_formatting_with_lists():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_combined_formatting_with_lists(engine):
     input_text = """
 - **Bold** list item
 - _Italic_ list item
@@ -261,13 +310,14 @@ def test_combined_formatting_with_lists():
 • <i>Italic</i> list item
 • <code>Code</code> list item
 """
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output.strip() == expected_output.strip()
     ), "Failed handling combined formatting with lists"
 
 
-def test_md_large_example():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_md_large_example(engine):
     input_text = """
 1. **Headings:**
 # H1 Heading
@@ -403,7 +453,7 @@ Here is some <code>inline code</code>.
 
 ---
 """
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output.strip() == expected_output.strip()
     ), "Failed handling large markdown example"
@@ -423,18 +473,65 @@ def test_unclosed_triple_backtick():
     assert result == "Here is some ```code without closing```"
 
 
-def test_bracket_link_with_additional_text():
+def test_extract_code_blocks_uses_match_positions():
+    text = "```\nx\n```\n\n```py\nx\n```\n\n```\nx\n```"
+    modified, blocks = extract_and_convert_code_blocks(text)
+    assert modified == (
+        "CODEBLOCKPLACEHOLDER_0_\n\nCODEBLOCKPLACEHOLDER_1_\n\nCODEBLOCKPLACEHOLDER_2_"
+    )
+    assert list(blocks.values()) == [
+        "<pre><code>x\n</code></pre>",
+        '<pre><code class="language-py">x\n</code></pre>',
+        "<pre><code>x\n</code></pre>",
+    ]
+    assert reinsert_code_blocks(modified, blocks) == (
+        "<pre><code>x\n</code></pre>\n\n"
+        '<pre><code class="language-py">x\n</code></pre>\n\n'
+        "<pre><code>x\n</code></pre>"
+    )
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_many_code_blocks_round_trip(engine):
+    snippets = [f"```python\nvalue_{i} = {i}\n```" for i in range(500)]
+    output = telegram_format("\n\n".join(snippets), engine=engine)
+    assert output.count("<pre><code") == 500
+    assert "PLACEHOLDER" not in output
+    assert output.index("value_10 ") < output.index("value_11 ")
+
+
+def test_scan_fences_reports_blocks_and_stray_backticks():
+    scan = scan_fences("````md\n```\n````\nstray \\` and `x`")
+    assert [(b.fence, b.language) for b in scan.blocks] == [("````", "md")]
+    assert scan.open_fence is None
+    assert scan.triple_backticks == 0
+    assert scan.unescaped_backticks == 2
+    # Inline code spans ignore escapes, like the pattern they replace.
+    assert [scan.text[a:b] for a, b in scan.inline_code(scan.blocks)] == ["` and `"]
+
+
+def test_scan_fences_extend_rematches_longer_closer():
+    scan = scan_fences("``````md\n`````\ncode")
+    assert scan.open_fence == "``````"
+    closed = scan.extend("\n``````")
+    assert closed.text == ensure_closing_delimiters("``````md\n`````\ncode")
+    assert [b.fence for b in closed.blocks] == ["``````"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_bracket_link_with_additional_text(engine):
     """
     Ensures that text like '[OtherText] [Title](Link)' doesn't
     merge 'OtherText' and 'Title' into the <a> tag text.
     """
     input_text = "[OtherText] [Title](https://example.com)"
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     expected_output = '[OtherText] <a href="https://example.com">Title</a>'
     assert output == expected_output, f"Output was: {output}"
 
 
-def test_heading_formatting_with_newlines():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_heading_formatting_with_newlines(engine):
     """
     Checks that headings #, ##, etc. are properly wrapped in <b> tags.
     """
@@ -443,7 +540,7 @@ Some text
 ## Heading2
 More text
 """
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     lines = output.splitlines()
 
     assert "<b>Heading1</b>" in output
@@ -454,7 +551,8 @@ More text
     assert lines[3] == "More text"
 
 
-def test_list_formatting_with_newlines():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_list_formatting_with_newlines(engine):
     """
     Checks that list items (starting with '-' or '*') become bullet points,
     each on its own line with proper spacing.
@@ -464,7 +562,7 @@ def test_list_formatting_with_newlines():
 * Item three
 Some text
 - Item four"""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     lines = [line.strip() for line in output.splitlines() if line.strip()]
 
     assert "• Item one" in lines
@@ -481,34 +579,38 @@ Some text
     assert bullet_lines[3] == "• Item four"
 
 
-def test_preserve_other_brackets():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_preserve_other_brackets(engine):
     """
     Ensures that other bracketed text not forming a valid link is preserved literally.
     """
     input_text = "Look at [this], but [not a link] something else."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert "[this]" in output
     assert "[not a link]" in output
     assert "<a href=" not in output
 
 
-def test_link_with_nested_brackets():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_link_with_nested_brackets(engine):
     """Test that links with nested brackets in the text are handled correctly"""
     input_text = "[Link [with brackets]](https://example.com)"
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     expected_output = '<a href="https://example.com">Link [with brackets]</a>'
     assert output == expected_output, f"Output was: {output}"
 
 
-def test_link_with_spaces():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_link_with_spaces(engine):
     """Test that links with spaces are handled correctly"""
     input_text = "[OtherText] [Title](Link)"
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     expected_output = '[OtherText] <a href="Link">Title</a>'
     assert output == expected_output, f"Output was: {output}"
 
 
-def test_ukrainian_bullet_points():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_ukrainian_bullet_points(engine):
     input_text = """Звісно, ось список цікавих речей у форматі Markdown:
 
 *  **Парадокс кота Шредінгера:** Чи може кіт бути одночасно живим і мертвим? 🤔
@@ -537,12 +639,13 @@ def test_ukrainian_bullet_points():
 • <b>Когнітивні спотворення:</b> Як наш мозок обманює нас? 🤯
 """
 
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     print(output)
     assert output.strip() == expected_output.strip()
 
 
-def test_asterisk_in_equations():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_asterisk_in_equations(engine):
     """Test that asterisks in mathematical equations are not converted to italic"""
     test_cases = [
         ("2 * 2 = 4", "2 * 2 = 4"),
@@ -554,13 +657,14 @@ def test_asterisk_in_equations():
     ]
 
     for input_text, expected_output in test_cases:
-        output = telegram_format(input_text)
+        output = telegram_format(input_text, engine=engine)
         assert (
             output == expected_output
         ), f"Failed on input: {input_text}, got: {output}"
 
 
-def test_complex_equations_with_asterisk():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_complex_equations_with_asterisk(engine):
     """Test more complex mathematical expressions with asterisks"""
     input_text = """The formula is:
 f(x) = 2*x + 3*y
@@ -572,7 +676,7 @@ f(x) = 2*x + 3*y
 g(x) = x * (y + z)
 This is <i>italic</i> text with equation 2 * 2 = 4"""
 
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output.strip() == expected_output.strip(), f"Output was: {output}"
 
 
@@ -581,38 +685,43 @@ This is <i>italic</i> text with equation 2 * 2 = 4"""
 # ----------------------------------------------------------------------------------------
 
 
-def test_empty_string():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_empty_string(engine):
     """Check behavior with an empty string."""
     input_text = ""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == ""
 
 
-def test_spaces_only():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_spaces_only(engine):
     """Check behavior with a string that has only spaces."""
     input_text = "    "
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     # Should either remain blank or just be those spaces (strip() might remove them)
     assert output.strip() == ""
 
 
-def test_asterisk_in_parentheses():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_asterisk_in_parentheses(engine):
     """Edge case with asterisk in parentheses."""
     input_text = "(2*3) is an equation, but *italic* text is separate."
     expected_output = "(2*3) is an equation, but <i>italic</i> text is separate."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output
 
 
-def test_underscore_in_non_italic_context():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_underscore_in_non_italic_context(engine):
     """Edge case with underscores that should not convert to italic."""
     input_text = "This_variable should remain, but _italic_ should convert."
     expected_output = "This_variable should remain, but <i>italic</i> should convert."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output
 
 
-def test_code_block_mixed_with_unescaped_html():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_code_block_mixed_with_unescaped_html(engine):
     """Ensure code block remains escaped but outside text is processed normally."""
     input_text = """
 Some <div>stuff</div> here.
@@ -627,27 +736,30 @@ Some &lt;div&gt;stuff&lt;/div&gt; here.
 </code></pre>
 More text with <i>italic</i>.
 """
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output.strip() == expected_output.strip()
 
 
-def test_equation_with_asterisks_and_italics_combined():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_equation_with_asterisks_and_italics_combined(engine):
     """More advanced check: combine equations and true italics side by side."""
     input_text = "2*x + 3*y = 10, and *italic* is separate."
     expected_output = "2*x + 3*y = 10, and <i>italic</i> is separate."
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output
 
 
-def test_inline_code_with_asterisk_and_underscore():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_inline_code_with_asterisk_and_underscore(engine):
     """Ensure that `*` and `_` inside inline code are not interpreted as markdown."""
     input_text = "Here is `code_with_*_asterisk` outside of `code_with__underscore__`"
     expected_output = "Here is <code>code_with_*_asterisk</code> outside of <code>code_with__underscore__</code>"
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output
 
 
-def test_heading_followed_by_equation():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_heading_followed_by_equation(engine):
     """Check heading usage right before an equation line."""
     input_text = """# MyHeading
 2*x + y = 4
@@ -655,42 +767,46 @@ def test_heading_followed_by_equation():
     # Heading should become <b>MyHeading</b>, equation line remains as is
     expected_output = """<b>MyHeading</b>
 2*x + y = 4"""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output.strip() == expected_output.strip(), f"Got: {output}"
 
 
-def test_spoiler_conversion():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_spoiler_conversion(engine):
     input_text = "This contains a ||spoiler|| text"
     expected_output = 'This contains a <span class="tg-spoiler">spoiler</span> text'
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output == expected_output
     ), 'Failed converting || to <span class="tg-spoiler"> tags'
 
 
-def test_spoiler_with_formatting():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_spoiler_with_formatting(engine):
     input_text = "This contains a ||*italic spoiler*|| text"
     expected_output = (
         'This contains a <span class="tg-spoiler"><i>italic spoiler</i></span> text'
     )
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output == expected_output
     ), "Failed converting nested formatting within spoiler tags"
 
 
-def test_expandable_blockquote_conversion():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_expandable_blockquote_conversion(engine):
     input_text = """**>The expandable block quotation started
 >Expandable block quotation continued
 >The last line of the expandable block quotation"""
     expected_output = """<blockquote expandable>The expandable block quotation started
 Expandable block quotation continued
 The last line of the expandable block quotation</blockquote>"""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed converting expandable blockquote"
 
 
-def test_regular_and_expandable_blockquotes():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_regular_and_expandable_blockquotes(engine):
     input_text = """>Regular blockquote
 >Regular blockquote continued
 
@@ -701,22 +817,24 @@ Regular blockquote continued</blockquote>
 
 <blockquote expandable>Expandable blockquote
 Expandable blockquote continued</blockquote>"""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert (
         output.strip() == expected_output.strip()
     ), "Failed handling mixed blockquote types"
 
 
-def test_blockquote_with_spoiler():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_blockquote_with_spoiler(engine):
     input_text = """>Regular blockquote with ||spoiler|| text
 >Continued"""
     expected_output = """<blockquote>Regular blockquote with <span class="tg-spoiler">spoiler</span> text
 Continued</blockquote>"""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed handling spoiler inside blockquote"
 
 
-def test_blockquote_lines_inside_code_block():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_blockquote_lines_inside_code_block(engine):
     input_text = """```text
 >** заголовок довгої цитати
 > рядок 2
@@ -732,11 +850,12 @@ def test_blockquote_lines_inside_code_block():
         '&gt; і ще хоч сто рядків\n'
         "</code></pre>"
     )
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, f"Got: {output}"
 
 
-def test_blockquote_double_asterisk_prefix():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_blockquote_double_asterisk_prefix(engine):
     input_text = """>** заголовок довгої цитати
 > рядок 2
 > рядок 3
@@ -747,28 +866,31 @@ def test_blockquote_double_asterisk_prefix():
 рядок 3
 рядок 4
 і ще хоч сто рядків</blockquote>"""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, f"Got: {output}"
 
 
-def test_multiple_spoilers():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_multiple_spoilers(engine):
     input_text = "First ||spoiler|| and then another ||spoiler with *italic*||"
     expected_output = 'First <span class="tg-spoiler">spoiler</span> and then another <span class="tg-spoiler">spoiler with <i>italic</i></span>'
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed handling multiple spoilers"
 
 
-def test_ukrainian_text_with_inline_code():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_ukrainian_text_with_inline_code(engine):
     """Test that Ukrainian text with inline code is properly formatted"""
     input_text = (
         """звісно, майстре тестування. ой та зрозуміло `<LAUGH>` що ти тут тестуєш."""
     )
     expected_output = """звісно, майстре тестування. ой та зрозуміло <code>&lt;LAUGH&gt;</code> що ти тут тестуєш."""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, f"Output was: {output}"
 
 
-def test_nested_code_fence_quadruple():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_code_fence_quadruple(engine):
     input_text = """````markdown
 ```python
 def hello_world():
@@ -779,14 +901,15 @@ def hello_world():
         "<pre><code class=\"language-markdown\">```python\n"
         "def hello_world():\n    print(\"Hello, World!\")\n```\n</code></pre>"
     )
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
     assert output == expected_output, show_output()
 
 
-def test_nested_code_fence_quadruple_no_lang():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_code_fence_quadruple_no_lang(engine):
     input_text = """````
 ```python
 print('hi')
@@ -795,14 +918,15 @@ print('hi')
     expected_output = (
         "<pre><code>```python\nprint('hi')\n```\n</code></pre>"
     )
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
     assert output == expected_output, show_output()
 
 
-def test_nested_code_fence_five_backticks():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_code_fence_five_backticks(engine):
     input_text = """`````markdown
 ````python
 print(1)
@@ -811,14 +935,15 @@ print(1)
     expected_output = (
         "<pre><code class=\"language-markdown\">````python\nprint(1)\n````\n</code></pre>"
     )
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
     assert output == expected_output, show_output()
 
 
-def test_nested_code_fence_five_backticks_with_inner_triple():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_code_fence_five_backticks_with_inner_triple(engine):
     input_text = """`````markdown
 ````python
 print("hello world ```")
@@ -828,14 +953,15 @@ print("hello world ```")
         "<pre><code class=\"language-markdown\">````python\n"
         "print(\"hello world ```\")\n````\n</code></pre>"
     )
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
     assert output == expected_output, show_output()
 
 
-def test_inline_code_placeholders_do_not_overlap():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_inline_code_placeholders_do_not_overlap(engine):
     input_text = """Службова нотатка для тесту.
 
 Коли ви запускаєте `alpha.run()`, система піднімає локальний клієнт.
@@ -885,7 +1011,7 @@ async def configure(base_url: str):
 
 Чи є питання щодо <code>hook.set()</code> чи <code>hook.clear()</code>?"""
 
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
 
     assert output == expected_output
     assert "<code>hook.set()</code>0" not in output
@@ -895,7 +1021,8 @@ async def configure(base_url: str):
     assert "<code>hook.set()</code>4" not in output
 
 
-def test_nested_code_fence_six_backticks():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_code_fence_six_backticks(engine):
     input_text = """``````markdown
 `````python
 print('hi')
@@ -905,14 +1032,15 @@ print('hi')
 print('hi')
 `````
 </code></pre>"""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
     assert output == expected_output, show_output()
 
 
-def test_nested_code_fence_plain_text():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_code_fence_plain_text(engine):
     input_text = """
 ````markdown
 ```
@@ -923,7 +1051,7 @@ hello
 hello
 ```
 </code></pre>"""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
@@ -933,7 +1061,8 @@ hello
 
 
 
-def test_expensive_nested_code_five_fence_plain_text():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_expensive_nested_code_five_fence_plain_text(engine):
     input_text = """
 `````markdown
 ````
@@ -947,13 +1076,14 @@ print("hello world ```")
 print("hello world ```")
 ```
 </code></pre>"""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
     assert output == expected_output, show_output()
 
-def test_another_expensive_nested_code_five_fence_plain_text():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_another_expensive_nested_code_five_fence_plain_text(engine):
     input_text = """`````markdown
 ````python
 print("hello world ```"')
@@ -964,13 +1094,14 @@ print("hello world ```"')
 print("hello world ```"')
 ```
 </code></pre>"""
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
     assert output == expected_output, show_output()
 
-def test_hard_level_nested_code_five_fence_plain_text():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_hard_level_nested_code_five_fence_plain_text(engine):
     input_text = """`````markdown
 ````python
 print("hello world ```"')
@@ -986,13 +1117,14 @@ print("hello world ```"')
 <pre><code class="language-python">print("Some another text")
 </code></pre>""" # But the code block is still closed correctly.
 
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
     assert output == expected_output, show_output()
 
-def test_hard_level_nested_code_five_fence_plain_text_2():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_hard_level_nested_code_five_fence_plain_text_2(engine):
     input_text = """`````markdown
 ````python
 print("hello world ```"')
@@ -1006,13 +1138,14 @@ print("hello world ```"')
 <pre><code class="language-python">print("Some another text")
 </code></pre>""" # But the code block is still closed correctly.
 
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
     assert output == expected_output, show_output()
 
-def test_some_new():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_some_new(engine):
     input_text = """
 ``````markdown
 `````
@@ -1026,31 +1159,34 @@ print("hello world ```")
 print("hello world ```")
 ```
 </code></pre>""" # But after closed correctly
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     def show_output():
       print(f"Expected was: \n\n{expected_output}\n\n")
       print(f"output was: \n\n{output}")
     assert output == expected_output, show_output()
 
-def test_inline_code_with_escaped_backtick_trailing_text():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_inline_code_with_escaped_backtick_trailing_text(engine):
     """Ensure inline code with escaped backtick does not gain an extra closing tick."""
     input_text = "Escaped \\*asterisks\\* and `code with \\` backtick`"
     expected_output = "Escaped \\*asterisks\\* and <code>code with \\</code> backtick`"
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output
 
 
-def test_custom_emoji_conversion():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_custom_emoji_conversion(engine):
     """Test that custom emoji markdown is converted to tg-emoji HTML tag."""
     input_text = "Hello ![❤️](tg://emoji?id=5226457415154701085) world"
     expected_output = 'Hello <tg-emoji emoji-id="5226457415154701085">❤️</tg-emoji> world'
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed converting custom emoji to <tg-emoji> tag"
 
 
-def test_custom_emoji_with_regular_link():
+@pytest.mark.parametrize("engine", ENGINES)
+def test_custom_emoji_with_regular_link(engine):
     """Test that custom emoji and regular links are both handled correctly."""
     input_text = "Emoji ![👍](tg://emoji?id=5368324170671202286) and [link](https://example.com)"
     expected_output = 'Emoji <tg-emoji emoji-id="5368324170671202286">👍</tg-emoji> and <a href="https://example.com">link</a>'
-    output = telegram_format(input_text)
+    output = telegram_format(input_text, engine=engine)
     assert output == expected_output, "Failed handling emoji and link together"
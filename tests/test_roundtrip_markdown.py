@@ -1,7 +1,16 @@
 
+import tracemalloc
+
 import pytest
 
-from chatgpt_md_converter import html_to_telegram_markdown, telegram_format
+from chatgpt_md_converter import (HtmlToMarkdownConverter,
+                                  html_to_telegram_markdown, telegram_format)
+from chatgpt_md_converter.html_markdown.escaping import post_process
+from chatgpt_md_converter.html_markdown.renderer import (
+    html_flat_tree_to_telegram_markdown, html_tree_to_telegram_markdown)
+from chatgpt_md_converter.html_markdown.tree import (FlatNode, Node,
+                                                     build_flat_tree,
+                                                     build_tree)
 from tests.fixtures.markdown_roundtrips import ROUND_TRIP_CASES
 
 
@@ -32,6 +41,99 @@ def test_markdown_html_markdown_cycle_is_idempotent(_case, markdown_input, _):
     assert html_first == html_third
 
 
+@pytest.mark.parametrize("_case, markdown_input, _", ROUND_TRIP_CASES)
+def test_event_renderer_matches_tree_renderer(_case, markdown_input, _):
+    html_text = telegram_format(markdown_input)
+    markdown = html_to_telegram_markdown(html_text)
+    assert markdown == html_tree_to_telegram_markdown(html_text)
+    assert markdown == html_flat_tree_to_telegram_markdown(html_text)
+
+
+@pytest.mark.parametrize(
+    "html_text",
+    [
+        "<b>bold <i>both</b> italic</i>",
+        "<pre>a<code class=\"language-py\">x</code></pre>",
+        "<code>`<b>x</b>`</code> <a>&amp;</a> <br/><i/>",
+        "<blockquote expandable><s>one\ntwo",
+    ],
+)
+def test_event_renderer_matches_tree_renderer_on_malformed_html(html_text):
+    markdown = html_to_telegram_markdown(html_text)
+    assert markdown == html_tree_to_telegram_markdown(html_text)
+    assert markdown == html_flat_tree_to_telegram_markdown(html_text)
+
+
+def test_deeply_nested_html_does_not_hit_recursion_limit():
+    html_text = "<b><i>" * 5000 + "x" + "</i></b>" * 5000
+    markdown = html_to_telegram_markdown(html_text)
+    assert markdown.startswith("**_**_") and markdown.count("x") == 1
+    assert html_tree_to_telegram_markdown(html_text) == markdown
+    assert html_flat_tree_to_telegram_markdown(html_text) == markdown
+
+
+@pytest.mark.parametrize(
+    "markdown, expected",
+    [
+        ("• one\n•\ttwo\n•\nthree", "- one\n- two\n- three"),
+        ("a\n\n\n\nb\n\r\n\nc  \n", "a\n\nb\n\n\nc"),
+        ("*x* and *y*z **b**\n\n\n*w*", "_x_ and *y*z **b**\n\n_w_"),
+        ("  \n\n• item\n", "- item"),
+    ],
+)
+def test_post_process(markdown, expected):
+    assert post_process(markdown) == expected
+
+
+def test_trees_use_plain_strings_for_text():
+    html_text = '<b>bold <a href="x">link</a></b> tail<i/>'
+    bold, tail, empty = build_tree(html_text)
+    assert isinstance(bold, Node) and not hasattr(bold, "__dict__")
+    assert bold.children[0] == "bold "
+    assert dict(bold.children[1].attrs) == {"href": "x"}
+    assert tail == " tail"
+    assert empty.tag == "i" and not empty.attrs and not empty.children
+
+    roots = build_flat_tree(html_text).roots()
+    assert isinstance(roots[0], FlatNode) and roots[0].tag == "b"
+    assert roots[0].children[1].children == ["link"]
+    assert roots[1] == " tail" and roots[2].tag == "i"
+
+
+@pytest.mark.parametrize("_case, markdown_input, expected_markdown", ROUND_TRIP_CASES)
+def test_converter_blocks_join_to_whole_conversion(_case, markdown_input, expected_markdown):
+    html_text = telegram_format(markdown_input)
+    converter = HtmlToMarkdownConverter()
+    blocks = []
+    for start in range(0, len(html_text), 7):
+        blocks += converter.feed(html_text[start:start + 7])
+    blocks += converter.close()
+    assert "".join(blocks) == expected_markdown
+
+
+def test_converter_yields_blocks_as_top_level_elements_close():
+    converter = HtmlToMarkdownConverter()
+    assert converter.feed("<b>one</b>\n<blockquote>two") == ["**one**"]
+    assert converter.feed("</blockquote>\n<i>three") == ["\n> two"]
+    assert converter.close() == ["\n_three_"]
+
+
+def test_converter_runs_in_bounded_memory():
+    chunk = "<b>bold</b> and <i>italic</i> &amp; text\n\n" * 100
+    converter = HtmlToMarkdownConverter()
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(20):
+            total += sum(len(block) for block in converter.feed(chunk))
+        total += sum(len(block) for block in converter.close())
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert total > 2000 * len("**bold** and _italic_ & text")
+    assert peak < len(chunk) * 10
+
+
 def test_html_to_markdown_expandable_blockquote():
     html_text = "<blockquote expandable>заголовок\nрядок 2\nрядок 3</blockquote>"
     expected_markdown = ">** заголовок\n> рядок 2\n> рядок 3"
@@ -1,9 +1,15 @@
 import re
+import tracemalloc
 
 import pytest
 
-from chatgpt_md_converter.html_splitter import (MIN_LENGTH,
-                                                split_html_for_telegram)
+from chatgpt_md_converter import (iter_split_html_for_telegram,
+                                  split_html_chunks_for_telegram,
+                                  split_markdown_for_telegram, telegram_format)
+from chatgpt_md_converter.html_splitter import (MIN_LENGTH, HTMLTagTracker,
+                                                _packing_tokens,
+                                                split_html_for_telegram,
+                                                split_pre_block)
 
 from . import html_examples
 
@@ -101,3 +107,273 @@ def test_split_html_trims_leading_newline_on_new_chunk():
     text = LONG_TEXT + "\n\n" + SHORT_TEXT
     chunks = split_html_for_telegram(text, max_length=500, trim_empty_leading_lines=True)
     assert chunks == [LONG_TEXT, SHORT_TEXT]
+
+
+def test_tag_tracker_counts_reopen_and_close_overhead():
+    tracker = HTMLTagTracker()
+    tracker.feed('<b><a href="https://x.io">link <i>x</i>')
+    fork = tracker.copy()
+    fork.feed("</a></b>")
+    assert tracker.open_tags_length == len(tracker.get_open_tags_html())
+    assert tracker.closing_tags_length == len(tracker.get_closing_tags_html())
+    assert tracker.get_closing_tags_html() == "</a></b>"
+    assert (fork.open_tags_length, fork.closing_tags_length) == (0, 0)
+
+
+def test_split_html_splits_large_input():
+    paragraph = "<b>bold <i>nested</i></b> text with <a href='https://x.io'>a link</a>\n"
+    text = paragraph * 8000
+    chunks = split_html_for_telegram(text)
+    assert sum(chunk.count("nested") for chunk in chunks) == 8000
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+
+
+def test_tag_tracker_reopens_bare_and_escaped_attributes():
+    tracker = HTMLTagTracker()
+    tracker.feed('<blockquote expandable><a href="https://x.io/?a=1&amp;b=&quot;2&quot;">')
+    assert tracker.get_open_tags_html() == (
+        '<blockquote expandable><a href="https://x.io/?a=1&amp;b=&quot;2&quot;">'
+    )
+    assert tracker.open_tags[0] == ("blockquote", [("expandable", None)])
+
+
+def test_tag_tracker_waits_for_tags_cut_between_feeds():
+    tracker = HTMLTagTracker()
+    tracker.feed('text <a href="https://x.io/a')
+    assert tracker.open_tags == []
+    tracker.feed('>b"><b/><!-- <i> -->')
+    assert tracker.open_tags == [("a", [("href", "https://x.io/a>b")])]
+
+
+def test_split_html_keeps_expandable_blockquote_bare():
+    text = "<blockquote expandable>" + "word " * 200 + "</blockquote>"
+    chunks = split_html_for_telegram(text, max_length=500)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.startswith("<blockquote expandable>")
+        assert chunk.endswith("</blockquote>")
+
+
+def test_iter_split_html_matches_list_and_yields_lazily():
+    for trim in (False, True):
+        assert list(
+            iter_split_html_for_telegram(html_examples.input_text, trim)
+        ) == split_html_for_telegram(html_examples.input_text, trim)
+
+    # The trailing block cannot be split, so the error shows where splitting got to.
+    text = ("<b>bold</b> " + "word " * 20 + "\n") * 100 + "<b>" * 300
+    chunks = iter_split_html_for_telegram(text, max_length=500)
+    assert next(chunks).startswith("<b>bold</b> word")
+    with pytest.raises(ValueError, match="only html tags"):
+        list(chunks)
+
+
+def test_iter_split_html_validates_max_length_eagerly():
+    with pytest.raises(ValueError):
+        iter_split_html_for_telegram("text", max_length=MIN_LENGTH - 1)
+
+
+def test_split_html_telegram_length_mode_counts_visible_utf16():
+    link = '<a href="https://example.com/a/very/long/path">x</a> '
+    text = link * 100
+    assert len(split_html_for_telegram(text, max_length=500)) > 1
+    assert split_html_for_telegram(text, max_length=500, length_mode="telegram") == [text]
+
+    # Each emoji is one character of HTML but two UTF-16 units in Telegram.
+    emoji = "😀 " * 400
+    chunks = split_html_for_telegram(emoji, max_length=500, length_mode="telegram")
+    assert all(len(chunk.encode("utf-16-le")) // 2 <= 500 for chunk in chunks)
+    assert "".join(chunks).split() == emoji.split()
+
+
+def test_tag_tracker_counts_visible_length_across_feeds():
+    tracker = HTMLTagTracker(count_visible=True)
+    tracker.feed('<b>a &amp; b</b> 😀 <a href="x')
+    tracker.feed('">y</a>')
+    assert tracker.visible_length == len("a & b") + len(" ") + 2 + len(" y")
+
+
+def test_split_html_rejects_unknown_length_mode():
+    with pytest.raises(ValueError):
+        split_html_for_telegram("text", length_mode="chars")
+
+
+def test_split_html_optimal_packing_uses_fewer_messages():
+    paragraph = "<b>Bold start.</b> " + "Some words in a sentence. " * 11 + "\n\n"
+    text = paragraph * 10
+    greedy = split_html_for_telegram(text, max_length=500)
+    optimal = split_html_for_telegram(text, max_length=500, packing="optimal")
+    assert len(optimal) < len(greedy)
+    assert all(len(chunk) <= 500 for chunk in optimal)
+    assert re.sub(r"<[^>]+>", "", "".join(optimal)) == re.sub(r"<[^>]+>", "", text)
+    # Messages end after a sentence, not in the middle of one.
+    assert all(chunk.rstrip().endswith((".", ".</b>")) for chunk in optimal)
+
+
+def test_split_html_optimal_packing_prefers_paragraph_breaks():
+    first = "<i>" + "alpha " * 50 + "</i>"
+    second = "beta " * 60
+    third = "gamma " * 20
+    text = f"{first}\n\n{second}\n\n{third}"
+    chunks = split_html_for_telegram(text, max_length=500, packing="optimal")
+    assert chunks == [f"{first}\n\n", f"{second}\n\n{third}"]
+
+
+@pytest.mark.parametrize("text, max_length", [
+    ("<pre>" + "A" * 10000 + "</pre>", 4096),
+    ('<pre><code class="language-py">' + "x" * 900 + "</code></pre>", 500),
+    ('<pre><code class="language-json">' + '{"key":"value","n":[1,2,3]},' * 450 + "</code></pre>", 4096),
+], ids=["pre", "code-with-language", "minified-json"])
+def test_split_html_optimal_packing_fills_messages_with_long_runs(text, max_length):
+    greedy = split_html_for_telegram(text, max_length=max_length)
+    optimal = split_html_for_telegram(text, max_length=max_length, packing="optimal")
+    assert len(optimal) <= len(greedy)
+    assert all(len(chunk) <= max_length for chunk in optimal)
+    assert re.sub(r"<[^>]+>", "", "".join(optimal)) == re.sub(r"<[^>]+>", "", text)
+
+
+def test_split_html_optimal_packing_falls_back_to_greedy():
+    # The tags leave less room than one step of the search, so only the
+    # greedy split succeeds.
+    text = "<b><i>" * 289 + "y" * 300
+    assert (split_html_for_telegram(text, packing="optimal")
+            == split_html_for_telegram(text))
+
+
+def test_split_html_rejects_unknown_packing():
+    with pytest.raises(ValueError):
+        split_html_for_telegram("text", packing="best")
+
+
+def test_split_pre_block_cuts_long_lines_outside_entities():
+    opening = '<pre><code class="language-json">'
+    content = '{"key":"a&amp;b"},' * 100
+    chunks = split_pre_block(f"{opening}{content}\nshort line\n</code></pre>", 500)
+    assert len(chunks) > 2
+    for chunk in chunks:
+        assert len(chunk) <= 500
+        assert chunk.startswith(opening) and chunk.endswith("</code></pre>")
+        body = chunk[len(opening):-len("</code></pre>")]
+        assert re.sub(r"&amp;", "", body).count("&") == 0
+    bodies = "".join(chunk[len(opening):-len("</code></pre>")] for chunk in chunks)
+    assert bodies == f"{content}\nshort line\n"
+
+    long_line = "x" * 1200
+    html_chunks = split_html_for_telegram(f"<pre>{long_line}</pre>", max_length=500)
+    assert all(c.startswith("<pre>") and c.endswith("</pre>") for c in html_chunks)
+    assert "".join(c[5:-6] for c in html_chunks) == long_line
+
+
+def test_packing_tokens_keep_entities_at_token_start_whole():
+    # At max_length=500 a long run is cut every 7 characters, shorter than the entity.
+    text = "&#128512;" * 20 + " &amp;" + "x" * 20
+    tokens = [token for token, _ in _packing_tokens(text, 500)]
+    assert "".join(tokens) == text
+    for token in tokens:
+        assert re.fullmatch(r"(?:[^&]|&#128512;|&amp;)*", token), token
+
+
+@pytest.mark.parametrize(
+    "text, baseline_count",
+    [
+        ('<pre><code class="language-py">a\n' + "y" * 1200 + "\nb\n</code></pre>", 3),
+        ("intro text\n<pre>short\n" + "z" * 700 + "\nend\n</pre>\nafter", 2),
+    ],
+    ids=["short-line-first", "text-before-block"],
+)
+def test_split_pre_block_fills_messages_before_cutting_long_lines(text, baseline_count):
+    # The message counts of the splitter before long lines were cut in place.
+    chunks = split_html_for_telegram(text, max_length=500)
+    assert len(chunks) <= baseline_count
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert "".join(re.sub(r"<[^>]+>", "", chunk) for chunk in chunks) == re.sub(r"<[^>]+>", "", text)
+
+
+def test_split_markdown_keeps_blocks_whole():
+    paragraph = "Some **bold** text with a [link](https://example.com/?a=1&b=2) and `code`."
+    code = "```python\nx = 1\n\ny = 2\n```"
+    markdown = "\n\n".join([paragraph] * 20 + [code] + [paragraph] * 20)
+    pieces = split_markdown_for_telegram(markdown, max_length=500)
+    assert len(pieces) > 2
+    assert any(code in piece for piece in pieces)
+    for piece in pieces:
+        assert len(telegram_format(piece)) <= 500
+    assert "\n\n".join(telegram_format(piece) for piece in pieces) == telegram_format(markdown)
+
+
+def test_split_markdown_does_not_cut_inside_spanning_formatting():
+    bold = "**" + "\n\n".join(["bold paragraph"] * 10) + "**"
+    markdown = "\n\n".join(["plain paragraph"] * 10 + [bold, "tail"])
+    pieces = split_markdown_for_telegram(markdown, max_length=100)
+    assert bold in pieces
+    assert split_markdown_for_telegram("  \n\n ") == []
+
+
+@pytest.mark.parametrize(
+    "markdown",
+    [
+        "Intro\n\n-\n\nnext para",
+        "# \n\nHeading text",
+        "**a\n\nb** c",
+        "see 【note\n\nstill note】 done\n\ntail",
+        "```py\ncode\n\n  ~~```x\n\nmore\n\nend",
+        "one `tick\n\ntwo\n\nthree",
+        "> quote\n>\n> more\n\nafter",
+    ],
+)
+@pytest.mark.parametrize("engine", ["regex", "tokenizer"])
+def test_split_markdown_pieces_join_to_whole_conversion(markdown, engine):
+    pieces = split_markdown_for_telegram(markdown, max_length=1)
+    joined = "\n\n".join(telegram_format(piece, engine=engine) for piece in pieces)
+    assert joined == telegram_format(markdown, engine=engine)
+
+
+def test_iter_split_html_streams_huge_block_in_bounded_memory():
+    # 10 MB with no line break: one block of tiny words cut across chunks.
+    text = "ab " * 3_400_000
+    tracemalloc.start()
+    try:
+        count = 0
+        for chunk in iter_split_html_for_telegram(text):
+            assert len(chunk) <= 4096
+            count += 1
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert count == -(-len(text) // 4096)
+    assert peak < 5 * 1024 * 1024
+
+
+def test_split_html_chunks_carry_metadata():
+    text = "<b>" + "bold &amp; 😀 words " * 60 + "</b>\n\n" + "plain text " * 40
+    chunks = split_html_chunks_for_telegram(text, max_length=500)
+    assert [chunk.html for chunk in chunks] == split_html_for_telegram(text, max_length=500)
+    assert chunks[0].reopened_tags == ""
+    assert chunks[1].reopened_tags == "<b>"
+    assert chunks[0].source_start == 0 and chunks[-1].source_end == len(text)
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert chunk.source_end == following.source_start
+    for chunk in chunks:
+        assert chunk.raw_length == len(chunk.html)
+        visible = re.sub(r"<[^>]+>", "", chunk.html).replace("&amp;", "&")
+        assert chunk.visible_length == len(visible.encode("utf-16-le")) // 2
+        body = chunk.html[len(chunk.reopened_tags):]
+        assert body.startswith(text[chunk.source_start:chunk.source_end])
+
+    # Reopened tags leave no room for the last tag, which is cut and sent as text.
+    code = '<pre><code class="language-py">'
+    text = (code * 2 + "<pre>" + code + "<pre>" * 2 + code + "<b><b><i><i>" + code
+            + "<b><b></i><b>" + code)
+    for chunk in chunks + split_html_chunks_for_telegram(text, max_length=500):
+        tracker = HTMLTagTracker(count_visible=True)
+        tracker.feed(chunk.html)
+        assert chunk.visible_length == tracker.visible_length
+
+
+def test_split_html_chunks_with_optimal_packing():
+    text = "<i>" + "Sentence with words. " * 80 + "</i>"
+    chunks = split_html_chunks_for_telegram(text, max_length=500, length_mode="telegram", packing="optimal")
+    assert [chunk.html for chunk in chunks] == split_html_for_telegram(
+        text, max_length=500, length_mode="telegram", packing="optimal")
+    assert all(chunk.visible_length <= 500 for chunk in chunks)
+    assert "".join(text[chunk.source_start:chunk.source_end] for chunk in chunks) == text
@@ -0,0 +1,99 @@
+import pytest
+
+from chatgpt_md_converter import (StreamingEntityFormatter,
+                                  StreamingTelegramFormatter, telegram_format,
+                                  telegram_format_entities)
+
+STREAMED_TEXT = """# Answer
+
+Here is some **bold** text and `inline code`.
+
+```python
+def greet():
+
+    print("hi")
+```
+
+> quoted
+> lines
+
+- item *one*
+- item _two_
+"""
+
+
+@pytest.mark.parametrize("engine", ["regex", "tokenizer"])
+@pytest.mark.parametrize("step", [1, 3, 17])
+def test_snapshots_match_full_render(engine, step):
+    formatter = StreamingTelegramFormatter(engine=engine)
+    for end in range(step, len(STREAMED_TEXT) + step, step):
+        formatter.feed(STREAMED_TEXT[end - step : end])
+        assert formatter.snapshot() == telegram_format(STREAMED_TEXT[:end])
+
+
+def test_finished_blocks_are_cached():
+    formatter = StreamingTelegramFormatter()
+    formatter.feed("First **paragraph**.\n\nSecond paragraph\n")
+    assert formatter.text == "\nSecond paragraph\n"
+    assert formatter.snapshot() == "First <b>paragraph</b>.\n\nSecond paragraph"
+
+
+def test_open_fence_is_not_cached():
+    formatter = StreamingTelegramFormatter()
+    formatter.feed("```\nline one\n\nline two\n")
+    assert formatter.text == "```\nline one\n\nline two\n"
+    assert formatter.snapshot() == "<pre><code>line one\n\nline two\n</code></pre>"
+
+
+def test_dangling_backtick_is_not_cached():
+    formatter = StreamingTelegramFormatter()
+    formatter.feed("a `b\n\nc` d\n")
+    assert formatter.snapshot() == telegram_format("a `b\n\nc` d\n")
+
+
+def test_unknown_engine_rejected():
+    with pytest.raises(ValueError):
+        StreamingTelegramFormatter(engine="nope")
+
+
+ENTITY_TEXT = """> quoted
+> lines
+
+Here is **bold** and `code`.
+
+```python
+x = 1
+
+y = 2
+```
+
+- item *one*
+- item _two_
+"""
+
+
+@pytest.mark.parametrize("step", [1, 4, 23])
+def test_entity_snapshots_match_full_parse(step):
+    formatter = StreamingEntityFormatter()
+    for end in range(step, len(ENTITY_TEXT) + step, step):
+        formatter.feed(ENTITY_TEXT[end - step : end])
+        assert formatter.snapshot() == telegram_format_entities(ENTITY_TEXT[:end])
+
+
+def test_entity_offsets_shift_in_utf16_units():
+    formatter = StreamingEntityFormatter()
+    formatter.feed("\U0001F600 **one**\n\n**two**\n")
+    assert formatter.text == "\n**two**\n"
+    text, entities = formatter.snapshot()
+    assert text == "\U0001F600 one\n\ntwo"
+    assert entities == [
+        {"type": "bold", "offset": 3, "length": 3},
+        {"type": "bold", "offset": 8, "length": 3},
+    ]
+
+
+def test_entity_open_fence_is_not_frozen():
+    formatter = StreamingEntityFormatter()
+    formatter.feed("```\na\n\nb\n")
+    assert formatter.text == "```\na\n\nb\n"
+    assert formatter.snapshot() == telegram_format_entities("```\na\n\nb\n")